@@ -8,15 +8,70 @@ from dotenv import load_dotenv
 import json
 import re
 from flask import send_file # For sending the file response
+from flask import g, has_request_context, stream_with_context, url_for
+from werkzeug.exceptions import HTTPException
+from werkzeug.security import safe_join
 import io
 import traceback
+import hashlib
+import math
+import copy
+import html
+from functools import lru_cache
+from collections import deque
+import cProfile
+import pstats
+import random
+import threading
+import time
+import uuid
+import hmac
+import secrets
+import mimetypes
+import gzip
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait, FIRST_COMPLETED, as_completed
+import click
 from xhtml2pdf import pisa
-from markdown import markdown
 from markdown_it import MarkdownIt
+from markdown_it.common.utils import escapeHtml
+import nh3
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime # For date handling if needed, though strings are simpler for DB
-from flask_jwt_extended import create_access_token, jwt_required, JWTManager, get_jwt_identity
+from datetime import datetime, timedelta # For date handling if needed, though strings are simpler for DB
+from flask_jwt_extended import create_access_token, jwt_required, JWTManager, get_jwt_identity, verify_jwt_in_request
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt.exceptions import PyJWTError
 from flask_bcrypt import Bcrypt
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import text, event, inspect
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.exc import IntegrityError
+
+# Optional fast JSON / brotli support (used automatically when installed)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+# Optional NumPy for the local extractive summarizer (SUMMARY_MODE=local)
+try:
+    import numpy as np
+except ImportError:
+    np = None
+# Optional fpdf2 for direct PDF drawing (PDF_ENGINE=fpdf)
+try:
+    from fpdf import FPDF, FPDF_VERSION
+    from fpdf.enums import XPos, YPos
+except ImportError:
+    FPDF = None
+# fpdf2 internals used only by the PDF font cache (see add_cached_font)
+try:
+    from fpdf.fonts import TTFFont, SubsetMap
+    from fontTools import ttLib
+except ImportError:
+    TTFFont = None
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -27,7 +82,8 @@ CORS(
         "origins": ["http://localhost:5173"]
         }
     },
-    allow_headers=["Authorization", "Content-Type"],
+    allow_headers=["Authorization", "Content-Type", "X-Profile-Token"],
+    expose_headers=["X-Profile-Id"],
     methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     supports_credentials=True
 )
@@ -44,27 +100,94 @@ if not GEMINI_API_KEY:
 if not YOUTUBE_API_KEY:
     raise ValueError("Missing YouTube API Key in .env file")
 
+# Optional endpoint overrides, e.g. to point at the fake services in bench/fake_services.py
+GEMINI_API_ENDPOINT = os.getenv('GEMINI_API_ENDPOINT')
+YOUTUBE_API_ENDPOINT = os.getenv('YOUTUBE_API_ENDPOINT')
+
 # --- Initialize Services ---
 # Configure Gemini client
-genai.configure(api_key=GEMINI_API_KEY)
-gemini_model = genai.GenerativeModel('gemini-2.5-flash') # Or 'gemini-pro'
+if GEMINI_API_ENDPOINT:
+    genai.configure(api_key=GEMINI_API_KEY, transport='rest', client_options={'api_endpoint': GEMINI_API_ENDPOINT})
+else:
+    genai.configure(api_key=GEMINI_API_KEY)
+GEMINI_MODEL_NAME = os.getenv('GEMINI_MODEL', 'gemini-2.5-flash') # Default for every artifact
+
+# --- Per-Artifact Model Routing ---
+# Each kind of generated artifact can get its own model, generation config and timeout:
+#   GEMINI_MODEL_<ARTIFACT>, GEMINI_MAX_TOKENS_<ARTIFACT>, GEMINI_TEMPERATURE_<ARTIFACT>,
+#   GEMINI_TIMEOUT_<ARTIFACT> (seconds), GEMINI_JSON_<ARTIFACT> (true/false)
+# where ARTIFACT is NOTES, SUMMARY, QUIZ, FLASHCARDS or CHAT. Unset values fall back to
+# GEMINI_MODEL_NAME and the API defaults.
+MODEL_ARTIFACTS = ('notes', 'summary', 'quiz', 'flashcards', 'chat')
+# JSON response mode makes the model return bare JSON, so the parsers never see prose or code fences
+JSON_ARTIFACTS = ('quiz', 'flashcards')
+
+def _optional_env(name, cast):
+    value = os.getenv(name)
+    return cast(value) if value not in (None, '') else None
+
+def load_model_route(artifact):
+    suffix = artifact.upper()
+    generation_config = {}
+    max_tokens = _optional_env(f'GEMINI_MAX_TOKENS_{suffix}', int)
+    if max_tokens:
+        generation_config['max_output_tokens'] = max_tokens
+    temperature = _optional_env(f'GEMINI_TEMPERATURE_{suffix}', float)
+    if temperature is not None:
+        generation_config['temperature'] = temperature
+    if os.getenv(f'GEMINI_JSON_{suffix}', str(artifact in JSON_ARTIFACTS)).lower() == 'true':
+        generation_config['response_mime_type'] = 'application/json'
+    return {
+        "model": os.getenv(f'GEMINI_MODEL_{suffix}', GEMINI_MODEL_NAME),
+        "generation_config": generation_config,
+        "timeout": _optional_env(f'GEMINI_TIMEOUT_{suffix}', float),
+    }
+
+MODEL_ROUTES = {artifact: load_model_route(artifact) for artifact in MODEL_ARTIFACTS}
+
+@lru_cache(maxsize=None)
+def get_gemini_model(model_name):
+    return genai.GenerativeModel(model_name)
+
+# Function to get the YouTube service. Building it parses the discovery document, so each
+# thread builds one once and reuses it (the underlying httplib2 client isn't thread-safe).
+_youtube_local = threading.local()
 
-# Function to build YouTube service (avoids building it globally)
 def get_youtube_service():
-    return build('youtube', 'v3', developerKey=YOUTUBE_API_KEY)
+    service = getattr(_youtube_local, 'service', None)
+    if service is None:
+        if YOUTUBE_API_ENDPOINT:
+            service = build('youtube', 'v3', developerKey=YOUTUBE_API_KEY, client_options={'api_endpoint': YOUTUBE_API_ENDPOINT})
+        else:
+            service = build('youtube', 'v3', developerKey=YOUTUBE_API_KEY)
+        _youtube_local.service = service
+    return service
 
 
 # --- Database Configuration ---
 # Define the base directory of the backend folder
 basedir = os.path.abspath(os.path.dirname(__file__))
-# Configure the SQLite database URI
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'study_plan.db')
+# Configure the SQLite database URI (DATABASE_URL overrides it, e.g. for a throwaway benchmark DB)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///' + os.path.join(basedir, 'study_plan.db'))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False # Disable modification tracking overhead
 
 # Initialize SQLAlchemy with the Flask app
 db = SQLAlchemy(app)
 
+# --- SQLite Connection Settings ---
+# SQLite leaves foreign keys off unless asked per connection; the models' ON DELETE CASCADE needs them.
+# Registered before anything touches db.engine, so every pooled connection, the first included, gets it.
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+with app.app_context():
+    event.listen(db.engine, 'connect', _set_sqlite_pragmas)
+
 # --- Initialize Extensions ---
+# bcrypt cost factor; raising it upgrades existing hashes transparently on their next login
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.getenv('BCRYPT_LOG_ROUNDS', '12'))
 bcrypt = Bcrypt(app) # For password hashing
 jwt = JWTManager(app) # For JWT handling
 
@@ -76,22 +199,239 @@ app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY", "your-super-secret-jw
 # Configure token expiration time (optional, default is 15 minutes)
 # app.config["JWT_ACCESS_TOKEN_EXPIRES"] = datetime.timedelta(hours=1)
 
+# --- Response Encoding ---
+# JSON: orjson (if installed, and JSON_BACKEND isn't 'stdlib') serializes responses and the
+# SavedSession JSON columns several times faster than the json module.
+JSON_BACKEND = os.getenv('JSON_BACKEND', 'orjson' if orjson else 'stdlib')
+USE_ORJSON = JSON_BACKEND == 'orjson' and orjson is not None
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson. Falls back to the stdlib for options orjson lacks."""
+    sort_keys = False # Sorting costs time and no client depends on key order
+
+    def dumps(self, obj, **kwargs):
+        if not USE_ORJSON or set(kwargs) - {'indent', 'separators', 'sort_keys'}:
+            return super().dumps(obj, **kwargs)
+        option = orjson.OPT_NON_STR_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if not USE_ORJSON or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+app.json = FastJSONProvider(app)
+
+def json_dumps(obj):
+    """Serializer for the JSON text columns (videos, quiz, flashcards) and NDJSON lines."""
+    return app.json.dumps(obj)
+
+def json_loads(s):
+    """Parser for the JSON text columns; raises json.JSONDecodeError (orjson's subclasses it) on bad input."""
+    return app.json.loads(s)
+
+# Compression: gzip (and brotli when installed) negotiated from Accept-Encoding for
+# compressible bodies of at least COMPRESS_MIN_SIZE bytes. PDFs/streams are left alone.
+COMPRESS_ENABLED = os.getenv('COMPRESS_ENABLED', 'true').lower() == 'true'
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))
+COMPRESS_GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', '6'))
+COMPRESS_BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', '4')) # Low qualities are fast enough per request
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/csv', 'text/plain', 'text/html', 'text/calendar',
+                          'application/javascript', 'text/css', 'image/svg+xml'}
+
+def choose_content_encoding(accept_encoding, candidates=None):
+    """
+    Picks 'br', 'gzip' or None from an Accept-Encoding header, honouring q-values (br wins ties).
+    `candidates` limits the choice (e.g. to the precompressed files that exist).
+    """
+    offered = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        q = 1.0
+        if params.strip().startswith('q='):
+            try: q = float(params.strip()[2:])
+            except ValueError: q = 0.0
+        offered[name.strip().lower()] = q
+    if candidates is None:
+        candidates = (['br'] if brotli is not None else []) + ['gzip']
+    if not candidates:
+        return None
+    wildcard = offered.get('*', 0.0)
+    scored = [(offered.get(name, wildcard), -i, name) for i, name in enumerate(candidates)]
+    best_q, _, best = max(scored)
+    return best if best_q > 0 else None
+
+def compress_body(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=COMPRESS_BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=COMPRESS_GZIP_LEVEL)
+
+def compress_response(response):
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    encoding = choose_content_encoding(request.headers.get('Accept-Encoding', ''))
+    if encoding is None:
+        return response
+    response.set_data(compress_body(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+if COMPRESS_ENABLED:
+    app.after_request(compress_response)
+
+# --- Password Hashing Pool ---
+# bcrypt is deliberately slow CPU work. Running it on a small dedicated pool caps how many
+# cores a login/registration storm can take from every other route; excess auth requests
+# wait for a slot (up to PASSWORD_HASH_QUEUE_TIMEOUT seconds) and then get a 503.
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', str(max((os.cpu_count() or 2) // 2, 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', str(PASSWORD_HASH_WORKERS * 8)))
+PASSWORD_HASH_QUEUE_TIMEOUT = float(os.getenv('PASSWORD_HASH_QUEUE_TIMEOUT', '10'))
+
+password_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash')
+_password_hash_slots = threading.BoundedSemaphore(PASSWORD_HASH_MAX_PENDING)
+
+class PasswordHashBusy(Exception):
+    """Raised when the hashing pool is saturated; routes answer 503 so clients retry later."""
+
+def run_password_job(func, *args):
+    """Runs a bcrypt call on the hashing pool and waits for its result."""
+    if not _password_hash_slots.acquire(timeout=PASSWORD_HASH_QUEUE_TIMEOUT):
+        raise PasswordHashBusy()
+    try:
+        future = password_hash_executor.submit(func, *args)
+    except BaseException:
+        _password_hash_slots.release()
+        raise
+    # The slot is freed when the job finishes (or is cancelled before it starts), not when we stop
+    # waiting: a bcrypt call that outlives the timeout still counts toward PASSWORD_HASH_MAX_PENDING
+    future.add_done_callback(lambda _: _password_hash_slots.release())
+    try:
+        return future.result(timeout=PASSWORD_HASH_QUEUE_TIMEOUT)
+    except FutureTimeoutError:
+        future.cancel()
+        raise PasswordHashBusy()
+
+def hash_password(password):
+    return run_password_job(bcrypt.generate_password_hash, password, app.config['BCRYPT_LOG_ROUNDS']).decode('utf-8')
+
+def verify_password(password_hash, password):
+    return run_password_job(bcrypt.check_password_hash, password_hash, password)
+
+def password_needs_rehash(password_hash):
+    """True if the stored hash used a different bcrypt cost factor than BCRYPT_LOG_ROUNDS."""
+    try:
+        return int(password_hash.split('$')[2]) != app.config['BCRYPT_LOG_ROUNDS']
+    except (IndexError, ValueError):
+        return True
+
+def password_busy_response():
+    response = jsonify({"msg": "Authentication is busy, please retry shortly"})
+    response.headers['Retry-After'] = '2'
+    return response, 503
+
+# --- Failed Login Throttling ---
+# Per username and client IP (unknown names are covered too): after LOGIN_MAX_FAILURES failures
+# within LOGIN_FAILURE_WINDOW seconds that pair is locked for LOGIN_LOCKOUT_SECONDS. Keying on the
+# IP as well means nobody can lock a user out of their account from elsewhere by guessing wrong.
+# Locked attempts are rejected before any bcrypt work is done. State is per process.
+LOGIN_MAX_FAILURES = int(os.getenv('LOGIN_MAX_FAILURES', '5'))
+LOGIN_FAILURE_WINDOW = float(os.getenv('LOGIN_FAILURE_WINDOW', '900'))
+LOGIN_LOCKOUT_SECONDS = float(os.getenv('LOGIN_LOCKOUT_SECONDS', '300'))
+
+_login_failures = {} # (username, client IP) -> {"count", "first_failure", "locked_until"}
+_login_failures_lock = threading.Lock()
+
+def login_throttle_key(username):
+    return (username, request.remote_addr)
+
+def login_retry_after(key):
+    """Seconds until this username/IP pair may try again, or 0 if it isn't locked."""
+    with _login_failures_lock:
+        entry = _login_failures.get(key)
+        if entry is None:
+            return 0
+        return max(entry["locked_until"] - time.time(), 0)
+
+def record_login_failure(key):
+    now = time.time()
+    with _login_failures_lock:
+        entry = _login_failures.get(key)
+        if entry is None or now - entry["first_failure"] > LOGIN_FAILURE_WINDOW:
+            entry = {"count": 0, "first_failure": now, "locked_until": 0}
+            _login_failures[key] = entry
+        entry["count"] += 1
+        if entry["count"] >= LOGIN_MAX_FAILURES:
+            entry["locked_until"] = now + LOGIN_LOCKOUT_SECONDS
+            entry["count"] = 0
+            entry["first_failure"] = now
+            print(f"Login locked for '{key[0]}' from {key[1]} for {LOGIN_LOCKOUT_SECONDS:.0f}s after repeated failures")
+        # Opportunistically drop stale entries so the table doesn't grow without bound
+        if len(_login_failures) > 10000:
+            cutoff = now - max(LOGIN_FAILURE_WINDOW, LOGIN_LOCKOUT_SECONDS)
+            for stale in [k for k, e in _login_failures.items() if e["first_failure"] < cutoff and e["locked_until"] < now]:
+                del _login_failures[stale]
+
+def clear_login_failures(key):
+    with _login_failures_lock:
+        _login_failures.pop(key, None)
+
 # --- Define Database Models ---
 
 class User(db.Model):
+    __table_args__ = {'sqlite_autoincrement': True} # Ids of deleted accounts are never reused
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     password_hash = db.Column(db.String(128), nullable=False) # Store hashed password
+    calendar_secret = db.Column(db.String(64), nullable=True) # Keys the calendar feed URL; reset to revoke it
 
     # Relationship to saved sessions (one-to-many)
     # 'lazy=True' means sessions are loaded only when accessed
     # 'cascade="all, delete-orphan"' means deleting a user deletes their sessions
-    sessions = db.relationship('SavedSession', backref='user', lazy=True, cascade="all, delete-orphan")
+    # 'passive_deletes=True' leaves that to the database's ON DELETE CASCADE instead of loading them all first
+    sessions = db.relationship('SavedSession', backref='user', lazy=True, cascade="all, delete-orphan", passive_deletes=True)
 
     def __repr__(self):
         return f'<User {self.username}>'
 
 
+# --- Shared Generated Content ---
+# Canonical notes/summary/videos for a normalized topic + generation parameters.
+# Many SavedSessions can point at one row; ref_count is maintained by DB triggers
+# (see ensure_content_store) and the row is dropped when the last session lets go,
+# unless it is pinned (pre-generated by the warm-cache command).
+class GeneratedContent(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    content_key = db.Column(db.String(64), unique=True, nullable=False) # sha256 of topic + params
+    topic = db.Column(db.String(200), nullable=False) # Normalized topic
+    notes = db.Column(db.Text, nullable=True)
+    summary = db.Column(db.Text, nullable=True)
+    youtube_videos = db.Column(db.Text, nullable=True) # Store as JSON string
+    # Quiz/flashcards for these notes, handed to sessions that don't have their own yet
+    quiz_questions = db.Column(db.Text, nullable=True) # Store as JSON string
+    flashcards = db.Column(db.Text, nullable=True) # Store as JSON string
+    # Sanitized HTML rendered from notes/summary at write time (see render_stored_html)
+    notes_html = db.Column(db.Text, nullable=True)
+    summary_html = db.Column(db.Text, nullable=True)
+    html_version = db.Column(db.Integer, nullable=True) # HTML_RENDERER_VERSION used for the HTML above
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    pinned = db.Column(db.Boolean, nullable=False, default=False) # Kept even with no sessions
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<GeneratedContent {self.id}: {self.topic} ({self.ref_count} refs)>'
+
+
 # --- NEW: SavedSession Model ---
 class SavedSession(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -101,17 +441,125 @@ class SavedSession(db.Model):
     youtube_videos = db.Column(db.Text, nullable=True) # Store as JSON string
     quiz_questions = db.Column(db.Text, nullable=True) # Store as JSON string
     flashcards = db.Column(db.Text, nullable=True) # Store as JSON string
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Sanitized HTML rendered from notes/summary at write time (see render_stored_html)
+    notes_html = db.Column(db.Text, nullable=True)
+    summary_html = db.Column(db.Text, nullable=True)
+    html_version = db.Column(db.Integer, nullable=True) # HTML_RENDERER_VERSION used for the HTML above
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True) # Indexed for the retention purge
     # Foreign Key to link to the User model
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    # Shared content this session reads notes/summary/videos from (NULL = session owns its own copy)
+    content_id = db.Column(db.Integer, db.ForeignKey('generated_content.id'), nullable=True, index=True)
+    content = db.relationship('GeneratedContent', lazy=True)
+
+    # --- Effective content (shared artifact or the session's own copy) ---
+    @property
+    def effective_notes(self):
+        return self.content_source.notes
+
+    @property
+    def effective_summary(self):
+        return self.content_source.summary
+
+    @property
+    def effective_youtube_videos(self):
+        return self.content_source.youtube_videos
+
+    @property
+    def content_source(self):
+        """
+        The row that actually holds this session's notes/summary (and their rendered HTML).
+        Falls back to the session's own columns if the shared row has gone missing (e.g. a
+        content_id left dangling by a race with the last-reference delete).
+        """
+        return self.content if self.content is not None else self
 
     def __repr__(self):
         return f'<SavedSession {self.id}: {self.topic} by User {self.user_id}>'
 
+# --- Markdown -> HTML Rendering ---
+# Notes and summaries are rendered once when written and stored next to the Markdown.
+# The parser is CommonMark plus the GFM tables and strikethrough, matching the
+# ReactMarkdown + remark-gfm renderer the frontend used before, so notes look the same.
+# Bump HTML_RENDERER_VERSION whenever the parser or sanitizing below change;
+# rows rendered by an older version are re-rendered the next time they're read.
+HTML_RENDERER_VERSION = 4
+# html=False escapes raw HTML in the Markdown source instead of passing it through
+notes_html_parser = MarkdownIt('commonmark', {'html': False}).enable(['table', 'strikethrough'])
+
+# The HTML is shown to everyone who opens a shared topic, so a remote image in model output
+# would let its host track them. Images are rendered as their alt text instead.
+def _render_image_as_alt_text(renderer, tokens, idx, options, env):
+    return escapeHtml(renderer.renderInlineAsText(tokens[idx].children, options, env))
+
+notes_html_parser.add_render_rule('image', _render_image_as_alt_text)
+# Allowlist for nh3: only the markup the parser above produces, and only plain web/mail links.
+# The HTML is inserted into the page as-is and shared across users, so everything else is dropped.
+HTML_ALLOWED_TAGS = {
+    'p', 'br', 'hr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'strong', 'em', 's', 'code', 'pre', 'blockquote',
+    'ul', 'ol', 'li', 'a', 'table', 'thead', 'tbody', 'tr', 'th', 'td',
+}
+HTML_ALLOWED_ATTRIBUTES = {
+    'a': {'href', 'title'},
+    'ol': {'start'},
+    'code': {'class'}, # language-xxx from fenced code
+    'th': {'style'},
+    'td': {'style'},
+}
+HTML_ALLOWED_URL_SCHEMES = {'http', 'https', 'mailto'}
+
+def sanitize_html(html):
+    """Runs rendered HTML through the allowlist above (entity-encoded or obfuscated schemes included)."""
+    return nh3.clean(html, tags=HTML_ALLOWED_TAGS, attributes=HTML_ALLOWED_ATTRIBUTES,
+                     url_schemes=HTML_ALLOWED_URL_SCHEMES, filter_style_properties={'text-align'})
+
+def render_markdown_html(markdown_text):
+    """Renders notes/summary Markdown to sanitized HTML."""
+    if not markdown_text:
+        return None
+    return sanitize_html(notes_html_parser.render(markdown_text))
+
+@lru_cache(maxsize=1024)
+def render_inline_markdown(markdown_text):
+    """Renders a short snippet (quiz question/answer) without the wrapping <p>. Cached: quizzes repeat."""
+    rendered = sanitize_html(notes_html_parser.render(markdown_text))
+    return rendered.replace('<p>', '').replace('</p>', '').strip()
+
+def render_stored_html(target):
+    """(Re)renders notes_html/summary_html on a SavedSession or GeneratedContent row."""
+    target.notes_html = render_markdown_html(target.notes)
+    target.summary_html = render_markdown_html(target.summary)
+    target.html_version = HTML_RENDERER_VERSION
+
+def ensure_html_current(target):
+    """Re-renders a row whose HTML is from an older renderer. Returns True if it changed."""
+    if target.html_version == HTML_RENDERER_VERSION:
+        return False
+    render_stored_html(target)
+    return True
+
+@event.listens_for(GeneratedContent, 'before_insert')
+@event.listens_for(SavedSession, 'before_insert')
+def _render_html_before_insert(mapper, connection, target):
+    render_stored_html(target)
+
+@event.listens_for(GeneratedContent, 'before_update')
+@event.listens_for(SavedSession, 'before_update')
+def _render_html_before_update(mapper, connection, target):
+    state = inspect(target)
+    source_changed = state.attrs.notes.history.has_changes() or state.attrs.summary.history.has_changes()
+    if source_changed or target.html_version != HTML_RENDERER_VERSION:
+        render_stored_html(target)
+
 # --- Update Database Creation ---
 with app.app_context():
     print("Checking/Creating database tables...")
-    db.create_all() # This will now create User, StudyPlanEntry, and SavedSession if they don't exist
+    # auto_vacuum can only be chosen before the first table exists, on the connection that creates it;
+    # older files are converted with `flask --app app enable-incremental-vacuum`
+    with db.engine.begin() as conn:
+        if conn.exec_driver_sql("SELECT count(*) FROM sqlite_master").scalar() == 0:
+            conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        db.metadata.create_all(bind=conn) # This will now create User, StudyPlanEntry, and SavedSession if they don't exist
     print("Database tables checked/created.")
 
 # --- Define Database Model ---
@@ -119,11 +567,31 @@ class StudyPlanEntry(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     topic = db.Column(db.String(200), nullable=False)
     review_date = db.Column(db.String(10), nullable=False) # Store date as YYYY-MM-DD string
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    # Both set by triggers on every insert/update (see Study Plan Revisions)
+    revision = db.Column(db.Integer)
+    updated_at = db.Column(db.DateTime)
+
+    __table_args__ = (db.Index('ix_study_plan_entry_user_revision', 'user_id', 'revision'),)
 
     def __repr__(self):
         return f'<StudyPlanEntry {self.id}: {self.topic} on {self.review_date}>'
 
+class StudyPlanTombstone(db.Model):
+    """A deleted StudyPlanEntry, kept so delta sync can tell clients to drop it."""
+    id = db.Column(db.Integer, primary_key=True)
+    entry_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False) # No FK: rows are written while the user may be going away
+    revision = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (db.Index('ix_study_plan_tombstone_user_revision', 'user_id', 'revision'),)
+
+class SyncCounter(db.Model):
+    """Monotonic counters handed out by triggers (e.g. study-plan revisions)."""
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
 # --- Create Database Tables (Run Once) ---
 # This context ensures the app context is available for db operations
 with app.app_context():
@@ -139,14 +607,757 @@ with app.app_context():
          db.create_all()
          print("Database tables checked/ensured.")
 
+
+# --- Lightweight Schema Upgrades ---
+# db.create_all() never alters existing tables, so columns added to models later
+# are appended here for databases created by older versions of the app.
+SCHEMA_UPGRADES = {
+    'user': [
+        ('calendar_secret', 'VARCHAR(64)'),
+    ],
+    'saved_session': [
+        ('content_id', 'INTEGER REFERENCES generated_content (id)'),
+        ('notes_html', 'TEXT'),
+        ('summary_html', 'TEXT'),
+        ('html_version', 'INTEGER'),
+    ],
+    'generated_content': [
+        ('notes_html', 'TEXT'),
+        ('summary_html', 'TEXT'),
+        ('html_version', 'INTEGER'),
+        ('quiz_questions', 'TEXT'),
+        ('flashcards', 'TEXT'),
+        ('pinned', 'BOOLEAN NOT NULL DEFAULT 0'),
+    ],
+    'study_plan_entry': [
+        ('revision', 'INTEGER'),
+        ('updated_at', 'DATETIME'),
+    ],
+}
+
+def add_missing_columns():
+    with db.engine.begin() as conn:
+        for table, columns in SCHEMA_UPGRADES.items():
+            existing = {row[1] for row in conn.execute(text(f"PRAGMA table_info({table})"))}
+            for column, ddl in columns:
+                if column not in existing:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+                    print(f"Added column {table}.{column}")
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_saved_session_content_id ON saved_session (content_id)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_saved_session_created_at ON saved_session (created_at)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_study_plan_entry_user_revision ON study_plan_entry (user_id, revision)"))
+
+# --- Cascading Deletes ---
+# User-owned rows reference user.id with ON DELETE CASCADE, so deleting an account is a single
+# DELETE in the database instead of the ORM loading every session first. SQLite can't alter a
+# constraint in place, so tables from older versions are rebuilt once (before the triggers on
+# them are recreated below). Rows whose user no longer exists are deleted first, with an
+# ordinary DELETE, so the existing triggers update the search index and shared-content ref counts.
+# The user table itself is rebuilt with AUTOINCREMENT, so a deleted account's id (which old JWTs
+# and calendar links carry) is never handed to a new account.
+CASCADE_TABLES = ('saved_session', 'study_plan_entry')
+
+def rebuild_table(conn, name):
+    """Recreates a table from its current model definition, keeping its rows. Foreign keys must be off."""
+    table = db.metadata.tables[name]
+    old_columns = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({name})")}
+    columns = ", ".join(column.name for column in table.columns if column.name in old_columns)
+    create_sql = str(CreateTable(table).compile(db.engine)).replace(f"CREATE TABLE {name} ", f"CREATE TABLE {name}_rebuild ", 1)
+    conn.exec_driver_sql(f"DROP TABLE IF EXISTS {name}_rebuild")
+    conn.exec_driver_sql(create_sql)
+    conn.exec_driver_sql(f"INSERT INTO {name}_rebuild ({columns}) SELECT {columns} FROM {name}")
+    conn.exec_driver_sql(f"DROP TABLE {name}")
+    # Triggers on other tables that mention this one would otherwise make the rename fail
+    conn.exec_driver_sql("PRAGMA legacy_alter_table=ON")
+    conn.exec_driver_sql(f'ALTER TABLE {name}_rebuild RENAME TO "{name}"')
+    conn.exec_driver_sql("PRAGMA legacy_alter_table=OFF")
+    for index in table.indexes:
+        index.create(conn, checkfirst=True)
+
+def ensure_cascading_foreign_keys():
+    with db.engine.connect() as conn:
+        pending = [
+            name for name in CASCADE_TABLES
+            if any(row[2] == 'user' and row[6].upper() != 'CASCADE'
+                   for row in conn.exec_driver_sql(f"PRAGMA foreign_key_list({name})"))
+        ]
+        user_sql = conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'user'").scalar()
+        rebuild_user = 'AUTOINCREMENT' not in (user_sql or '').upper()
+        if not pending and not rebuild_user:
+            return
+        for name in pending:
+            orphans = conn.exec_driver_sql(f"DELETE FROM {name} WHERE user_id NOT IN (SELECT id FROM user)").rowcount
+            if orphans:
+                print(f"Deleted {orphans} {name} rows whose user no longer exists")
+        conn.commit() # PRAGMA foreign_keys is ignored inside a transaction
+        conn.exec_driver_sql("PRAGMA foreign_keys=OFF")
+        if rebuild_user:
+            rebuild_table(conn, 'user')
+            print("Rebuilt table user with AUTOINCREMENT ids")
+        for name in pending:
+            rebuild_table(conn, name)
+            print(f"Rebuilt table {name} with ON DELETE CASCADE")
+        conn.commit()
+        conn.exec_driver_sql("PRAGMA foreign_keys=ON")
+
+
+# --- Shared Content Reference Counting ---
+# Triggers keep generated_content.ref_count equal to the number of sessions pointing at it,
+# whichever path inserts, re-points or deletes a session.
+CONTENT_STORE_DDL = [
+    # Triggers are recreated on startup so changes to their bodies take effect
+    "DROP TRIGGER IF EXISTS saved_session_content_ad",
+    "DROP TRIGGER IF EXISTS saved_session_content_au",
+    """
+    CREATE TRIGGER IF NOT EXISTS saved_session_content_ai
+    AFTER INSERT ON saved_session WHEN new.content_id IS NOT NULL BEGIN
+        UPDATE generated_content SET ref_count = ref_count + 1 WHERE id = new.content_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS saved_session_content_ad
+    AFTER DELETE ON saved_session WHEN old.content_id IS NOT NULL BEGIN
+        UPDATE generated_content SET ref_count = ref_count - 1 WHERE id = old.content_id;
+        DELETE FROM generated_content WHERE id = old.content_id AND ref_count <= 0 AND NOT pinned;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS saved_session_content_au
+    AFTER UPDATE OF content_id ON saved_session
+    WHEN old.content_id IS NOT new.content_id BEGIN
+        UPDATE generated_content SET ref_count = ref_count + 1 WHERE id = new.content_id;
+        UPDATE generated_content SET ref_count = ref_count - 1 WHERE id = old.content_id;
+        DELETE FROM generated_content WHERE id = old.content_id AND ref_count <= 0 AND NOT pinned;
+    END
+    """,
+]
+
+def ensure_content_store():
+    with db.engine.begin() as conn:
+        for statement in CONTENT_STORE_DDL:
+            conn.execute(text(statement))
+
+
+# --- Study Plan Revisions ---
+# Every insert, edit and delete of a study-plan entry takes the next value of the 'study_plan'
+# counter as its revision. Deletes leave a tombstone. GET /api/study-plan?since=<revision>
+# can then return just the entries changed and ids deleted after that point. Triggers do the
+# bookkeeping, so the single-entry routes, batch route and retention purge all stay in step.
+PLAN_REVISION_COUNTER = 'study_plan'
+PLAN_TOMBSTONE_FLOOR = 'study_plan_tombstone_floor' # Highest revision whose tombstone was purged
+
+_NEXT_PLAN_REVISION_SQL = f"(SELECT value FROM sync_counter WHERE name = '{PLAN_REVISION_COUNTER}')"
+_BUMP_PLAN_REVISION_SQL = f"UPDATE sync_counter SET value = value + 1 WHERE name = '{PLAN_REVISION_COUNTER}';"
+
+PLAN_REVISION_DDL = [
+    f"INSERT OR IGNORE INTO sync_counter (name, value) VALUES ('{PLAN_REVISION_COUNTER}', 0)",
+    # Rows from before revisions existed
+    f"""
+    UPDATE study_plan_entry SET revision = {_NEXT_PLAN_REVISION_SQL} + id, updated_at = coalesce(updated_at, CURRENT_TIMESTAMP)
+    WHERE revision IS NULL
+    """,
+    f"""
+    UPDATE sync_counter SET value = max(value,
+        (SELECT coalesce(max(revision), 0) FROM study_plan_entry),
+        (SELECT coalesce(max(revision), 0) FROM study_plan_tombstone))
+    WHERE name = '{PLAN_REVISION_COUNTER}'
+    """,
+    # Triggers are recreated on startup so changes to their bodies take effect
+    "DROP TRIGGER IF EXISTS study_plan_entry_revision_ai",
+    "DROP TRIGGER IF EXISTS study_plan_entry_revision_au",
+    "DROP TRIGGER IF EXISTS study_plan_entry_revision_ad",
+    f"""
+    CREATE TRIGGER study_plan_entry_revision_ai AFTER INSERT ON study_plan_entry BEGIN
+        {_BUMP_PLAN_REVISION_SQL}
+        UPDATE study_plan_entry SET revision = {_NEXT_PLAN_REVISION_SQL}, updated_at = CURRENT_TIMESTAMP WHERE id = new.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER study_plan_entry_revision_au AFTER UPDATE OF topic, review_date ON study_plan_entry BEGIN
+        {_BUMP_PLAN_REVISION_SQL}
+        UPDATE study_plan_entry SET revision = {_NEXT_PLAN_REVISION_SQL}, updated_at = CURRENT_TIMESTAMP WHERE id = new.id;
+    END
+    """,
+    # No tombstone when the whole account is being deleted (cascade): nobody is left to sync it
+    f"""
+    CREATE TRIGGER study_plan_entry_revision_ad AFTER DELETE ON study_plan_entry
+    WHEN EXISTS (SELECT 1 FROM user WHERE id = old.user_id) BEGIN
+        {_BUMP_PLAN_REVISION_SQL}
+        INSERT INTO study_plan_tombstone (entry_id, user_id, revision, deleted_at)
+        VALUES (old.id, old.user_id, {_NEXT_PLAN_REVISION_SQL}, CURRENT_TIMESTAMP);
+    END
+    """,
+]
+
+def ensure_plan_revisions():
+    with db.engine.begin() as conn:
+        for statement in PLAN_REVISION_DDL:
+            conn.execute(text(statement))
+
+def current_plan_revision(user_id):
+    """Latest revision among the user's entries and tombstones (0 if they have none)."""
+    return db.session.execute(text("""
+        SELECT max(coalesce((SELECT max(revision) FROM study_plan_entry WHERE user_id = :user_id), 0),
+                   coalesce((SELECT max(revision) FROM study_plan_tombstone WHERE user_id = :user_id), 0))
+    """), {"user_id": user_id}).scalar()
+
+
+with app.app_context():
+    add_missing_columns()
+    ensure_cascading_foreign_keys()
+    ensure_content_store()
+    ensure_plan_revisions()
+
+# --- Full-Text Search Index (SQLite FTS5) ---
+# Mirror of SavedSession's searchable text, kept in sync by triggers, so every
+# write path (ORM, raw SQL, bulk deletes) updates the index without extra code.
+# 'owner' holds the user id and is the LAST column so snippet() prefers content columns.
+SEARCH_INDEX_TABLE = 'saved_session_fts'
+
+# Flashcards are stored as a JSON string; pull out just the terms for indexing
+_FLASHCARD_TERMS_SQL = (
+    "(SELECT group_concat(json_extract(value, '$.term'), ' ') "
+    "FROM json_each(CASE WHEN json_valid({col}) THEN {col} ELSE '[]' END))"
+)
+
+# Sessions backed by shared content have NULL notes/summary; index the shared text instead
+_EFFECTIVE_COLUMN_SQL = (
+    "(CASE WHEN {row}.content_id IS NULL THEN {row}.{col} "
+    "ELSE (SELECT {col} FROM generated_content WHERE id = {row}.content_id) END)"
+)
+
+def _indexed_values_sql(row):
+    """SQL for the (topic, notes, summary, flashcard_terms, owner) values of a saved_session row."""
+    return ", ".join([
+        f"{row}.topic",
+        _EFFECTIVE_COLUMN_SQL.format(row=row, col='notes'),
+        _EFFECTIVE_COLUMN_SQL.format(row=row, col='summary'),
+        _FLASHCARD_TERMS_SQL.format(col=f'{row}.flashcards'),
+        f"{row}.user_id",
+    ])
+
+SEARCH_INDEX_DDL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_INDEX_TABLE} USING fts5(
+        topic, notes, summary, flashcard_terms, owner,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    # Triggers are recreated on startup so changes to the indexed expressions take effect
+    "DROP TRIGGER IF EXISTS saved_session_fts_ai",
+    "DROP TRIGGER IF EXISTS saved_session_fts_au",
+    f"""
+    CREATE TRIGGER IF NOT EXISTS saved_session_fts_ai AFTER INSERT ON saved_session BEGIN
+        INSERT INTO {SEARCH_INDEX_TABLE} (rowid, topic, notes, summary, flashcard_terms, owner)
+        VALUES (new.id, {_indexed_values_sql('new')});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS saved_session_fts_ad AFTER DELETE ON saved_session BEGIN
+        DELETE FROM {SEARCH_INDEX_TABLE} WHERE rowid = old.id;
+    END
+    """,
+    # Only re-index when searchable columns change (quiz updates don't touch the index)
+    f"""
+    CREATE TRIGGER IF NOT EXISTS saved_session_fts_au
+    AFTER UPDATE OF topic, notes, summary, flashcards, user_id, content_id ON saved_session BEGIN
+        DELETE FROM {SEARCH_INDEX_TABLE} WHERE rowid = old.id;
+        INSERT INTO {SEARCH_INDEX_TABLE} (rowid, topic, notes, summary, flashcard_terms, owner)
+        VALUES (new.id, {_indexed_values_sql('new')});
+    END
+    """,
+]
+
+
+def ensure_search_index():
+    """Creates the FTS5 table and its sync triggers if they don't exist yet."""
+    with db.engine.begin() as conn:
+        for statement in SEARCH_INDEX_DDL:
+            conn.execute(text(statement))
+
+
+def rebuild_search_index():
+    """Repopulates the FTS5 index from every SavedSession row. Returns the number of rows indexed."""
+    with db.engine.begin() as conn:
+        conn.execute(text(f"DELETE FROM {SEARCH_INDEX_TABLE}"))
+        conn.execute(text(f"""
+            INSERT INTO {SEARCH_INDEX_TABLE} (rowid, topic, notes, summary, flashcard_terms, owner)
+            SELECT id, {_indexed_values_sql('saved_session')}
+            FROM saved_session
+        """))
+        # Merge index segments so lookups stay fast after a bulk load
+        conn.execute(text(f"INSERT INTO {SEARCH_INDEX_TABLE} ({SEARCH_INDEX_TABLE}) VALUES ('optimize')"))
+        return conn.execute(text(f"SELECT count(*) FROM {SEARCH_INDEX_TABLE}")).scalar()
+
+
+def build_fts_query(raw_query, user_id):
+    """
+    Turns free text from the user into a safe FTS5 MATCH expression.
+    Every word is quoted (so FTS5 operators in user input are inert), words are ANDed,
+    the last word is prefix-matched, and results are restricted to the user's own rows.
+    Returns None if the query has no searchable words.
+    """
+    words = re.findall(r'\w+', raw_query or '')
+    if not words:
+        return None
+    phrases = [f'"{w}"' for w in words[:-1]] + [f'"{words[-1]}"*']
+    return f'owner:"{user_id}" AND {{topic notes summary flashcard_terms}} : ({" ".join(phrases)})'
+
+
+# FTS5 can't escape the text around its highlight markers, so highlight with control
+# characters first, HTML-escape the result, then swap in real <mark> tags.
+SEARCH_MARK_OPEN, SEARCH_MARK_CLOSE = '\x02', '\x03'
+
+def render_search_highlight(fragment):
+    """HTML-escapes a snippet()/highlight() fragment and wraps matches in <mark> tags."""
+    if fragment is None:
+        return None
+    return (html.escape(fragment)
+            .replace(SEARCH_MARK_OPEN, '<mark>')
+            .replace(SEARCH_MARK_CLOSE, '</mark>'))
+
+
+with app.app_context():
+    ensure_search_index()
+    print("Search index checked/ensured.")
+
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Rebuilds the session full-text search index from existing data."""
+    count = rebuild_search_index()
+    print(f"Search index rebuilt: {count} sessions indexed.")
+
+# --- Data Retention & Incremental Vacuum ---
+# `flask --app app purge-old-data` deletes sessions created, and study-plan entries scheduled,
+# more than N days ago. It works in small batches, each in its own short transaction with a
+# pause in between, so live requests can take the write lock between batches. Triggers keep the
+# search index and shared-content ref counts in step. Freed pages are then handed back to the
+# filesystem a few at a time with PRAGMA incremental_vacuum.
+RETENTION_SESSION_DAYS = int(os.getenv('RETENTION_SESSION_DAYS', '0')) # 0 = keep forever
+RETENTION_PLAN_DAYS = int(os.getenv('RETENTION_PLAN_DAYS', '0'))
+RETENTION_TOMBSTONE_DAYS = int(os.getenv('RETENTION_TOMBSTONE_DAYS', '90')) # Deleted study-plan ids kept for delta sync
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', '500'))
+RETENTION_BATCH_PAUSE = float(os.getenv('RETENTION_BATCH_PAUSE', '0.05')) # Seconds between batches
+VACUUM_PAGES_PER_STEP = int(os.getenv('VACUUM_PAGES_PER_STEP', '1000'))
+
+def incremental_vacuum_enabled():
+    with db.engine.connect() as conn:
+        return conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2
+
+def enable_incremental_vacuum():
+    """
+    Switches a database created without auto_vacuum to INCREMENTAL. This needs one full VACUUM,
+    which rewrites the file and locks out every other connection while it runs.
+    Returns False if the database was already converted.
+    """
+    with db.engine.connect() as conn:
+        if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2:
+            return False
+        conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.exec_driver_sql("VACUUM")
+    return True
+
+def purge_in_batches(table, where_sql, params, batch_size=RETENTION_BATCH_SIZE, pause=RETENTION_BATCH_PAUSE):
+    """Deletes matching rows `batch_size` at a time. Returns the number of rows deleted."""
+    total = 0
+    while True:
+        with db.engine.begin() as conn:
+            deleted = conn.execute(text(
+                f"DELETE FROM {table} WHERE id IN (SELECT id FROM {table} WHERE {where_sql} LIMIT :batch_size)"
+            ), {**params, "batch_size": batch_size}).rowcount
+        total += deleted
+        if deleted < batch_size:
+            return total
+        time.sleep(pause)
+
+def incremental_vacuum(pages_per_step=VACUUM_PAGES_PER_STEP, pause=RETENTION_BATCH_PAUSE):
+    """Returns free pages to the filesystem in small steps. Returns the number of pages released."""
+    released = 0
+    while True:
+        with db.engine.connect() as conn:
+            if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+                return released
+            free_pages = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+            if not free_pages:
+                return released
+            # The sqlite3 driver steps a PRAGMA only once and each step frees one page, so run it
+            # page by page inside one explicit transaction
+            conn.exec_driver_sql("BEGIN")
+            for _ in range(min(pages_per_step, free_pages)):
+                conn.exec_driver_sql("PRAGMA incremental_vacuum(1)")
+            conn.commit()
+            remaining = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+        if remaining >= free_pages:
+            return released
+        released += free_pages - remaining
+        time.sleep(pause)
+
+def purge_plan_tombstones(days, batch_size=RETENTION_BATCH_SIZE, pause=RETENTION_BATCH_PAUSE):
+    """
+    Deletes study-plan tombstones older than `days`. The floor counter is raised first, so a
+    client that synced before the newest purged tombstone gets a full list instead of a delta.
+    """
+    cutoff = (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+    with db.engine.begin() as conn:
+        conn.execute(text("INSERT OR IGNORE INTO sync_counter (name, value) VALUES (:name, 0)"), {"name": PLAN_TOMBSTONE_FLOOR})
+        conn.execute(text("""
+            UPDATE sync_counter SET value = max(value,
+                (SELECT coalesce(max(revision), 0) FROM study_plan_tombstone WHERE deleted_at < :cutoff))
+            WHERE name = :name
+        """), {"name": PLAN_TOMBSTONE_FLOOR, "cutoff": cutoff})
+    return purge_in_batches('study_plan_tombstone', "deleted_at < :cutoff", {"cutoff": cutoff}, batch_size, pause)
+
+def purge_old_data(session_days=RETENTION_SESSION_DAYS, plan_days=RETENTION_PLAN_DAYS,
+                   batch_size=RETENTION_BATCH_SIZE, pause=RETENTION_BATCH_PAUSE, tombstone_days=RETENTION_TOMBSTONE_DAYS):
+    """Purges old sessions/study-plan entries/tombstones (0 days = keep) and vacuums. Returns counts."""
+    counts = {"sessions": 0, "study_plan_entries": 0, "tombstones": 0, "pages_released": 0}
+    if session_days > 0:
+        cutoff = (datetime.utcnow() - timedelta(days=session_days)).strftime('%Y-%m-%d %H:%M:%S')
+        counts["sessions"] = purge_in_batches('saved_session', "created_at < :cutoff", {"cutoff": cutoff}, batch_size, pause)
+    if plan_days > 0:
+        cutoff = (datetime.utcnow() - timedelta(days=plan_days)).strftime('%Y-%m-%d')
+        counts["study_plan_entries"] = purge_in_batches('study_plan_entry', "review_date < :cutoff", {"cutoff": cutoff}, batch_size, pause)
+    if tombstone_days > 0:
+        counts["tombstones"] = purge_plan_tombstones(tombstone_days, batch_size, pause)
+    if counts["sessions"] or counts["study_plan_entries"] or counts["tombstones"]:
+        counts["pages_released"] = incremental_vacuum(pause=pause)
+    return counts
+
+@app.cli.command('purge-old-data')
+@click.option('--session-days', default=RETENTION_SESSION_DAYS, show_default=True, help='Delete sessions created more than this many days ago (0 = keep).')
+@click.option('--plan-days', default=RETENTION_PLAN_DAYS, show_default=True, help='Delete study-plan entries scheduled more than this many days ago (0 = keep).')
+@click.option('--tombstone-days', default=RETENTION_TOMBSTONE_DAYS, show_default=True, help='Delete study-plan tombstones older than this many days (0 = keep).')
+@click.option('--batch-size', default=RETENTION_BATCH_SIZE, show_default=True)
+@click.option('--pause', default=RETENTION_BATCH_PAUSE, show_default=True, help='Seconds to pause between batches.')
+def purge_old_data_command(session_days, plan_days, tombstone_days, batch_size, pause):
+    """Purges old sessions, study-plan entries and tombstones in batches, then vacuums incrementally."""
+    counts = purge_old_data(session_days, plan_days, batch_size, pause, tombstone_days)
+    print(f"Purged {counts['sessions']} sessions, {counts['study_plan_entries']} study-plan entries and "
+          f"{counts['tombstones']} tombstones; "
+          f"released {counts['pages_released']} pages.")
+
+@app.cli.command('enable-incremental-vacuum')
+def enable_incremental_vacuum_command():
+    """One-time conversion of an older database to incremental auto-vacuum (full VACUUM; stop the app first)."""
+    print("Converting database to incremental auto-vacuum (full VACUUM)...")
+    print("Database converted." if enable_incremental_vacuum() else "Database already uses incremental auto-vacuum.")
+
+# Converting needs an exclusive full VACUUM, so it's never done implicitly at startup
+with app.app_context():
+    if not incremental_vacuum_enabled():
+        print("Note: this database predates incremental auto-vacuum, so purges can't return freed pages to "
+              "the filesystem. Convert it once while the app is stopped: flask --app app enable-incremental-vacuum")
+
 # --- End Database Configuration ---
 
+# --- On-Demand Request Profiling ---
+# Opt-in: set PROFILE_TOKEN to enable. A request is profiled when it carries the header
+# 'X-Profile-Token: <PROFILE_TOKEN>', or at random with probability PROFILE_SAMPLE_RATE.
+# Each profile stores a cProfile dump plus the SQL statements the request ran, and is
+# retrievable from /api/admin/profiles (same header required).
+# With PROFILE_TOKEN unset none of the hooks, SQL listeners or routes are registered at all.
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(basedir, 'profiles'))
+PROFILE_MAX_STORED = int(os.getenv('PROFILE_MAX_STORED', '100'))
+
+# cProfile can only profile one request at a time per process; others just skip profiling
+_profile_lock = threading.Lock()
+
+def has_profile_token():
+    supplied = request.headers.get('X-Profile-Token', '')
+    return bool(supplied) and hmac.compare_digest(supplied, PROFILE_TOKEN)
+
+def _start_request_profile():
+    if request.path.startswith('/api/admin/'):
+        return
+    if not (has_profile_token() or (PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE)):
+        return
+    if not _profile_lock.acquire(blocking=False):
+        return
+    g.profile_queries = []
+    g.profile_started = time.perf_counter()
+    g.profiler = cProfile.Profile()
+    g.profiler.enable()
+
+def _stop_request_profile():
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return None
+    profiler.disable()
+    _profile_lock.release()
+    return profiler
+
+def _finish_request_profile(response):
+    profiler = _stop_request_profile()
+    if profiler is None:
+        return response
+    duration = time.perf_counter() - g.profile_started
+    profile_id = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    try:
+        save_request_profile(profile_id, profiler, duration, response.status_code, g.pop('profile_queries', []))
+        response.headers['X-Profile-Id'] = profile_id
+    except Exception as e:
+        print(f"Error saving request profile: {e}")
+    return response
+
+def _abort_request_profile(exc):
+    # Safety net if the request failed before after_request ran
+    _stop_request_profile()
+
+def _profiling_queries():
+    # Queries also run outside requests (CLI commands, prefetch/generation workers), where g doesn't exist
+    return has_request_context() and 'profile_queries' in g
+
+def describe_query_parameters(parameters, executemany):
+    """Parameter types only, e.g. "(int, str)": the values can be password hashes or user content."""
+    def types(params):
+        if isinstance(params, dict):
+            return "{" + ", ".join(f"{key}: {type(value).__name__}" for key, value in params.items()) + "}"
+        return "(" + ", ".join(type(value).__name__ for value in params) + ")"
+    if executemany:
+        return f"{len(parameters)} x {types(parameters[0])}" if parameters else "0 rows"
+    return types(parameters or ())
+
+def _record_query_start(conn, cursor, statement, parameters, context, executemany):
+    if _profiling_queries():
+        conn.info.setdefault('profile_query_start', []).append(time.perf_counter())
+
+def _record_query_end(conn, cursor, statement, parameters, context, executemany):
+    if _profiling_queries() and conn.info.get('profile_query_start'):
+        started = conn.info['profile_query_start'].pop()
+        g.profile_queries.append({
+            "statement": statement,
+            "parameter_types": describe_query_parameters(parameters, executemany)[:500],
+            "duration_ms": (time.perf_counter() - started) * 1000
+        })
+
+def save_request_profile(profile_id, profiler, duration, status_code, queries):
+    """Writes <id>.prof (load with pstats/snakeviz) and <id>.json, then prunes old profiles."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profiler.dump_stats(os.path.join(PROFILE_DIR, f"{profile_id}.prof"))
+
+    stats_stream = io.StringIO()
+    pstats.Stats(profiler, stream=stats_stream).sort_stats('cumulative').print_stats(40)
+    record = {
+        "id": profile_id,
+        "method": request.method,
+        "path": request.full_path.rstrip('?'),
+        "status": status_code,
+        "duration_ms": duration * 1000,
+        "query_count": len(queries),
+        "query_time_ms": sum(q["duration_ms"] for q in queries),
+        "created_at": datetime.utcnow().isoformat(),
+        "queries": queries,
+        "top_functions": stats_stream.getvalue()
+    }
+    with open(os.path.join(PROFILE_DIR, f"{profile_id}.json"), 'w') as f:
+        json.dump(record, f)
+    print(f"Saved profile {profile_id} for {request.method} {request.path} ({record['duration_ms']:.1f} ms)")
+
+    # Keep only the newest PROFILE_MAX_STORED profiles (ids sort chronologically)
+    stored = sorted(name[:-5] for name in os.listdir(PROFILE_DIR) if name.endswith('.json'))
+    for old_id in stored[:-PROFILE_MAX_STORED]:
+        for ext in ('.json', '.prof'):
+            try: os.remove(os.path.join(PROFILE_DIR, old_id + ext))
+            except OSError: pass
+
+def _safe_profile_path(profile_id, ext):
+    if not re.fullmatch(r'[0-9A-Za-z-]+', profile_id):
+        return None
+    path = os.path.join(PROFILE_DIR, profile_id + ext)
+    return path if os.path.exists(path) else None
+
+def list_profiles():
+    """Returns a list of all stored profiles (metadata only)."""
+    if not has_profile_token():
+        return jsonify({"msg": "Admin profile token required"}), 403
+    profiles = []
+    if os.path.isdir(PROFILE_DIR):
+        for name in sorted(os.listdir(PROFILE_DIR), reverse=True):
+            if not name.endswith('.json'):
+                continue
+            with open(os.path.join(PROFILE_DIR, name)) as f:
+                record = json.load(f)
+            record.pop('queries', None)
+            record.pop('top_functions', None)
+            profiles.append(record)
+    return jsonify(profiles)
+
+def get_profile(profile_id):
+    """Returns one profile: timing, SQL query log and the top functions by cumulative time."""
+    if not has_profile_token():
+        return jsonify({"msg": "Admin profile token required"}), 403
+    path = _safe_profile_path(profile_id, '.json')
+    if path is None:
+        return jsonify({"error": "Profile not found"}), 404
+    with open(path) as f:
+        return jsonify(json.load(f))
+
+def download_profile_stats(profile_id):
+    """Returns the raw cProfile dump for offline analysis (pstats, snakeviz)."""
+    if not has_profile_token():
+        return jsonify({"msg": "Admin profile token required"}), 403
+    path = _safe_profile_path(profile_id, '.prof')
+    if path is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return send_file(path, mimetype='application/octet-stream', as_attachment=True, download_name=f"{profile_id}.prof")
+
+if PROFILE_TOKEN:
+    app.before_request(_start_request_profile)
+    app.after_request(_finish_request_profile)
+    app.teardown_request(_abort_request_profile)
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', _record_query_start)
+        event.listen(db.engine, 'after_cursor_execute', _record_query_end)
+    app.add_url_rule('/api/admin/profiles', 'list_profiles', list_profiles, methods=['GET'])
+    app.add_url_rule('/api/admin/profiles/<profile_id>', 'get_profile', get_profile, methods=['GET'])
+    app.add_url_rule('/api/admin/profiles/<profile_id>/pstats', 'download_profile_stats', download_profile_stats, methods=['GET'])
+    print(f"Request profiling enabled (sample rate {PROFILE_SAMPLE_RATE}), profiles stored in {PROFILE_DIR}")
+
+# --- Model Call Telemetry ---
+# Latency and token counts per (artifact, model), kept in memory. Every call is also logged.
+# With PROFILE_TOKEN set, GET /api/admin/model-stats (same X-Profile-Token header) reports them.
+MODEL_TELEMETRY_SAMPLES = 500 # Latencies kept per route for the percentiles
+_model_telemetry = {}
+_model_telemetry_lock = threading.Lock()
+
+def record_model_call(artifact, model_name, elapsed, usage, ok):
+    prompt_tokens = getattr(usage, 'prompt_token_count', 0) or 0
+    output_tokens = getattr(usage, 'candidates_token_count', 0) or 0
+    with _model_telemetry_lock:
+        stats = _model_telemetry.setdefault((artifact, model_name), {
+            "calls": 0, "errors": 0, "prompt_tokens": 0, "output_tokens": 0,
+            "latencies": deque(maxlen=MODEL_TELEMETRY_SAMPLES),
+        })
+        stats["calls"] += 1
+        stats["errors"] += 0 if ok else 1
+        stats["prompt_tokens"] += prompt_tokens
+        stats["output_tokens"] += output_tokens
+        stats["latencies"].append(elapsed)
+    print(f"Gemini {artifact} via {model_name}: {elapsed:.2f}s, {prompt_tokens} prompt + {output_tokens} output tokens{'' if ok else ' (failed)'}")
+
+def nearest_rank_percentile(sorted_values, pct):
+    """Nearest-rank percentile (pct in 0-100) of a sorted list, as bench/stats.py computes it; None if empty."""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(pct * len(sorted_values) / 100.0) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+def model_telemetry_snapshot():
+    rows = []
+    with _model_telemetry_lock:
+        for (artifact, model_name), stats in sorted(_model_telemetry.items()):
+            latencies = sorted(stats["latencies"])
+            pick = lambda pct: round(nearest_rank_percentile(latencies, pct), 3) if latencies else None
+            rows.append({
+                "artifact": artifact,
+                "model": model_name,
+                "calls": stats["calls"],
+                "errors": stats["errors"],
+                "latency_p50_s": pick(50),
+                "latency_p95_s": pick(95),
+                "prompt_tokens": stats["prompt_tokens"],
+                "output_tokens": stats["output_tokens"],
+                "avg_output_tokens": round(stats["output_tokens"] / stats["calls"], 1),
+            })
+    return rows
+
+def get_model_stats():
+    if not has_profile_token():
+        return jsonify({"msg": "Admin profile token required"}), 403
+    return jsonify({
+        "routes": MODEL_ROUTES,
+        "stats": model_telemetry_snapshot(),
+        "single_flight": {flight.name: flight.snapshot() for flight in (gemini_flight, youtube_flight, topic_flight)},
+    })
+
+if PROFILE_TOKEN:
+    app.add_url_rule('/api/admin/model-stats', 'get_model_stats', get_model_stats, methods=['GET'])
+
+# --- Single-Flight Request Coalescing ---
+# When many users ask for the same thing at once (a class typing the assigned topic), concurrent
+# identical upstream calls share one in-flight call: the first caller makes it and the others
+# wait for its result (or its exception). Nothing is kept once the call finishes; this is not a
+# cache. A caller that waits longer than SINGLE_FLIGHT_WAIT_TIMEOUT makes its own call instead.
+SINGLE_FLIGHT_ENABLED = os.getenv('SINGLE_FLIGHT_ENABLED', 'true').lower() == 'true'
+SINGLE_FLIGHT_WAIT_TIMEOUT = float(os.getenv('SINGLE_FLIGHT_WAIT_TIMEOUT', '180'))
+
+class _FlightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0 # Upstream calls actually made
+        self.coalesced = 0 # Callers served by someone else's call
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args):
+        """Runs func(*args), or waits for the identical call already in flight under `key`."""
+        if not SINGLE_FLIGHT_ENABLED:
+            with self._lock:
+                self.calls += 1
+            return func(*args)
+        with self._lock:
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = self._in_flight[key] = _FlightCall()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            if not call.done.wait(SINGLE_FLIGHT_WAIT_TIMEOUT):
+                print(f"Timed out waiting for in-flight {self.name} call; calling upstream directly")
+                return func(*args)
+            if call.error is not None:
+                raise call.error
+            # Each caller gets its own copy of mutable results (video lists, tuples of them)
+            return call.result if isinstance(call.result, str) else copy.deepcopy(call.result)
+        try:
+            call.result = func(*args)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            call.done.set()
+
+    def snapshot(self):
+        with self._lock:
+            return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._in_flight)}
+
+gemini_flight = SingleFlight('gemini')
+youtube_flight = SingleFlight('youtube')
+topic_flight = SingleFlight('topic') # Whole notes+summary+videos generation, by content_cache_key
+
 # --- Helper Functions ---
-def generate_gemini_content(prompt_text):
-    """Calls the Gemini API and handles potential errors."""
+def generate_gemini_content(prompt_text, artifact='notes'):
+    """Calls the Gemini model routed for `artifact`, sharing identical concurrent calls (see SingleFlight)."""
+    return gemini_flight.do((artifact, prompt_text), call_gemini, prompt_text, artifact)
+
+def call_gemini(prompt_text, artifact):
+    """Calls the Gemini model routed for `artifact` (see MODEL_ROUTES) and handles potential errors."""
+    route = MODEL_ROUTES[artifact]
+    options = {}
+    if route["generation_config"]:
+        options["generation_config"] = route["generation_config"]
+    if route["timeout"]:
+        options["request_options"] = {"timeout": route["timeout"]}
+    started = time.perf_counter()
     try:
-        response = gemini_model.generate_content(prompt_text)
+        response = get_gemini_model(route["model"]).generate_content(prompt_text, **options)
         # Handling potential safety blocks or empty responses
+        record_model_call(artifact, route["model"], time.perf_counter() - started,
+                          getattr(response, 'usage_metadata', None), ok=bool(response.parts))
         if response.parts:
              return response.text
         else:
@@ -156,11 +1367,17 @@ def generate_gemini_content(prompt_text):
              else:
                  return "Error: Received empty response from AI."
     except Exception as e:
+        record_model_call(artifact, route["model"], time.perf_counter() - started, None, ok=False)
         print(f"Gemini API Error: {e}")
         return f"Error generating content: {e}" # Return error message
 
 def search_youtube(query, max_results=5):
-    """Searches YouTube and returns a list of video details."""
+    """Searches YouTube and returns a list of video details, sharing identical concurrent searches."""
+    # YouTube search ignores case and extra whitespace, so those queries can share a call
+    key = (" ".join(query.lower().split()), max_results)
+    return youtube_flight.do(key, call_youtube_search, query, max_results)
+
+def call_youtube_search(query, max_results):
     try:
         youtube = get_youtube_service()
         search_response = youtube.search().list(
@@ -191,112 +1408,525 @@ def search_youtube(query, max_results=5):
         return [] # Return empty list on other errors
 
 
-def __init__(self, *args, **kwargs):
+# --- Topic Content Generation & Sharing ---
+# Bump when the notes/summary prompts change so previously shared content isn't reused
+CONTENT_PROMPT_VERSION = 1
+YOUTUBE_MAX_RESULTS = 5
+
+# Shared pool for multi-topic generation (see /api/get-content/batch); bounds total upstream fan-out
+GENERATION_WORKERS = int(os.getenv('GENERATION_WORKERS', '6'))
+generation_executor = ThreadPoolExecutor(max_workers=GENERATION_WORKERS, thread_name_prefix='generation')
+
+def normalize_topic(topic):
+    """Lowercases and collapses whitespace/trailing punctuation so 'Mitosis ' and 'mitosis?' share content."""
+    return re.sub(r'\s+', ' ', topic).strip().rstrip('.?!').strip().lower()
+
+def content_cache_key(topic):
+    """Key for GeneratedContent: the normalized topic plus every parameter that shapes the output."""
+    params = {
+        "topic": normalize_topic(topic),
+        "model": MODEL_ROUTES['notes']['model'],
+        "prompt_version": CONTENT_PROMPT_VERSION,
+        "max_videos": YOUTUBE_MAX_RESULTS,
+    }
+    # Routing that changes notes/summary output is part of the key; the defaults add nothing,
+    # so keys created before per-artifact routing stay valid
+    if MODEL_ROUTES['summary']['model'] != MODEL_ROUTES['notes']['model']:
+        params["summary_model"] = MODEL_ROUTES['summary']['model']
+    for artifact in ('notes', 'summary'):
+        if MODEL_ROUTES[artifact]['generation_config']:
+            params[f"{artifact}_config"] = MODEL_ROUTES[artifact]['generation_config']
+    if SUMMARY_MODE != 'llm':
+        params["summary_mode"] = SUMMARY_MODE
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+def is_generation_error(content_text):
+    """True for the error/blocked strings generate_gemini_content returns instead of raising."""
+    return not content_text or content_text.startswith(("Error", "Content generation blocked"))
+
+def build_summary_prompt(topic):
+    return f"""
+    Provide a concise summary (2-4 paragraphs) of the main points for the topic: "{topic}".
+    Highlight the key concepts and definitions.
+    """
+
+# --- Local Extractive Summary ---
+# SUMMARY_MODE=local builds the summary from the generated notes instead of making a second
+# Gemini call. Sentences are ranked with TextRank over TF-IDF vectors (NumPy) and weighted
+# by the heading structure; the best few are returned in document order. Without NumPy, or
+# for notes too short to summarize, the LLM summary is used instead.
+SUMMARY_MODE = os.getenv('SUMMARY_MODE', 'llm') # 'llm' or 'local'
+SUMMARY_SENTENCES = int(os.getenv('SUMMARY_SENTENCES', '6'))
+SUMMARY_PARAGRAPH_SENTENCES = 3
+SUMMARY_MAX_SIMILARITY = 0.6 # Skip a sentence this close (cosine) to one already picked
+SUMMARY_DAMPING = 0.85
+SUMMARY_LEAD_WEIGHT = 1.3 # First sentence under a heading usually introduces/defines it
+SUMMARY_LIST_WEIGHT = 0.9 # Bullets are often fragments
+SUMMARY_RECAP_WEIGHT = 1.5 # Sentences under "Summary", "Key points", "Conclusion"...
+SUMMARY_HEADING_OVERLAP_WEIGHT = 0.5
+_RECAP_HEADING_RE = re.compile(r'\b(summary|key (points|takeaways|concepts|terms)|conclusion|overview|recap)\b', re.I)
+_SENTENCE_SPLIT_RE = re.compile(r'(?<=[.!?])\s+(?=[A-Z0-9"(\x02])') # \x02 starts a bold span (see _marked_inline_text)
+_SUMMARY_STOPWORDS = frozenset("""
+    about also and are because been but can does for from has have how into its may more most
+    not one such than that the their them then there these they this those through was were
+    what when where which while who will with within would you your
+""".split())
+summary_parser = MarkdownIt()
+
+def _inline_text(token):
+    return "".join(" " if child.type in ('softbreak', 'hardbreak') else child.content
+                   for child in (token.children or [])
+                   if child.type in ('text', 'code_inline', 'softbreak', 'hardbreak'))
+
+def _summary_terms(value):
+    return [word for word in re.findall(r"[a-z0-9]+", value.lower()) if len(word) > 2 and word not in _SUMMARY_STOPWORDS]
+
+def extract_note_sentences(notes_text):
+    """
+    Splits Markdown notes into candidate sentences using the markdown_it token stream.
+    Returns [(sentence, heading_path, weight)]; headings themselves and short fragments are skipped.
+    """
+    sentences = []
+    headings = {} # level -> heading text of the current section path
+    pending_level = None
+    list_depth = 0
+    section_position = 0
+    for token in summary_parser.parse(notes_text):
+        if token.type == 'heading_open':
+            pending_level = int(token.tag[1])
+        elif token.type in ('bullet_list_open', 'ordered_list_open'):
+            list_depth += 1
+        elif token.type in ('bullet_list_close', 'ordered_list_close'):
+            list_depth -= 1
+        if token.type != 'inline':
+            continue
+        content = re.sub(r'\s+', ' ', _inline_text(token)).strip()
+        if pending_level is not None:
+            headings = {level: value for level, value in headings.items() if level < pending_level}
+            headings[pending_level] = content
+            pending_level, section_position = None, 0
+            continue
+        innermost = headings[max(headings)] if headings else ""
+        for sentence in _SENTENCE_SPLIT_RE.split(content):
+            if len(sentence.split()) < 5:
+                continue
+            weight = SUMMARY_LIST_WEIGHT if list_depth else 1.0
+            if section_position == 0:
+                weight *= SUMMARY_LEAD_WEIGHT
+            if _RECAP_HEADING_RE.search(innermost):
+                weight *= SUMMARY_RECAP_WEIGHT
+            if not sentence.endswith(('.', '!', '?')):
+                sentence += '.'
+            sentences.append((sentence, " ".join(headings[level] for level in sorted(headings)), weight))
+            section_position += 1
+    return sentences
+
+def rank_sentences(sentences):
+    """
+    Scores each sentence: TextRank (PageRank over TF-IDF cosine similarity) times its structural
+    weight, boosted by how many of its section's heading terms it mentions.
+    Returns (scores, unit-length TF-IDF vectors).
+    """
+    docs = [_summary_terms(sentence) for sentence, _, _ in sentences]
+    vocabulary = {term: i for i, term in enumerate(sorted({term for doc in docs for term in doc}))}
+    counts = np.zeros((len(docs), max(len(vocabulary), 1)))
+    for row, doc in enumerate(docs):
+        for term in doc:
+            counts[row, vocabulary[term]] += 1
+    document_frequency = (counts > 0).sum(axis=0)
+    idf = np.log((1 + len(docs)) / (1 + document_frequency)) + 1
+    tfidf = counts / np.maximum(counts.sum(axis=1, keepdims=True), 1) * idf
+    norms = np.linalg.norm(tfidf, axis=1, keepdims=True)
+    vectors = tfidf / np.where(norms == 0, 1, norms)
+
+    similarity = vectors @ vectors.T
+    np.fill_diagonal(similarity, 0)
+    row_sums = similarity.sum(axis=1, keepdims=True)
+    # Sentences sharing no terms with any other spread their rank uniformly
+    transition = np.divide(similarity, row_sums, out=np.full_like(similarity, 1 / len(docs)), where=row_sums > 0)
+    scores = np.full(len(docs), 1 / len(docs))
+    for _ in range(100):
+        updated = (1 - SUMMARY_DAMPING) / len(docs) + SUMMARY_DAMPING * (transition.T @ scores)
+        converged = np.abs(updated - scores).sum() < 1e-6
+        scores = updated
+        if converged:
+            break
+
+    overlap = []
+    for doc, (_, heading_path, _) in zip(docs, sentences):
+        heading_terms = set(_summary_terms(heading_path))
+        overlap.append(len(heading_terms & set(doc)) / len(heading_terms) if heading_terms else 0.0)
+    weights = np.array([weight for _, _, weight in sentences]) * (1 + SUMMARY_HEADING_OVERLAP_WEIGHT * np.array(overlap))
+    return scores * weights, vectors
+
+def summarize_notes_locally(notes_text, sentence_count=SUMMARY_SENTENCES):
+    """Extractive summary of Markdown notes, or None if NumPy is missing or the notes are too short."""
+    if np is None or is_generation_error(notes_text):
+        return None
+    started = time.perf_counter()
+    sentences = extract_note_sentences(notes_text)
+    if len(sentences) <= sentence_count:
+        return None
+    scores, vectors = rank_sentences(sentences)
+    chosen = []
+    for index in np.argsort(-scores, kind='stable'):
+        if any(vectors[index] @ vectors[other] > SUMMARY_MAX_SIMILARITY for other in chosen):
+            continue
+        chosen.append(index)
+        if len(chosen) == sentence_count:
+            break
+    picked = [sentences[i][0] for i in sorted(chosen)]
+    print(f"Local summary: {len(picked)} of {len(sentences)} sentences in {(time.perf_counter() - started) * 1000:.1f} ms")
+    return "\n\n".join(" ".join(picked[i:i + SUMMARY_PARAGRAPH_SENTENCES])
+                       for i in range(0, len(picked), SUMMARY_PARAGRAPH_SENTENCES))
+
+def generate_topic_content(topic):
+    """Generates notes, summary and YouTube videos for a topic. Returns (notes, summary, videos)."""
+    # Prompt for detailed notes
+    notes_prompt = f"""
+    Generate detailed study notes for the topic: "{topic}".
+    Structure the notes clearly with headings, bullet points, and explanations where appropriate.
+    Assume the audience is a student trying to understand this topic.
+    Focus on accuracy and clarity.
+    """
+    notes = generate_gemini_content(notes_prompt, 'notes')
+
+    # SUMMARY_MODE=local: extract the summary from the notes (no second Gemini call)
+    summary = summarize_notes_locally(notes) if SUMMARY_MODE == 'local' else None
+    if summary is None:
+        # Prompt for a concise summary
+        summary_prompt = build_summary_prompt(topic)
+        # Alternatively, summarize the generated notes:
+        # summary_prompt = f"Summarize the following notes concisely (2-4 paragraphs):\n\n{notes}"
+        summary = generate_gemini_content(summary_prompt, 'summary')
+
+    # --- Search YouTube ---
+    videos = search_youtube(topic, max_results=YOUTUBE_MAX_RESULTS)
+    return notes, summary, videos
+
+def get_or_create_shared_content(topic):
+    """
+    Looks up the shared GeneratedContent for a topic, generating and storing it on a miss.
+    Returns (shared, generated):
+      - cache hit: (GeneratedContent, None)
+      - miss: (GeneratedContent, (notes, summary, videos)) for the newly stored row
+      - generation failed or couldn't be shared: (None, (notes, summary, videos))
+    """
+    content_key = content_cache_key(topic)
+    shared = GeneratedContent.query.filter_by(content_key=content_key).first()
+    if shared:
+        return shared, None
+
+    # Concurrent requests for the same topic (in any spelling normalize_topic folds together)
+    # share one generation; all but one then lose the insert race below and reuse its row
+    generated = topic_flight.do(content_key, generate_topic_content, topic)
+    notes, summary, videos = generated
+    if is_generation_error(notes) or is_generation_error(summary):
+        return None, generated # Never share an error message with other users
+
+    shared = GeneratedContent(
+        content_key=content_key,
+        topic=normalize_topic(topic),
+        notes=notes,
+        summary=summary,
+        youtube_videos=json_dumps(videos) if videos else None
+    )
+    try:
+        db.session.add(shared)
+        db.session.commit()
+    except IntegrityError:
+        # Another request generated the same topic concurrently; use theirs
+        db.session.rollback()
+        shared = GeneratedContent.query.filter_by(content_key=content_key).first()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error storing shared content for '{topic}': {e}")
+        shared = None
+    return shared, generated
+
+
+# --- Direct PDF Rendering (fpdf2) ---
+# PDF_ENGINE=fpdf draws the notes straight from the Markdown token stream with fpdf2 instead of
+# laying out HTML with xhtml2pdf. The bundled DejaVu fonts cover Latin, Greek and Cyrillic text,
+# which the core fonts xhtml2pdf uses can't show; fpdf2 embeds only the glyphs a document uses.
+# Text shaping isn't enabled and DejaVu has no CJK glyphs, so Chinese, Japanese, Korean, Arabic
+# and Indic scripts still don't render correctly.
+PDF_ENGINE = os.getenv('PDF_ENGINE', 'pisa') # 'pisa' or 'fpdf'
+PDF_FONT_DIR = os.path.join(basedir, 'fonts')
+PDF_FONT_FILES = {
+    ('DejaVu', ''): 'DejaVuSans.ttf',
+    ('DejaVu', 'B'): 'DejaVuSans-Bold.ttf',
+    ('DejaVu', 'I'): 'DejaVuSans-Oblique.ttf',
+    ('DejaVu', 'BI'): 'DejaVuSans-BoldOblique.ttf',
+    ('DejaVuCondensed', ''): 'DejaVuSansCondensed.ttf', # Code spans and blocks
+}
+PDF_HEADING_SIZES = {'h1': 16, 'h2': 14, 'h3': 13}
+PDF_INDENT = 6 # mm per list/blockquote level
+
+if PDF_ENGINE == 'fpdf' and FPDF is None:
+    print("PDF_ENGINE=fpdf but fpdf2 is not installed; using xhtml2pdf")
+    PDF_ENGINE = 'pisa'
+
+pdf_markdown_parser = MarkdownIt().enable('table')
+
+# Parsing the TrueType metrics dominates the cost of a short document (~50 ms per face), so each
+# font is parsed once and copied into every document. The copy gets its own lazily opened TTFont
+# because fpdf2 subsets that in place when the document is written. This reaches into fpdf2's
+# font objects, so it's only used with the release it was tested against
+# (tests/test_pdf_fonts.py); any other version goes through the public add_font.
+PDF_FONT_CACHE_FPDF_VERSION = '2.8.9'
+PDF_FONT_CACHE_ENABLED = FPDF is not None and TTFFont is not None and FPDF_VERSION == PDF_FONT_CACHE_FPDF_VERSION
+if PDF_ENGINE == 'fpdf' and not PDF_FONT_CACHE_ENABLED:
+    print(f"fpdf2 {FPDF_VERSION} isn't the tested {PDF_FONT_CACHE_FPDF_VERSION}; PDF fonts are loaded per document")
+_pdf_font_templates = {}
+_pdf_font_lock = threading.Lock()
+
+def add_cached_font(pdf, family, style, path):
+    if not PDF_FONT_CACHE_ENABLED:
+        pdf.add_font(family, style, path)
+        return
+    fontkey = f"{family.lower()}{style}"
+    with _pdf_font_lock:
+        cached = _pdf_font_templates.get(fontkey)
+        if cached is None:
+            with open(path, 'rb') as f:
+                cached = _pdf_font_templates[fontkey] = (TTFFont(pdf, path, fontkey, style), f.read())
+    template, font_bytes = cached
+    font = copy.copy(template)
+    font.i = len(pdf.fonts) + 1
+    # From memory: a lazily loaded TTFont would otherwise keep the font file open per document
+    font.ttfont = ttLib.TTFont(io.BytesIO(font_bytes), recalcTimestamp=False, lazy=True)
+    font.subset = SubsetMap(font)
+    font.missing_glyphs = []
+    font.biggest_size_pt = 0
+    pdf.fonts[fontkey] = font
+
+class StudyNotesPDF(FPDF if FPDF is not None else object):
+    def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.md = MarkdownIt()
+        self.md = pdf_markdown_parser
         self.current_style = ''
+        self.indent = 0
         try:
-            font_path = os.path.join(os.path.dirname(__file__), 'fonts')
-            self.add_font('DejaVu', '', os.path.join(font_path, 'DejaVuSans.ttf'), uni=True)
-            self.add_font('DejaVu', 'B', os.path.join(font_path, 'DejaVuSans-Bold.ttf'), uni=True)
-            self.add_font('DejaVu', 'I', os.path.join(font_path, 'DejaVuSans-Italic.ttf'), uni=True)
-            self.set_font('DejaVu', '', 12)
+            add_cached_font(self, 'DejaVu', '', os.path.join(PDF_FONT_DIR, PDF_FONT_FILES[('DejaVu', '')]))
             self.default_font = 'DejaVu'
-            print("Successfully added DejaVu fonts.")
+            self.code_font = 'DejaVuCondensed'
+            self.unicode_font = True
         except Exception as e:
-            print(f"!!! Font Error: {e}. Could not load DejaVu fonts. Falling back to Arial.")
-            self.set_font('Arial', '', 12)
-            self.default_font = 'Arial'
+            print(f"!!! Font Error: {e}. Could not load DejaVu fonts. Falling back to Helvetica.")
+            self.default_font = self.code_font = 'Helvetica'
+            self.unicode_font = False
+        self.set_font(self.default_font, '', 12)
+
+    def set_font(self, family=None, style='', size=0):
+        # Faces are added on first use: every registered font gets subset and embedded on output
+        filename = PDF_FONT_FILES.get((family, style))
+        if filename and f"{family.lower()}{style}" not in self.fonts:
+            add_cached_font(self, family, style, os.path.join(PDF_FONT_DIR, filename))
+        super().set_font(family, style, size)
+
+    def printable(self, text):
+        """Core fonts only cover Latin-1; replace anything else rather than failing."""
+        return text if self.unicode_font else text.encode('latin-1', 'replace').decode('latin-1')
 
-def header(self):
+    def header(self):
         self.set_font(self.default_font, 'B', 15)
         title_w = self.get_string_width(self.title) + 6
         doc_w = self.w
         self.set_x((doc_w - title_w) / 2)
-        self.cell(title_w, 10, self.title, border=0, ln=1, align='C')
+        self.cell(title_w, 10, self.title, border=0, align='C', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
         self.ln(10)
         self.set_font(self.default_font, '', 12)
 
-def footer(self):
+    def footer(self):
         self.set_y(-15)
-        self.set_font(self.default_font, 'I', 8)
+        self.set_font(self.default_font, '', 8) # Regular, so the italic face is only embedded when the notes use it
         self.set_text_color(128)
-        self.cell(0, 10, 'Page ' + str(self.page_no()), 0, 0, 'C')
+        self.cell(0, 10, 'Page ' + str(self.page_no()), align='C')
         self.set_text_color(0)
 
-def set_font_style(self, style, size=12):
+    def set_font_style(self, style, size=12):
         self.set_font(self.default_font, style, size)
         self.current_style = style
 
-def chapter_title(self, title):
+    def line_height(self):
+        return self.font_size_pt * 1.2 / self.k # pt to mm
+
+    def set_indent(self, indent):
+        self.indent = indent
+        self.set_left_margin(self.base_margin + indent * PDF_INDENT)
+
+    def chapter_title(self, title):
         self.set_font_style('B', 14)
-        self.cell(0, 6, title, 0, 1, 'L')
+        self.cell(0, 6, self.printable(title), new_x=XPos.LMARGIN, new_y=YPos.NEXT)
         self.ln(4)
 
-def chapter_body(self, markdown_text):
-        try:
-            decoded_text = markdown_text.encode('latin-1', 'replace').decode('latin-1')
-        except AttributeError:
-            decoded_text = markdown_text
-
-        tokens = self.md.parse(decoded_text)
+    def chapter_body(self, markdown_text):
+        tokens = self.md.parse(self.printable(markdown_text))
+        self.base_margin = self.l_margin
         self.set_font_style('', 12)
+        lists = [] # [ordered, next item number] per open list
 
-        for token in tokens:
-            if token.type == 'paragraph_open':
-                pass
-            elif token.type == 'paragraph_close':
-                self.ln(2)
-            elif token.type == 'inline':
-                current_text = ''
-                start_x = self.get_x()
-                for child in token.children:
-                    if child.type == 'text':
-                        current_text += child.content
-                    elif child.type == 'strong_open':
-                        if current_text:
-                            self.write_text(current_text)
-                            current_text = ''
-                        self.set_font_style('B', 12)
-                    elif child.type == 'strong_close':
-                        if current_text:
-                            self.write_text(current_text)
-                            current_text = ''
-                        self.set_font_style('', 12)
-                    elif child.type == 'em_open':
-                        if current_text:
-                            self.write_text(current_text)
-                            current_text = ''
-                        self.set_font_style('I', 12)
-                    elif child.type == 'em_close':
-                        if current_text:
-                            self.write_text(current_text)
-                            current_text = ''
-                        self.set_font_style('', 12)
-                if current_text:
-                    self.write_text(current_text)
-            elif token.type == 'heading_open' and token.tag == 'h2':
+        index = 0
+        while index < len(tokens):
+            token = tokens[index]
+            if token.type == 'heading_open':
                 self.ln(4)
-                self.set_font_style('B', 14)
-            elif token.type == 'heading_close' and token.tag == 'h2':
+                self.set_font_style('B', PDF_HEADING_SIZES.get(token.tag, 12))
+            elif token.type == 'heading_close':
+                self.ln(self.line_height() + 1)
+                self.set_font_style('', 12)
+            elif token.type == 'inline':
+                self.write_inline(token.children)
+            elif token.type == 'paragraph_close':
+                self.ln(self.line_height())
+                if not token.hidden: # Tight list items don't get paragraph spacing
+                    self.ln(2)
+            elif token.type in ('bullet_list_open', 'ordered_list_open'):
+                lists.append([token.type == 'ordered_list_open', int(token.attrGet('start') or 1)])
+                self.set_indent(self.indent + 1)
+            elif token.type in ('bullet_list_close', 'ordered_list_close'):
+                lists.pop()
+                self.set_indent(self.indent - 1)
+                if not lists:
+                    self.ln(2)
+            elif token.type == 'list_item_open':
+                ordered, number = lists[-1]
+                lists[-1][1] += 1
+                self.set_x(self.l_margin - PDF_INDENT)
+                self.cell(PDF_INDENT, self.line_height(), f"{number}." if ordered else ("•" if self.unicode_font else "-"))
+            elif token.type == 'blockquote_open':
+                self.set_indent(self.indent + 1)
+                self.set_text_color(90)
+            elif token.type == 'blockquote_close':
+                self.set_indent(self.indent - 1)
+                self.set_text_color(0)
+            elif token.type in ('fence', 'code_block'):
+                self.set_font(self.code_font, '', 9)
+                self.set_fill_color(240)
+                self.multi_cell(0, 4.5, token.content.rstrip('\n'), fill=True, align='L', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
                 self.set_font_style('', 12)
                 self.ln(2)
-
-def write_text(self, text):
-        try:
-            # Dynamic line height based on font size
-            line_height = self.font_size_pt * 1.2 / self.k  # pt to mm
-            self.write(line_height, text)
-        except Exception as e:
-            print(f"Error writing text chunk: {e}")
-            self.write(5, "[Write Error]")
-
-def add_quiz_question(self, index, q_data):
+            elif token.type == 'hr':
+                y = self.get_y() + 2
+                self.line(self.l_margin, y, self.w - self.r_margin, y)
+                self.ln(5)
+            elif token.type == 'table_open':
+                index = self.write_table(tokens, index)
+            index += 1
+        self.set_indent(0)
+
+    def write_inline(self, children):
+        """Lays out an inline token's bold/italic/code/link runs from the current position."""
+        base_style = self.current_style
+        bold, italic, link = 'B' in base_style, 'I' in base_style, ''
+        size = self.font_size_pt
+        runs = [] # (text, family, style, size, link); None is a hard line break
+        for child in children or []:
+            style = ('B' if bold else '') + ('I' if italic else '')
+            if child.type in ('text', 'image'):
+                runs.append((child.content, self.default_font, style, size, link))
+            elif child.type == 'code_inline':
+                runs.append((child.content, self.code_font, '', size - 1, link))
+            elif child.type == 'softbreak':
+                runs.append((' ', self.default_font, style, size, link))
+            elif child.type == 'hardbreak':
+                runs.append(None)
+            elif child.type in ('strong_open', 'strong_close', 'em_open', 'em_close'):
+                if child.type.startswith('strong'):
+                    bold = child.type == 'strong_open' or 'B' in base_style
+                else:
+                    italic = child.type == 'em_open' or 'I' in base_style
+            elif child.type == 'link_open':
+                href = child.attrGet('href') or ''
+                link = href if href.startswith(('http://', 'https://', 'mailto:')) else ''
+            elif child.type == 'link_close':
+                link = ''
+        self.write_runs(runs, self.line_height())
+        self.set_font(self.default_font, base_style, size)
+
+    def write_runs(self, runs, line_height):
+        """
+        Greedy word wrap up to the right margin, drawing one cell per same-styled segment of a line.
+        fpdf2's write() re-measures the pending line for every character, which made it the
+        slowest part of a document; here each word is measured once.
+        """
+        right = self.w - self.r_margin
+        line = [] # [(family, style, size, link), text, width] segments of the current line
+        x, pending_space = self.get_x(), False
+
+        def flush(new_line):
+            for (family, style, size, link), text, width in line:
+                self.set_font(family, style, size)
+                self.cell(width, line_height, text, link=link)
+            line.clear()
+            if new_line:
+                self.ln(line_height)
+            return self.get_x()
+
+        for run in runs:
+            if run is None:
+                x, pending_space = flush(True), False
+                continue
+            text, family, style, size, link = run
+            key = (family, style, size, link)
+            self.set_font(family, style, size)
+            space_width = self.get_string_width(' ')
+            for word in re.findall(r'\S+|\s+', text):
+                if word.isspace():
+                    pending_space = bool(line) or x > self.l_margin
+                    continue
+                width = self.get_string_width(word)
+                gap = space_width if pending_space else 0
+                if x + gap + width > right and (line or x > self.l_margin):
+                    x, gap = flush(True), 0
+                if width > right - self.l_margin:
+                    # Longer than a whole line (e.g. a URL): let fpdf2 break it mid-word
+                    flush(False)
+                    self.set_font(family, style, size)
+                    self.write(line_height, word, link)
+                    x, pending_space = self.get_x(), False
+                    continue
+                piece = (' ' if gap else '') + word
+                if line and line[-1][0] == key:
+                    line[-1][1] += piece
+                    line[-1][2] += gap + width
+                else:
+                    line.append([key, piece, gap + width])
+                x += gap + width
+                pending_space = False
+        flush(False)
+
+    def write_table(self, tokens, index):
+        """Draws the table starting at tokens[index]; returns the index of its table_close."""
+        rows, has_head = [], False
+        while tokens[index].type != 'table_close':
+            token = tokens[index]
+            if token.type == 'thead_open':
+                has_head = True
+            elif token.type == 'tr_open':
+                rows.append([])
+            elif token.type == 'inline':
+                rows[-1].append(_inline_text(token))
+            index += 1
+        if rows:
+            width = max(len(row) for row in rows)
+            self.set_font_style('', 10)
+            with self.table(first_row_as_headings=has_head, line_height=self.line_height() + 1) as table:
+                for cells in rows:
+                    row = table.row()
+                    for cell in cells + [''] * (width - len(cells)):
+                        row.cell(cell)
+            self.set_font_style('', 12)
+            self.ln(2)
+        return index
+
+    def add_quiz_question(self, index, q_data):
         available_width = self.w - self.l_margin - self.r_margin
 
         self.set_font_style('B', 12)
-        question_text = q_data.get('question', 'N/A')
-        self.multi_cell(available_width, 5, f"{index + 1}. {question_text}")
+        question_text = self.plain_inline(q_data.get('question', 'N/A'))
+        self.multi_cell(available_width, 5, f"{index + 1}. {question_text}", align='L', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
         self.ln(1)
 
         self.set_font_style('', 11)
@@ -306,21 +1936,824 @@ def add_quiz_question(self, index, q_data):
         option_prefix_width = 5
 
         for option in options:
-            prefix = " " * 4
-            if option == correct_answer:
-                prefix += "✓ "
+            self.set_x(self.l_margin + option_indent)
+            self.cell(option_prefix_width, 5, "✓" if option == correct_answer and self.unicode_font else
+                      ("*" if option == correct_answer else ""))
+            self.multi_cell(available_width - (option_indent + option_prefix_width), 5, self.plain_inline(option), align='L',
+                            new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+
+        self.set_font_style('', 10)
+        self.set_text_color(90)
+        explanation_text = self.plain_inline(q_data.get('explanation', 'N/A'))
+        self.set_x(self.l_margin + option_indent)
+        self.multi_cell(available_width - option_indent, 5, f"Explanation: {explanation_text}", align='L', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        self.set_text_color(0)
+        self.ln(4)
+
+    def plain_inline(self, value):
+        """Quiz fields may carry inline Markdown; draw just their text."""
+        tokens = self.md.parseInline(self.printable(str(value)))
+        return _inline_text(tokens[0]) if tokens else ''
+
+def draw_notes_pdf(topic, notes_text, quiz_data):
+    """Draws the notes Markdown plus a quiz review directly with fpdf2 and returns the PDF bytes."""
+    pdf = StudyNotesPDF(format='A4')
+    pdf.set_margins(25.4, 25.4) # Same 1in margins as the xhtml2pdf layout
+    pdf.set_auto_page_break(True, margin=25.4)
+    pdf.set_title(pdf.printable(topic))
+    pdf.add_page()
+    pdf.chapter_title("Study Notes")
+    pdf.chapter_body(notes_text)
+    if quiz_data and isinstance(quiz_data, list):
+        pdf.ln(4)
+        pdf.chapter_title("Quiz Review")
+        for i, q in enumerate(quiz_data):
+            if isinstance(q, dict):
+                pdf.add_quiz_question(i, q)
+    return bytes(pdf.output())
+
+# --- AI Response Parsing & Export Helpers ---
+def parse_quiz_response(quiz_content_raw):
+    """
+    Extracts and validates the quiz question list from a raw Gemini response.
+    Raises ValueError/json.JSONDecodeError/TypeError if the response can't be used.
+    """
+    # Attempt to extract JSON list using regex - more robust!
+    # This looks for the first '[' that seems to start a list/object structure
+    # and the last ']' that appropriately closes it. Handles nested structures.
+    match = re.search(r'\[\s*\{.*?\}\s*\]', quiz_content_raw, re.DOTALL)
+
+    if not match:
+         # Fallback: Maybe it returned a single object instead of a list? Less likely based on prompt.
+         match = re.search(r'\{\s*".*?":.*?\s*\}', quiz_content_raw, re.DOTALL)
+         if match:
+             print("Warning: AI returned a single JSON object, expected a list. Attempting to wrap in a list.")
+             potential_json = f"[{match.group(0)}]" # Wrap the single object in a list
+         else:
+             raise ValueError("Could not find JSON list or object structure in the AI response using regex.")
+    else:
+         potential_json = match.group(0)
+
+
+    print(f"Attempting to parse extracted JSON:\n{potential_json}")
+    questions = json.loads(potential_json)
+
+    # Basic validation
+    if not isinstance(questions, list):
+        # If we wrapped a single object, this check might fail unless we re-assign 'questions'
+        if isinstance(questions, dict) and potential_json.startswith('['): # Check if we manually wrapped it
+             questions = [questions] # Put the single dict into a list
+        else:
+             raise ValueError("Parsed JSON is not a list.")
+
+    if not questions:
+         raise ValueError("Parsed JSON list is empty.")
+
+    # Check keys of the first question object
+    required_keys = ["question", "options", "correct_answer", "explanation"]
+    if not all(k in questions[0] for k in required_keys):
+         missing_keys = [k for k in required_keys if k not in questions[0]]
+         raise ValueError(f"Parsed JSON object missing required keys: {missing_keys}")
+    return questions
+
+def parse_flashcards_response(flashcard_content_raw):
+    """
+    Extracts and validates the flashcard list from a raw Gemini response.
+    Raises ValueError/json.JSONDecodeError/TypeError if the response can't be used.
+    """
+    # Attempt to extract JSON list using regex
+    match = re.search(r'\[\s*\{.*?\}\s*\]', flashcard_content_raw, re.DOTALL)
+    if not match:
+        raise ValueError("Could not find JSON list structure in the AI response using regex.")
+
+    potential_json = match.group(0)
+    print(f"Attempting to parse extracted flashcard JSON:\n{potential_json}")
+    flashcards = json.loads(potential_json)
+
+    # Basic validation
+    if not isinstance(flashcards, list):
+        raise ValueError("Parsed JSON is not a list.")
+    # Allow empty list as valid response
+    if flashcards and not all(k in flashcards[0] for k in ["term", "definition"]):
+        missing_keys = [k for k in ["term", "definition"] if k not in flashcards[0]]
+        raise ValueError(f"Parsed JSON object missing required keys: {missing_keys}")
+    return flashcards
+
+def flashcards_to_csv(flashcards):
+    """Serializes flashcards to CSV text with a "Term","Definition" header."""
+    # Simple CSV generation: Header + one line per card
+    # Wrap fields in double quotes to handle potential commas within term/definition
+    # Double up existing double quotes within fields to escape them
+    csv_lines = ['"Term","Definition"'] # Header row
+    for card in flashcards:
+        term = str(card.get('term', '')).replace('"', '""') # Escape double quotes
+        definition = str(card.get('definition', '')).replace('"', '""') # Escape double quotes
+        csv_lines.append(f'"{term}","{definition}"')
+
+    return "\n".join(csv_lines)
+
+def render_notes_pdf(topic, notes_html, quiz_data):
+    """Lays out the notes HTML plus a quiz Q&A review and renders it to PDF bytes with xhtml2pdf."""
+    # --- Prepare Quiz HTML (Question & Answer only) ---
+    quiz_html = ""
+    if quiz_data and isinstance(quiz_data, list) and len(quiz_data) > 0:
+        quiz_html += "<h2>Quiz Review</h2><ol>"
+        for i, q in enumerate(quiz_data):
+            question_text = q.get('question', 'N/A')
+            # Convert potential markdown in question to HTML (without surrounding <p> tags)
+            question_html = render_inline_markdown(str(question_text))
+
+            correct_answer = q.get('correct_answer', 'N/A')
+            # Convert potential markdown in answer to HTML
+            answer_html = render_inline_markdown(str(correct_answer))
+
+            quiz_html += f"<li><strong>Question:</strong> {question_html}<br/>"
+            quiz_html += f"<strong>Answer:</strong> {answer_html}</li><br/>" # Add line break for spacing
+        quiz_html += "</ol>"
+
+    # --- Combine into Full HTML Document ---
+    # Basic HTML structure with some CSS for styling
+    # Using default serif font, easy to read. Add more CSS as needed.
+    html_content = f"""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <meta charset="UTF-8">
+        <style>
+            @page {{ margin: 1in; }} /* Set page margins */
+            body {{ font-family: Georgia, serif; font-size: 11pt; line-height: 1.4; }}
+            h1 {{ font-size: 18pt; font-weight: bold; text-align: center; margin-bottom: 20px; }}
+            h2 {{ font-size: 14pt; font-weight: bold; margin-top: 15px; margin-bottom: 8px; border-bottom: 1px solid #ccc; padding-bottom: 2px;}}
+            p {{ margin-top: 0; margin-bottom: 10px; }}
+            ul, ol {{ margin-left: 20px; margin-bottom: 10px;}}
+            li {{ margin-bottom: 5px; }}
+            strong, b {{ font-weight: bold; }}
+            em, i {{ font-style: italic; }}
+            pre {{ background-color: #f0f0f0; padding: 10px; border-radius: 4px; white-space: pre-wrap; word-wrap: break-word; }}
+            code {{ font-family: 'Courier New', monospace; background-color: #f0f0f0; padding: 1px 3px; border-radius: 3px;}}
+            /* Add more styles as needed */
+        </style>
+    </head>
+    <body>
+        <h1>{topic}</h1>
+
+        <h2>Study Notes</h2>
+        {notes_html}
+
+        {quiz_html}
+    </body>
+    </html>
+    """
+
+    # --- Generate PDF using xhtml2pdf ---
+    result_buffer = io.BytesIO() # Create a buffer to hold PDF data
+
+    # Convert HTML to PDF
+    pisa_status = pisa.CreatePDF(
+        src=io.StringIO(html_content), # Source HTML (as string IO)
+        dest=result_buffer             # Destination buffer
+    )
+
+    # Check for errors
+    if pisa_status.err:
+        raise Exception(f"PDF Generation Error: {pisa_status.err}")
+    return result_buffer.getvalue()
+
+
+# --- Quiz & Flashcard Generation ---
+QUIZ_QUESTION_COUNT = 5
+FLASHCARD_MAX_COUNT = 15
+
+class AIResponseError(ValueError):
+    """A model response that couldn't be turned into quiz questions/flashcards; keeps the raw text for debugging."""
+    def __init__(self, message, raw_response):
+        super().__init__(message)
+        self.raw_response = raw_response
+
+def build_quiz_prompt(notes_text, question_count=QUIZ_QUESTION_COUNT):
+    # UPDATED, STRICTER PROMPT:
+    return f"""
+    Based ONLY on the following study notes, generate exactly {question_count} multiple-choice quiz questions suitable for a student.
+    For each question, provide:
+    1. The question text (string).
+    2. A list of 4 distinct options (list of strings).
+    3. The correct answer (string, exactly matching one of the options).
+    4. A brief explanation (string) for why the answer is correct, based on the notes.
+
+    Output the result ONLY as a valid JSON list (starting with '[' and ending with ']').
+    Each element in the list must be an object with keys: "question", "options", "correct_answer", and "explanation".
+
+    IMPORTANT: Do NOT include any introductory text, concluding remarks, code block markers (like ```json), or ANY characters whatsoever before the opening '[' or after the closing ']'. The entire response MUST be the JSON list itself.
+
+    Study Notes:
+    ---
+    {notes_text}
+    ---
+    """
+
+def build_flashcard_prompt(notes_text, count_hint="5-15"):
+    return f"""
+    Analyze the following study notes and extract key terms and their definitions.
+    Generate a list of flashcards based ONLY on the provided text.
+    For each flashcard, provide:
+    1. "term": The key term or concept (string, keep it concise).
+    2. "definition": A clear and concise definition of the term based on the notes (string).
+
+    Output the result ONLY as a valid JSON list where each element is an object with keys "term" and "definition".
+    Aim for around {count_hint} flashcards, focusing on the most important concepts.
+
+    IMPORTANT: Do NOT include any introductory text, concluding remarks, code block markers (like ```json), or ANY characters whatsoever before the opening '[' or after the closing ']'. The entire response MUST be the JSON list itself.
+
+    Study Notes:
+    ---
+    {notes_text}
+    ---
+    """
+
+# --- Map-Reduce for Long Notes ---
+# Notes longer than NOTES_MAP_REDUCE_MIN_CHARS are split at their Markdown headings and each
+# section gets its own (parallel) prompt, so latency follows the longest section and questions
+# cover the whole document. A local reduce step dedupes and picks round-robin across sections.
+NOTES_MAP_REDUCE_MIN_CHARS = int(os.getenv('NOTES_MAP_REDUCE_MIN_CHARS', '6000'))
+NOTES_SECTION_MIN_CHARS = int(os.getenv('NOTES_SECTION_MIN_CHARS', '1500'))
+NOTES_MAX_SECTIONS = int(os.getenv('NOTES_MAX_SECTIONS', '8'))
+# Separate from generation_executor so batch workers can't starve (or deadlock on) section calls
+section_executor = ThreadPoolExecutor(max_workers=NOTES_MAX_SECTIONS * 2, thread_name_prefix='notes-section')
+notes_section_parser = MarkdownIt()
+
+def split_notes_sections(notes_text):
+    """
+    Splits Markdown notes into sections at h1-h3 headings (via the markdown_it token stream).
+    Small sections are merged into their predecessor and the count is capped at NOTES_MAX_SECTIONS.
+    Returns [notes_text] when the notes are short enough for a single prompt.
+    """
+    if len(notes_text) < NOTES_MAP_REDUCE_MIN_CHARS:
+        return [notes_text]
+
+    lines = notes_text.splitlines(keepends=True)
+    heading_lines = sorted({
+        token.map[0] for token in notes_section_parser.parse(notes_text)
+        if token.type == 'heading_open' and token.tag in ('h1', 'h2', 'h3') and token.map
+    })
+    boundaries = [0] + [line for line in heading_lines if line > 0] + [len(lines)]
+    chunks = [chunk for chunk in ("".join(lines[a:b]) for a, b in zip(boundaries, boundaries[1:])) if chunk.strip()]
+
+    sections = []
+    for chunk in chunks:
+        if sections and len(sections[-1]) < NOTES_SECTION_MIN_CHARS:
+            sections[-1] += chunk
+        else:
+            sections.append(chunk)
+    # A short trailing section is folded back too
+    if len(sections) > 1 and len(sections[-1]) < NOTES_SECTION_MIN_CHARS:
+        sections[-2:] = [sections[-2] + sections[-1]]
+    # Too many sections: repeatedly merge the smallest adjacent pair
+    while len(sections) > NOTES_MAX_SECTIONS:
+        i = min(range(len(sections) - 1), key=lambda i: len(sections[i]) + len(sections[i + 1]))
+        sections[i:i + 2] = [sections[i] + sections[i + 1]]
+    return sections
+
+def map_sections(sections, build_prompt, parse, label):
+    """
+    Map step: one prompt per section, run in parallel on the model routed for `label` ("quiz"/"flashcards").
+    Returns (candidates per section, combined raw text).
+    Sections whose response can't be parsed contribute nothing; fails only if every section failed.
+    """
+    futures = [section_executor.submit(generate_gemini_content, build_prompt(section), label) for section in sections]
+    per_section, raw_responses = [], []
+    for i, future in enumerate(futures):
+        raw = future.result()
+        raw_responses.append(raw)
+        try:
+            per_section.append(parse(raw))
+        except (json.JSONDecodeError, ValueError, TypeError) as e:
+            print(f"Section {i + 1}/{len(sections)} {label} response unusable: {e}")
+            per_section.append([])
+    combined_raw = "\n---\n".join(raw_responses)
+    if not any(per_section):
+        raise AIResponseError(f"No section produced a usable {label} response", combined_raw)
+    return per_section, combined_raw
+
+def _word_set(value):
+    return set(re.findall(r'\w+', str(value).lower()))
+
+def reduce_candidates(per_section, limit, key, required_keys, similarity=0.8):
+    """
+    Reduce step: drops malformed and near-duplicate candidates (word-set Jaccard >= similarity on key)
+    and picks round-robin across sections so every part of the notes is represented.
+    """
+    queues = [[c for c in candidates if isinstance(c, dict) and all(k in c for k in required_keys)]
+              for candidates in per_section]
+    seen, selected = [], []
+    while len(selected) < limit and any(queues):
+        for queue in queues:
+            while queue:
+                candidate = queue.pop(0)
+                words = _word_set(key(candidate))
+                if any(len(words & other) / max(len(words | other), 1) >= similarity for other in seen):
+                    continue
+                seen.append(words)
+                selected.append(candidate)
+                break
+            if len(selected) >= limit:
+                break
+    return selected
+
+def generate_quiz_questions(notes_text):
+    """Returns (questions, raw_response). Raises ValueError/AIResponseError if unusable."""
+    sections = split_notes_sections(notes_text)
+    if len(sections) == 1:
+        quiz_content_raw = generate_gemini_content(build_quiz_prompt(notes_text), 'quiz') # Use the existing helper
+        print(f"Raw AI response for quiz:\n{quiz_content_raw}") # Keep logging the raw response
+        try:
+            return parse_quiz_response(quiz_content_raw), quiz_content_raw
+        except (json.JSONDecodeError, ValueError, TypeError) as e:
+            raise AIResponseError(str(e), quiz_content_raw) from e
+
+    # Oversample per section so the reduce step has room to dedupe and spread coverage
+    per_section_count = max(2, -(-QUIZ_QUESTION_COUNT * 2 // len(sections)))
+    print(f"Generating quiz from {len(sections)} note sections ({per_section_count} candidates each)")
+    per_section, quiz_content_raw = map_sections(
+        sections, lambda section: build_quiz_prompt(section, per_section_count), parse_quiz_response, "quiz")
+    questions = reduce_candidates(per_section, QUIZ_QUESTION_COUNT, key=lambda q: q["question"],
+                                  required_keys=["question", "options", "correct_answer", "explanation"])
+    if not questions:
+        raise AIResponseError("No valid quiz questions after merging sections", quiz_content_raw)
+    return questions, quiz_content_raw
+
+def generate_flashcard_list(notes_text):
+    """
+    Returns (flashcards, raw_response), honouring FLASHCARD_MODE and the local fallback.
+    Raises ValueError/AIResponseError if unusable.
+    """
+    if FLASHCARD_MODE == 'local':
+        flashcards = extract_flashcards_locally(notes_text)
+        if len(flashcards) >= FLASHCARD_LOCAL_MIN_CARDS:
+            print(f"Extracted {len(flashcards)} flashcards locally")
+            return flashcards, ""
+    try:
+        return generate_flashcard_list_with_model(notes_text)
+    except (ValueError, TypeError) as e:
+        # Timed out, rate limited or unparseable: the notes themselves still hold the key terms
+        flashcards = extract_flashcards_locally(notes_text) if FLASHCARD_LOCAL_FALLBACK else []
+        if not flashcards:
+            raise
+        print(f"Model flashcards unusable ({e}); using {len(flashcards)} locally extracted flashcards")
+        return flashcards, getattr(e, 'raw_response', "")
+
+def generate_flashcard_list_with_model(notes_text):
+    """Returns (flashcards, raw_response) from Gemini. Raises ValueError/AIResponseError if unusable."""
+    sections = split_notes_sections(notes_text)
+    if len(sections) == 1:
+        flashcard_content_raw = generate_gemini_content(build_flashcard_prompt(notes_text), 'flashcards') # Reuse helper
+        print(f"Raw AI response for flashcards:\n{flashcard_content_raw}")
+        try:
+            return parse_flashcards_response(flashcard_content_raw), flashcard_content_raw
+        except (json.JSONDecodeError, ValueError, TypeError) as e:
+            raise AIResponseError(str(e), flashcard_content_raw) from e
+
+    print(f"Generating flashcards from {len(sections)} note sections")
+    per_section, flashcard_content_raw = map_sections(
+        sections, lambda section: build_flashcard_prompt(section, "3-6"), parse_flashcards_response, "flashcards")
+    flashcards = reduce_candidates(per_section, FLASHCARD_MAX_COUNT, key=lambda card: card["term"],
+                                   required_keys=["term", "definition"])
+    return flashcards, flashcard_content_raw
+
+# --- Local Flashcard Extraction ---
+# The notes we ask for are structured Markdown with bold key terms and definition bullets,
+# so flashcards can be read straight off the markdown_it token stream, with no model call.
+# FLASHCARD_MODE=local tries this first (the model is used if it finds too few cards); in the
+# default 'llm' mode it is the fallback when the model call fails or returns unusable output.
+FLASHCARD_MODE = os.getenv('FLASHCARD_MODE', 'llm') # 'llm' or 'local'
+FLASHCARD_LOCAL_FALLBACK = os.getenv('FLASHCARD_LOCAL_FALLBACK', 'true').lower() == 'true'
+FLASHCARD_LOCAL_MIN_CARDS = int(os.getenv('FLASHCARD_LOCAL_MIN_CARDS', '4'))
+FLASHCARD_TERM_MAX_WORDS = 6
+FLASHCARD_DEFINITION_MAX_CHARS = 300
+# Candidate sources, best first; a term found by several keeps the best one
+FLASHCARD_FROM_BULLET, FLASHCARD_FROM_BOLD, FLASHCARD_FROM_HEADING = 1, 2, 3
+_BOLD_OPEN, _BOLD_CLOSE = '\x02', '\x03'
+_DEFINITION_SEPARATOR_RE = re.compile(r'^\s*(?::|\s[-–—])\s*')
+_PLAIN_DEFINITION_RE = re.compile(r'^([^:]{2,60}?)(?::|\s[-–—])\s+(.{10,})$')
+_COPULA_RE = re.compile(r'^\s*(?:is|are|was|were|refers to|means|describes)\s+', re.I)
+_GENERIC_HEADING_RE = re.compile(r'\b(introduction|overview|summary|conclusion|examples?|key (points|takeaways|concepts|terms)|recap|applications)\b', re.I)
+flashcard_parser = MarkdownIt()
+
+def _marked_inline_text(token):
+    """Inline text with bold spans wrapped in _BOLD_OPEN/_BOLD_CLOSE."""
+    parts = []
+    for child in token.children or []:
+        if child.type == 'strong_open':
+            parts.append(_BOLD_OPEN)
+        elif child.type == 'strong_close':
+            parts.append(_BOLD_CLOSE)
+        elif child.type in ('softbreak', 'hardbreak'):
+            parts.append(' ')
+        elif child.type in ('text', 'code_inline'):
+            parts.append(child.content)
+    return re.sub(r'\s+', ' ', "".join(parts)).strip()
+
+def _unmark(value):
+    return value.replace(_BOLD_OPEN, '').replace(_BOLD_CLOSE, '')
+
+def _clean_term(term):
+    term = _unmark(term).strip().rstrip(':').strip()
+    if not term or len(term.split()) > FLASHCARD_TERM_MAX_WORDS or _GENERIC_HEADING_RE.search(term):
+        return None
+    return term
+
+def _clean_definition(definition):
+    definition = _DEFINITION_SEPARATOR_RE.sub('', _unmark(definition)).strip()
+    if len(definition) > FLASHCARD_DEFINITION_MAX_CHARS:
+        # Keep whole sentences where possible
+        sentences = _SENTENCE_SPLIT_RE.split(definition)
+        definition = sentences[0] if len(sentences[0]) <= FLASHCARD_DEFINITION_MAX_CHARS else definition[:FLASHCARD_DEFINITION_MAX_CHARS].rsplit(' ', 1)[0] + '…'
+    if len(definition.split()) < 2:
+        return None
+    definition = definition[0].upper() + definition[1:]
+    return definition if definition.endswith(('.', '!', '?', '…')) else definition + '.'
+
+def _bold_sentence_cards(text_value):
+    """(term, definition) for each bold term in a sentence: "X is ..." becomes the rest, else a cloze."""
+    for sentence in _SENTENCE_SPLIT_RE.split(text_value):
+        for term in re.findall(f'{_BOLD_OPEN}(.+?){_BOLD_CLOSE}', sentence):
+            marked = f'{_BOLD_OPEN}{term}{_BOLD_CLOSE}'
+            remainder = sentence.split(marked, 1)[1]
+            if sentence.startswith(marked) and _COPULA_RE.match(remainder):
+                yield term, _COPULA_RE.sub('', remainder, count=1)
             else:
-                prefix += "  "
+                yield term, sentence.replace(marked, '____', 1)
 
-            self.cell(option_indent + option_prefix_width, 5, prefix)
-            self.multi_cell(available_width - (option_indent + option_prefix_width), 5, option)
+def extract_flashcards_locally(notes_text, limit=FLASHCARD_MAX_COUNT):
+    """
+    Builds flashcards from Markdown notes, from (best first): definition bullets
+    ("**Term**: definition" / "Term - definition"), bold terms in sentences, and h2-h4 headings
+    directly followed by a paragraph. Returns up to `limit` [{"term", "definition"}] in document order.
+    """
+    if not notes_text or is_generation_error(notes_text):
+        return []
+    candidates = {} # lowercased term -> (source, position, card)
+
+    def add(source, position, term, definition):
+        term, definition = _clean_term(term), _clean_definition(definition)
+        if term and definition:
+            key = term.lower()
+            if key not in candidates or source < candidates[key][0]:
+                candidates[key] = (source, position, {"term": term, "definition": definition})
+
+    tokens = flashcard_parser.parse(notes_text)
+    list_depth = 0
+    for position, token in enumerate(tokens):
+        if token.type in ('bullet_list_open', 'ordered_list_open'):
+            list_depth += 1
+        elif token.type in ('bullet_list_close', 'ordered_list_close'):
+            list_depth -= 1
+        if token.type != 'inline':
+            continue
+        text_value = _marked_inline_text(token)
+        opener = tokens[position - 1] if position else None
+        if opener is not None and opener.type == 'heading_open':
+            # heading_open, inline, heading_close, paragraph_open, inline
+            follows = tokens[position + 2:position + 4]
+            if opener.tag in ('h2', 'h3', 'h4') and len(follows) == 2 and follows[0].type == 'paragraph_open':
+                first_sentence = _unmark(_SENTENCE_SPLIT_RE.split(_marked_inline_text(follows[1]))[0])
+                heading = _unmark(text_value)
+                add(FLASHCARD_FROM_HEADING, position, heading, re.sub(re.escape(heading), '____', first_sentence, count=1, flags=re.I))
+            continue
+        if list_depth:
+            lead = re.match(f'^{_BOLD_OPEN}(.+?){_BOLD_CLOSE}(.*)$', text_value)
+            if lead and _DEFINITION_SEPARATOR_RE.match(lead.group(2)):
+                add(FLASHCARD_FROM_BULLET, position, lead.group(1), lead.group(2))
+                continue
+            plain = _PLAIN_DEFINITION_RE.match(_unmark(text_value))
+            if plain and not lead:
+                add(FLASHCARD_FROM_BULLET, position, plain.group(1), plain.group(2))
+                continue
+        for term, definition in _bold_sentence_cards(text_value):
+            add(FLASHCARD_FROM_BOLD, position, term, definition)
+
+    best = sorted(candidates.values(), key=lambda entry: (entry[0], entry[1]))[:limit]
+    return [card for _, _, card in sorted(best, key=lambda entry: entry[1])]
+
+# --- Shared Quiz/Flashcards ---
+# Sessions backed by GeneratedContent can reuse the quiz/flashcards stored there (by the
+# warm-cache command or by an earlier user of the same topic). A session only takes the shared
+# copy while it has none of its own, so asking again still generates a fresh set.
+def take_shared_artifact(session_id, user_id, column, notes_text):
+    """Copies the shared quiz/flashcards onto the session and returns them, or None if there are none to use."""
+    try:
+        session = SavedSession.query.filter_by(id=int(session_id), user_id=user_id).first()
+    except (ValueError, TypeError):
+        return None
+    if session is None or session.content_id is None or getattr(session, column) is not None:
+        return None
+    shared = session.content
+    stored = getattr(shared, column)
+    if not stored or shared.notes != notes_text:
+        return None
+    try:
+        items = json_loads(stored)
+        setattr(session, column, stored)
+        db.session.commit()
+    except (json.JSONDecodeError, TypeError):
+        return None
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error copying shared {column} to session {session_id}: {e}")
+    return items
+
+def share_artifact(session, column, stored, notes_text):
+    """Offers a freshly generated quiz/flashcards to the session's shared content if it has none yet."""
+    shared = session.content if session.content_id is not None else None
+    if shared is not None and getattr(shared, column) is None and shared.notes == notes_text:
+        setattr(shared, column, stored)
+
+# --- Speculative Quiz/Flashcard Prefetch ---
+# Opt-in (PREFETCH_ENABLED=true): once get_content has saved a session, its quiz and flashcards
+# are generated on a small background pool. /api/generate-quiz and /api/generate-flashcards
+# then return the prefetched result, or wait for a job that is already running.
+# Prefetch only runs while the server is quiet: a job is dropped if more than
+# PREFETCH_MAX_ACTIVE_REQUESTS foreground requests are in flight when it starts, and queued
+# jobs are cancelled as soon as that threshold is crossed.
+PREFETCH_ENABLED = os.getenv('PREFETCH_ENABLED', 'false').lower() == 'true'
+PREFETCH_WORKERS = int(os.getenv('PREFETCH_WORKERS', '2'))
+PREFETCH_MAX_ACTIVE_REQUESTS = int(os.getenv('PREFETCH_MAX_ACTIVE_REQUESTS', '4'))
+PREFETCH_RESULT_TTL = int(os.getenv('PREFETCH_RESULT_TTL', '900')) # Seconds an unclaimed job is kept
+PREFETCH_CLAIM_TIMEOUT = float(os.getenv('PREFETCH_CLAIM_TIMEOUT', '30')) # Max wait on a running job before generating in the foreground
+
+# kind -> (generator returning (items, raw), SavedSession column the result is stored in)
+PREFETCH_GENERATORS = {
+    'quiz': (generate_quiz_questions, 'quiz_questions'),
+    'flashcards': (generate_flashcard_list, 'flashcards'),
+}
+
+prefetch_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix='prefetch') if PREFETCH_ENABLED else None
+_prefetch_jobs = {} # (session_id, kind) -> PrefetchJob
+_prefetch_lock = threading.Lock()
+_active_requests = 0
+
+class PrefetchJob:
+    def __init__(self, user_id, notes_text):
+        self.user_id = user_id
+        self.notes_text = notes_text
+        self.created_at = time.monotonic()
+        self.future = None
+
+def foreground_busy():
+    return _active_requests > PREFETCH_MAX_ACTIVE_REQUESTS
+
+def _count_request_start():
+    global _active_requests
+    if not request.path.startswith('/api/'): # Static frontend files are cheap; a page load shouldn't hold prefetch off
+        return
+    g.counted_as_active = True
+    with _prefetch_lock:
+        _active_requests += 1
+        busy = foreground_busy()
+        queued = [key for key, job in _prefetch_jobs.items() if busy and job.future.cancel()]
+        for key in queued:
+            del _prefetch_jobs[key]
+    if queued:
+        print(f"Cancelled {len(queued)} queued prefetch job(s) under load")
+
+def _count_request_end(exc):
+    global _active_requests
+    if not g.pop('counted_as_active', False):
+        return
+    with _prefetch_lock:
+        _active_requests -= 1
+
+def _drop_prefetch_job(key, job):
+    with _prefetch_lock:
+        if _prefetch_jobs.get(key) is job:
+            del _prefetch_jobs[key]
+
+def run_prefetch(key, job):
+    """Worker: generates one artifact and stores it on the session if the session still wants it."""
+    session_id, kind = key
+    if foreground_busy():
+        print(f"Skipping {kind} prefetch for session {session_id}: server busy")
+        _drop_prefetch_job(key, job)
+        return None
+    generate, column = PREFETCH_GENERATORS[kind]
+    try:
+        items, _ = generate(job.notes_text)
+    except Exception as e:
+        print(f"Prefetch of {kind} for session {session_id} failed: {e}")
+        _drop_prefetch_job(key, job)
+        return None
 
-        self.set_font_style('I', 10)
-        explanation_text = q_data.get('explanation', 'N/A')
-        self.set_x(self.l_margin + option_indent)
-        self.multi_cell(available_width - option_indent, 5, f"Explanation: {explanation_text}")
-        self.set_x(self.l_margin)
-        self.ln(4)
+    with app.app_context():
+        try:
+            session = db.session.get(SavedSession, session_id)
+            # Never overwrite a result the user generated in the meantime, or one for other notes
+            if session is not None and getattr(session, column) is None and session.effective_notes == job.notes_text:
+                setattr(session, column, json_dumps(items))
+                share_artifact(session, column, getattr(session, column), job.notes_text)
+                db.session.commit()
+                print(f"Prefetched {len(items)} {kind} items for session {session_id}")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error storing prefetched {kind} for session {session_id}: {e}")
+    return items
+
+def schedule_prefetch(session_id, user_id, notes_text, shared=None):
+    """Queues quiz/flashcard jobs for a new session, except those its shared content already has."""
+    if not PREFETCH_ENABLED or session_id is None or is_generation_error(notes_text) or foreground_busy():
+        return
+    now = time.monotonic()
+    with _prefetch_lock:
+        for key in [key for key, job in _prefetch_jobs.items() if now - job.created_at > PREFETCH_RESULT_TTL]:
+            del _prefetch_jobs[key]
+        for kind, (_, column) in PREFETCH_GENERATORS.items():
+            key = (session_id, kind)
+            if key in _prefetch_jobs or (shared is not None and getattr(shared, column)):
+                continue
+            job = PrefetchJob(user_id, notes_text)
+            _prefetch_jobs[key] = job
+            job.future = prefetch_executor.submit(run_prefetch, key, job)
+
+def stored_artifact(session_id, user_id, column, notes_text):
+    """The quiz/flashcards already stored on the user's session for exactly these notes, or None."""
+    session = SavedSession.query.filter_by(id=session_id, user_id=user_id).first()
+    stored = getattr(session, column) if session is not None else None
+    if not stored or session.effective_notes != notes_text:
+        return None
+    try:
+        return json_loads(stored)
+    except (json.JSONDecodeError, TypeError):
+        return None
+
+def claim_prefetched(session_id, user_id, kind, notes_text):
+    """
+    Returns the prefetched items for this session/kind: the result already stored on the session
+    (which also covers jobs that expired here, ran in another worker or finished before a restart),
+    or else the result of this process's running job, waited on for up to PREFETCH_CLAIM_TIMEOUT.
+    None means there's nothing usable (no result, different notes, still queued, failed or too
+    slow) and the caller should generate in the foreground.
+    """
+    if not PREFETCH_ENABLED:
+        return None
+    try:
+        key = (int(session_id), kind)
+    except (ValueError, TypeError):
+        return None
+    with _prefetch_lock:
+        job = _prefetch_jobs.pop(key, None)
+    stored = stored_artifact(key[0], user_id, PREFETCH_GENERATORS[kind][1], notes_text)
+    if stored is not None:
+        return stored
+    if job is None or job.user_id != user_id or job.notes_text != notes_text:
+        return None
+    if job.future.cancel():
+        return None # Not started yet: don't wait behind other prefetches
+    try:
+        return job.future.result(timeout=PREFETCH_CLAIM_TIMEOUT)
+    except FutureTimeoutError:
+        print(f"Prefetch of {kind} for session {key[0]} still running after {PREFETCH_CLAIM_TIMEOUT:g}s; generating in the foreground")
+        return None
+    except Exception:
+        return None
+
+if PREFETCH_ENABLED:
+    app.before_request(_count_request_start)
+    app.teardown_request(_count_request_end)
+
+# --- Cache Warming ---
+# `flask --app app warm-cache topics.txt` pre-generates notes, summary, videos, quiz and
+# flashcards for topics we know will be popular (e.g. the course catalog), so the first user
+# of each topic gets a cache hit. Warmed rows are pinned so they outlive their sessions.
+# All progress is stored in GeneratedContent: re-running after an interruption only does the
+# pieces that are still missing.
+RATE_LIMIT_MARKERS = ('429', 'resource has been exhausted', 'resourceexhausted', 'quota', 'rate limit')
+
+def is_rate_limited(error):
+    """True for an exception or error string that looks like an upstream rate-limit/quota response."""
+    return any(marker in str(error).lower() for marker in RATE_LIMIT_MARKERS)
+
+class RateLimitGate:
+    """Shared back-off: once any worker is rate limited, every worker pauses before its next call."""
+    def __init__(self, base_delay, max_delay):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._delay = base_delay
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        while True:
+            with self._lock:
+                remaining = self._resume_at - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def backoff(self):
+        """Starts (or extends) a pause for everyone; the pause doubles on each consecutive limit."""
+        with self._lock:
+            delay = self._delay
+            self._resume_at = max(self._resume_at, time.monotonic() + delay)
+            self._delay = min(self._delay * 2, self.max_delay)
+        return delay
+
+    def succeeded(self):
+        with self._lock:
+            self._delay = self.base_delay
+
+def call_with_backoff(func, gate, retries):
+    for attempt in range(retries + 1):
+        gate.wait()
+        try:
+            result = func()
+        except Exception as e:
+            # Quiz/flashcard failures carry the upstream error text in raw_response
+            if attempt == retries or not is_rate_limited(getattr(e, 'raw_response', None) or e):
+                raise
+            print(f"Rate limited; pausing all warm-cache workers for {gate.backoff():.1f}s")
+            continue
+        gate.succeeded()
+        return result
+
+def read_topic_list(lines):
+    """Topics from a file, one per line; blank lines, '#' comments and duplicates are skipped."""
+    topics, seen = [], set()
+    for line in lines:
+        topic = line.split('#', 1)[0].strip()
+        if topic and normalize_topic(topic) not in seen:
+            seen.add(normalize_topic(topic))
+            topics.append(topic)
+    return topics
+
+def warm_topic(topic, gate, retries):
+    """Generates and stores whatever is still missing for one topic. Returns the names of the steps done."""
+    def create_content():
+        shared, generated = get_or_create_shared_content(topic)
+        if shared is None:
+            raise RuntimeError(next((part for part in generated[:2] if is_generation_error(part)), "content was not stored"))
+        return shared
+
+    steps = []
+    shared = GeneratedContent.query.filter_by(content_key=content_cache_key(topic)).first()
+    if shared is None:
+        shared = call_with_backoff(create_content, gate, retries)
+        steps.append('notes+summary')
+    if not shared.pinned:
+        shared.pinned = True
+        db.session.commit()
+    if not shared.youtube_videos:
+        # search_youtube swallows quota errors; an empty result is simply retried on the next run
+        videos = search_youtube(topic, max_results=YOUTUBE_MAX_RESULTS)
+        if videos:
+            shared.youtube_videos = json_dumps(videos)
+            db.session.commit()
+            steps.append('videos')
+    for column, generate in (('quiz_questions', generate_quiz_questions), ('flashcards', generate_flashcard_list)):
+        if getattr(shared, column) is None:
+            items, _ = call_with_backoff(lambda: generate(shared.notes), gate, retries)
+            setattr(shared, column, json_dumps(items))
+            db.session.commit() # Commit per step so an interrupted run keeps its progress
+            steps.append('quiz' if column == 'quiz_questions' else 'flashcards')
+    return steps
+
+@app.cli.command('warm-cache')
+@click.argument('topic_file', type=click.File('r'))
+@click.option('--concurrency', default=2, show_default=True, help='Topics generated in parallel.')
+@click.option('--retries', default=5, show_default=True, help='Retries per step after a rate-limit error.')
+@click.option('--backoff', default=10.0, show_default=True, help='First pause (seconds) after a rate limit; doubles each time.')
+@click.option('--max-backoff', default=300.0, show_default=True, help='Longest pause (seconds) after a rate limit.')
+def warm_cache_command(topic_file, concurrency, retries, backoff, max_backoff):
+    """Pre-generates notes, summary, videos, quiz and flashcards for the topics in TOPIC_FILE (one per line, '-' for stdin)."""
+    topics = read_topic_list(topic_file)
+    gate = RateLimitGate(backoff, max_backoff)
+    click.echo(f"Warming {len(topics)} topics with {concurrency} workers")
+
+    def work(topic):
+        with app.app_context():
+            started = time.monotonic()
+            return warm_topic(topic, gate, retries), time.monotonic() - started
+
+    counts = {'warmed': 0, 'already cached': 0, 'failed': 0}
+    pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='warm-cache')
+    try:
+        futures = {pool.submit(work, topic): topic for topic in topics}
+        for done, future in enumerate(as_completed(futures), 1):
+            topic = futures[future]
+            try:
+                steps, elapsed = future.result()
+            except Exception as e:
+                counts['failed'] += 1
+                click.echo(f"[{done}/{len(topics)}] {topic}: FAILED ({e})")
+                continue
+            counts['warmed' if steps else 'already cached'] += 1
+            click.echo(f"[{done}/{len(topics)}] {topic}: {', '.join(steps) or 'already cached'} ({elapsed:.1f}s)")
+    except KeyboardInterrupt:
+        pool.shutdown(wait=True, cancel_futures=True)
+        click.echo("Interrupted. Finished steps are saved; run the same command again to resume.")
+        raise SystemExit(130)
+    pool.shutdown()
+    click.echo(", ".join(f"{count} {label}" for label, count in counts.items()))
+    if counts['failed']:
+        click.echo("Run the same command again to retry the failed topics.")
+        raise SystemExit(1)
 
 # --- Authentication API Routes ---
 
@@ -340,8 +2773,11 @@ def register():
     if user_exists:
         return jsonify({"msg": "Username already exists"}), 409 # 409 Conflict
 
-    # Hash the password using Bcrypt
-    hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
+    # Hash the password using Bcrypt (on the bounded hashing pool)
+    try:
+        hashed_password = hash_password(password)
+    except PasswordHashBusy:
+        return password_busy_response()
 
     # Create new user
     new_user = User(username=username, password_hash=hashed_password)
@@ -370,16 +2806,42 @@ def login():
     if not username or not password:
         return jsonify({"msg": "Missing username or password"}), 400
 
+    # Reject locked username/IP pairs before spending any bcrypt time on them
+    throttle_key = login_throttle_key(username)
+    retry_after = login_retry_after(throttle_key)
+    if retry_after:
+        response = jsonify({"msg": "Too many failed login attempts, try again later"})
+        response.headers['Retry-After'] = str(int(retry_after) + 1)
+        return response, 429
+
     # Find user
     user = User.query.filter_by(username=username).first()
 
     # Check if user exists and password is correct
-    if user and bcrypt.check_password_hash(user.password_hash, password):
+    try:
+        password_ok = bool(user) and verify_password(user.password_hash, password)
+    except PasswordHashBusy:
+        return password_busy_response()
+
+    if password_ok:
+        clear_login_failures(throttle_key)
+        # Transparently upgrade hashes made with an old cost factor
+        if password_needs_rehash(user.password_hash):
+            try:
+                user.password_hash = hash_password(password)
+                db.session.commit()
+                print(f"Rehashed password for {username} at cost {app.config['BCRYPT_LOG_ROUNDS']}")
+            except PasswordHashBusy:
+                pass # Try again on a later login
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error rehashing password for {username}: {e}")
         # Create JWT access token - identity can be user ID or username
         access_token = create_access_token(identity=str(user.id))
         print(f"User logged in: {username}")
         return jsonify(access_token=access_token)
     else:
+        record_login_failure(throttle_key)
         return jsonify({"msg": "Bad username or password"}), 401 # 401 Unauthorized
 
 
@@ -399,6 +2861,48 @@ def get_current_user():
         # Add any other user info you want to return
     })
 
+@app.route('/api/user/me', methods=['DELETE'])
+@jwt_required()
+def delete_current_user():
+    """Deletes the account; sessions and study-plan entries go with it via ON DELETE CASCADE."""
+    try:
+        current_user_id = int(get_jwt_identity())
+    except ValueError:
+        return jsonify({"msg": "Invalid user identity"}), 422
+    password = (request.get_json(silent=True) or {}).get('password')
+    if not password:
+        return jsonify({"msg": "Password confirmation required"}), 400
+
+    user = db.session.get(User, current_user_id)
+    if not user:
+        return jsonify({"msg": "User not found"}), 404
+
+    # Same lockout as login, or a stolen token could guess the password here without limit
+    throttle_key = login_throttle_key(user.username)
+    retry_after = login_retry_after(throttle_key)
+    if retry_after:
+        response = jsonify({"msg": "Too many failed password attempts, try again later"})
+        response.headers['Retry-After'] = str(int(retry_after) + 1)
+        return response, 429
+    try:
+        if not verify_password(user.password_hash, password):
+            record_login_failure(throttle_key)
+            return jsonify({"msg": "Bad password"}), 401
+    except PasswordHashBusy:
+        return password_busy_response()
+    clear_login_failures(throttle_key)
+
+    try:
+        # A single DELETE; the database removes the user's rows without loading them
+        db.session.execute(db.delete(User).where(User.id == current_user_id))
+        db.session.commit()
+        print(f"Deleted user {current_user_id} and all their data")
+        return jsonify({"message": "Account deleted"}), 200
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error deleting user {current_user_id}: {e}")
+        return jsonify({"error": f"Failed to delete account: {str(e)}"}), 500
+
 # --- Keep other API routes (get-content, quiz, pdf, flashcards, planner, chat) ---
 # We will modify these later to use authentication and save data.
 
@@ -426,6 +2930,76 @@ def get_user_sessions():
         print(f"Error fetching sessions for user {current_user_id}: {e}")
         return jsonify({"error": f"Failed to fetch sessions: {str(e)}"}), 500
 
+@app.route('/api/sessions/search', methods=['GET'])
+@jwt_required()
+def search_sessions():
+    """
+    Full-text search over the current user's saved sessions.
+    Query params: q (required), page (default 1), per_page (default 20, max 100).
+    Results are ranked by bm25 (topic matches weigh most) with highlighted snippets.
+    """
+    current_user_id_str = get_jwt_identity()
+    try:
+        current_user_id = int(current_user_id_str)
+    except ValueError:
+        return jsonify({"msg": "Invalid user identity"}), 422
+
+    raw_query = request.args.get('q', '').strip()
+    if not raw_query:
+        return jsonify({"error": "Missing 'q'"}), 400
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        per_page = min(max(int(request.args.get('per_page', 20)), 1), 100)
+    except ValueError:
+        return jsonify({"error": "'page' and 'per_page' must be integers"}), 400
+
+    fts_query = build_fts_query(raw_query, current_user_id)
+    if fts_query is None:
+        return jsonify({"query": raw_query, "page": page, "per_page": per_page, "total": 0, "results": []})
+
+    try:
+        total = db.session.execute(
+            text(f"SELECT count(*) FROM {SEARCH_INDEX_TABLE} WHERE {SEARCH_INDEX_TABLE} MATCH :q"),
+            {"q": fts_query}
+        ).scalar()
+
+        # bm25 weights: topic, notes, summary, flashcard_terms, owner (owner never affects rank)
+        rows = db.session.execute(text(f"""
+            SELECT s.id, s.topic, s.created_at,
+                   highlight({SEARCH_INDEX_TABLE}, 0, :mark_open, :mark_close) AS topic_highlight,
+                   snippet({SEARCH_INDEX_TABLE}, -1, :mark_open, :mark_close, '...', 16) AS snippet,
+                   bm25({SEARCH_INDEX_TABLE}, 10.0, 1.0, 3.0, 5.0, 0.0) AS score
+            FROM {SEARCH_INDEX_TABLE}
+            JOIN saved_session s ON s.id = {SEARCH_INDEX_TABLE}.rowid
+            WHERE {SEARCH_INDEX_TABLE} MATCH :q
+            ORDER BY score
+            LIMIT :limit OFFSET :offset
+        """), {
+            "q": fts_query, "limit": per_page, "offset": (page - 1) * per_page,
+            "mark_open": SEARCH_MARK_OPEN, "mark_close": SEARCH_MARK_CLOSE
+        }).mappings().all()
+
+        results = [{
+            "id": row["id"],
+            "topic": row["topic"],
+            "topic_highlight": render_search_highlight(row["topic_highlight"]),
+            "snippet": render_search_highlight(row["snippet"]),
+            "score": row["score"],
+            # Raw SQL returns SQLite's stored string rather than a datetime
+            "created_at": datetime.fromisoformat(str(row["created_at"])).isoformat() if row["created_at"] else None
+        } for row in rows]
+        print(f"Search '{raw_query}' for user {current_user_id}: {total} matches") # Add log
+        return jsonify({
+            "query": raw_query,
+            "page": page,
+            "per_page": per_page,
+            "total": total,
+            "results": results
+        })
+    except Exception as e:
+        print(f"Error searching sessions for user {current_user_id}: {e}")
+        return jsonify({"error": f"Failed to search sessions: {str(e)}"}), 500
+
 @app.route('/api/sessions/<int:session_id>', methods=['GET'])
 @jwt_required()
 def get_session_details(session_id):
@@ -444,22 +3018,34 @@ def get_session_details(session_id):
 
         # Parse JSON strings back into Python objects before sending
         # Add default empty list/dict if parsing fails or field is None
-        try: videos = json.loads(session.youtube_videos) if session.youtube_videos else []
+        youtube_videos = session.effective_youtube_videos
+        try: videos = json_loads(youtube_videos) if youtube_videos else []
         except (json.JSONDecodeError, TypeError): videos = []
 
-        try: quiz = json.loads(session.quiz_questions) if session.quiz_questions else []
+        try: quiz = json_loads(session.quiz_questions) if session.quiz_questions else []
         except (json.JSONDecodeError, TypeError): quiz = []
 
-        try: flashcards_data = json.loads(session.flashcards) if session.flashcards else []
+        try: flashcards_data = json_loads(session.flashcards) if session.flashcards else []
         except (json.JSONDecodeError, TypeError): flashcards_data = []
 
+        # Rows rendered by an older renderer version are upgraded on first read
+        content_source = session.content_source
+        if ensure_html_current(content_source):
+            try:
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error storing re-rendered HTML for session {session_id}: {e}")
+
 
         print(f"Fetched details for session {session_id} for user {current_user_id}") # Add log
         return jsonify({
             "id": session.id,
             "topic": session.topic,
-            "notes": session.notes,
-            "summary": session.summary,
+            "notes": session.effective_notes,
+            "summary": session.effective_summary,
+            "notes_html": content_source.notes_html,
+            "summary_html": content_source.summary_html,
             "videos": videos,
             "quizQuestions": quiz, # Match frontend state name
             "flashcards": flashcards_data, # Match frontend state name
@@ -518,51 +3104,48 @@ def get_content():
 
     print(f"User {current_user_id} requested topic: {topic}")
 
-    # --- Generate Content using Gemini ---
-    # Prompt for detailed notes
-    notes_prompt = f"""
-    Generate detailed study notes for the topic: "{topic}".
-    Structure the notes clearly with headings, bullet points, and explanations where appropriate.
-    Assume the audience is a student trying to understand this topic.
-    Focus on accuracy and clarity.
-    """
-    notes = generate_gemini_content(notes_prompt)
-
-    # Prompt for a concise summary
-    summary_prompt = f"""
-    Provide a concise summary (2-4 paragraphs) of the main points for the topic: "{topic}".
-    Highlight the key concepts and definitions.
-    """
-    # Alternatively, summarize the generated notes:
-    # summary_prompt = f"Summarize the following notes concisely (2-4 paragraphs):\n\n{notes}"
-    summary = generate_gemini_content(summary_prompt)
-
-    # --- Search YouTube ---
-    videos = search_youtube(topic)
+    # --- Reuse shared content for this topic, or generate it ---
+    shared, generated = get_or_create_shared_content(topic)
+    if shared is not None:
+        notes, summary = shared.notes, shared.summary
+        try: videos = json_loads(shared.youtube_videos) if shared.youtube_videos else []
+        except (json.JSONDecodeError, TypeError): videos = []
+        print(f"{'Reusing' if generated is None else 'Created'} shared content {shared.id} for topic: {topic}")
+    else:
+        notes, summary, videos = generated
 
     # --- Save to Database ---
     session_id = None
     try:
-        new_session = SavedSession(
-            user_id=current_user_id,
-            topic=topic,
-            notes=notes,
-            summary=summary,
-            # Store lists/dicts as JSON strings in the Text column
-            youtube_videos=json.dumps(videos) if videos else None,
-            # Quiz/Flashcards initially null, will be updated later
-            quiz_questions=None,
-            flashcards=None
-        )
+        if shared is not None:
+            # Point at the shared artifact; ref_count is bumped by a DB trigger
+            new_session = SavedSession(user_id=current_user_id, topic=topic, content_id=shared.id)
+        else:
+            new_session = SavedSession(
+                user_id=current_user_id,
+                topic=topic,
+                notes=notes,
+                summary=summary,
+                # Store lists/dicts as JSON strings in the Text column
+                youtube_videos=json_dumps(videos) if videos else None,
+                # Quiz/Flashcards initially null, will be updated later
+                quiz_questions=None,
+                flashcards=None
+            )
         db.session.add(new_session)
         db.session.commit()
         session_id = new_session.id # Get the ID of the newly created session
         print(f"Saved new session {session_id} for user {current_user_id}")
+        # HTML was rendered by the before_insert hook on whichever row holds the content
+        notes_html, summary_html = new_session.content_source.notes_html, new_session.content_source.summary_html
+        # Opt-in: start the quiz/flashcards the user will most likely ask for next
+        schedule_prefetch(session_id, current_user_id, notes, shared)
     except Exception as e:
         db.session.rollback()
         print(f"Error saving session for user {current_user_id}: {e}")
         # Decide if you should still return content even if saving fails
         # For now, we'll return content but maybe indicate save failure
+        notes_html, summary_html = render_markdown_html(notes), render_markdown_html(summary)
 
     # --- Return Results ---
     return jsonify({
@@ -570,8 +3153,231 @@ def get_content():
         "topic": topic, # Also return topic for consistency
         "notes": notes,
         "summary": summary,
-        "videos": videos
+        "notes_html": notes_html,
+        "summary_html": summary_html,
+        "videos": videos,
+        "shared": shared is not None
+    })
+
+
+@app.route('/api/sessions/<int:session_id>/regenerate', methods=['POST'])
+@jwt_required()
+def regenerate_session(session_id):
+    """
+    Regenerates notes, summary and videos for one of the user's sessions.
+    Copy-on-write: the session detaches from any shared content and keeps its own copy,
+    so other users pointing at the same topic are unaffected.
+    """
+    current_user_id_str = get_jwt_identity()
+    try:
+        current_user_id = int(current_user_id_str)
+    except ValueError:
+        return jsonify({"msg": "Invalid user identity"}), 422
+
+    session = SavedSession.query.filter_by(id=session_id, user_id=current_user_id).first()
+    if session is None:
+        return jsonify({"error": "Session not found or access denied"}), 404
+
+    print(f"User {current_user_id} regenerating session {session_id}: {session.topic}")
+    notes, summary, videos = generate_topic_content(session.topic)
+
+    try:
+        session.notes = notes
+        session.summary = summary
+        session.youtube_videos = json_dumps(videos) if videos else None
+        # Quiz/flashcards were built from the old notes
+        session.quiz_questions = None
+        session.flashcards = None
+        # Releasing the shared row decrements (and possibly frees) it via a DB trigger
+        session.content_id = None
+        db.session.commit()
+        print(f"Regenerated session {session_id} for user {current_user_id}")
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error regenerating session {session_id} for user {current_user_id}: {e}")
+        return jsonify({"error": f"Failed to save regenerated session: {str(e)}"}), 500
+
+    return jsonify({
+        "session_id": session.id,
+        "topic": session.topic,
+        "notes": notes,
+        "summary": summary,
+        "notes_html": session.notes_html,
+        "summary_html": session.summary_html,
+        "videos": videos,
+        "shared": False
     })
+# --- Batch (Syllabus) Generation ---
+BATCH_MAX_TOPICS = int(os.getenv('BATCH_MAX_TOPICS', '50'))
+BATCH_COMMIT_SIZE = int(os.getenv('BATCH_COMMIT_SIZE', '5'))
+BATCH_COMMIT_INTERVAL = float(os.getenv('BATCH_COMMIT_INTERVAL', '1.0')) # Max seconds a finished topic waits for its commit
+
+def save_batch_results(user_id, items):
+    """
+    Saves one SavedSession per item in a single commit, creating shared content for fresh
+    generations. Each item is a dict with topic, content_key, shared (GeneratedContent or None)
+    and, for generated topics, notes/summary/videos. Sets item["session"] on success.
+    Falls back to saving items one at a time if the batch commit fails (e.g. another request
+    created the same shared content concurrently).
+    """
+    def stage(item):
+        shared = item["shared"]
+        if shared is None and not (is_generation_error(item["notes"]) or is_generation_error(item["summary"])):
+            shared = GeneratedContent.query.filter_by(content_key=item["content_key"]).first() or GeneratedContent(
+                content_key=item["content_key"],
+                topic=normalize_topic(item["topic"]),
+                notes=item["notes"],
+                summary=item["summary"],
+                youtube_videos=json_dumps(item["videos"]) if item["videos"] else None
+            )
+            item["shared"] = shared
+        if shared is not None:
+            session = SavedSession(user_id=user_id, topic=item["topic"], content=shared)
+        else:
+            session = SavedSession(
+                user_id=user_id, topic=item["topic"], notes=item["notes"], summary=item["summary"],
+                youtube_videos=json_dumps(item["videos"]) if item["videos"] else None
+            )
+        db.session.add(session)
+        item["session"] = session
+
+    try:
+        for item in items:
+            stage(item)
+        db.session.commit()
+        return
+    except Exception as e:
+        db.session.rollback()
+        print(f"Batch commit of {len(items)} sessions failed, saving individually: {e}")
+
+    for item in items:
+        if item["shared"] is not None and inspect(item["shared"]).transient:
+            item["shared"] = None # Discard the unsaved row; stage() looks it up again
+        try:
+            stage(item)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            item["session"] = None
+            item["error"] = f"Failed to save session: {e}"
+
+def batch_result_line(index, item):
+    """One NDJSON line describing a finished topic."""
+    shared, session = item["shared"], item.get("session")
+    source = shared if shared is not None else session
+    if shared is not None:
+        notes, summary = shared.notes, shared.summary
+        try: videos = json_loads(shared.youtube_videos) if shared.youtube_videos else []
+        except (json.JSONDecodeError, TypeError): videos = []
+    else:
+        notes, summary, videos = item["notes"], item["summary"], item["videos"]
+    return json_dumps({
+        "type": "result",
+        "index": index,
+        "topic": item["topic"],
+        "session_id": session.id if session is not None else None,
+        "notes": notes,
+        "summary": summary,
+        "notes_html": source.notes_html if source is not None else render_markdown_html(notes),
+        "summary_html": source.summary_html if source is not None else render_markdown_html(summary),
+        "videos": videos,
+        "shared": shared is not None,
+        "error": item.get("error")
+    }) + "\n"
+
+
+@app.route('/api/get-content/batch', methods=['POST'])
+@jwt_required()
+def get_content_batch():
+    """
+    Generates content for a list of topics (e.g. a syllabus) with bounded parallelism.
+    Body: {"topics": ["Mitosis", "Meiosis", ...]}
+    Streams newline-delimited JSON: one {"type": "result", ...} line per topic as it finishes
+    (same fields as /api/get-content plus "index"), then a final {"type": "summary", ...} line.
+    Topics that already have shared content are returned immediately without generation.
+    """
+    current_user_id_str = get_jwt_identity()
+    try:
+        current_user_id = int(current_user_id_str)
+    except ValueError:
+        return jsonify({"msg": "Invalid user identity in token"}), 422
+
+    if not request.is_json: return jsonify({"error": "Request must be JSON"}), 400
+    topics = request.get_json().get('topics')
+    if not isinstance(topics, list) or not topics:
+        return jsonify({"error": "Missing 'topics' list"}), 400
+    if len(topics) > BATCH_MAX_TOPICS:
+        return jsonify({"error": f"At most {BATCH_MAX_TOPICS} topics per batch"}), 400
+    if not all(isinstance(t, str) and t.strip() for t in topics):
+        return jsonify({"error": "Every topic must be a non-empty string"}), 400
+    topics = [t.strip() for t in topics]
+
+    print(f"User {current_user_id} requested batch of {len(topics)} topics")
+
+    def generate_stream():
+        # Group identical topics so each distinct one is generated at most once
+        indexes_by_key = {}
+        for index, topic in enumerate(topics):
+            indexes_by_key.setdefault(content_cache_key(topic), []).append(index)
+        existing = {
+            content.content_key: content
+            for content in GeneratedContent.query.filter(GeneratedContent.content_key.in_(list(indexes_by_key))).all()
+        }
+
+        ready = [] # (index, item) waiting for the next batched commit
+        futures = {}
+        for key, indexes in indexes_by_key.items():
+            if key in existing:
+                for index in indexes:
+                    ready.append((index, {"topic": topics[index], "content_key": key, "shared": existing[key]}))
+            else:
+                futures[generation_executor.submit(generate_topic_content, topics[indexes[0]])] = key
+
+        completed = failed = 0
+        # Cache hits are ready right away, so let them go out in the first commit
+        first_ready_at = time.monotonic() - BATCH_COMMIT_INTERVAL
+        try:
+            while ready or futures:
+                # Commit when enough topics are ready, they've waited long enough, or nothing is left
+                waited = time.monotonic() - first_ready_at
+                if ready and (len(ready) >= BATCH_COMMIT_SIZE or waited >= BATCH_COMMIT_INTERVAL or not futures):
+                    save_batch_results(current_user_id, [item for _, item in ready])
+                    for index, item in ready:
+                        if item.get("session") is None or is_generation_error(item.get("notes", "ok")):
+                            failed += 1
+                        completed += 1
+                        yield batch_result_line(index, item)
+                    print(f"Batch for user {current_user_id}: committed {len(ready)} sessions ({completed}/{len(topics)})")
+                    ready = []
+
+                if futures:
+                    done, _ = wait(list(futures), timeout=BATCH_COMMIT_INTERVAL, return_when=FIRST_COMPLETED)
+                    if done and not ready:
+                        first_ready_at = time.monotonic()
+                    for future in done:
+                        key = futures.pop(future)
+                        try:
+                            notes, summary, videos = future.result()
+                        except Exception as e:
+                            notes = summary = f"Error generating content: {e}"
+                            videos = []
+                        for index in indexes_by_key[key]:
+                            ready.append((index, {
+                                "topic": topics[index], "content_key": key, "shared": None,
+                                "notes": notes, "summary": summary, "videos": videos
+                            }))
+            yield json_dumps({"type": "summary", "total": len(topics), "completed": completed, "failed": failed}) + "\n"
+        finally:
+            # Client went away: don't keep generating topics nobody will receive
+            for future in futures:
+                future.cancel()
+
+    return Response(
+        stream_with_context(generate_stream()),
+        mimetype='application/x-ndjson',
+        headers={'X-Accel-Buffering': 'no', 'Cache-Control': 'no-cache'} # Let proxies pass lines through
+    )
+
 @app.route('/api/generate-quiz', methods=['POST'])
 @jwt_required() # Protect
 def generate_quiz():
@@ -591,76 +3397,28 @@ def generate_quiz():
     print(f"User {current_user_id} generating quiz for session {session_id}")
 
 
-    # --- Generate Quiz Questions using Gemini ---
-    # UPDATED, STRICTER PROMPT:
-    quiz_prompt = f"""
-    Based ONLY on the following study notes, generate exactly 5 multiple-choice quiz questions suitable for a student.
-    For each question, provide:
-    1. The question text (string).
-    2. A list of 4 distinct options (list of strings).
-    3. The correct answer (string, exactly matching one of the options).
-    4. A brief explanation (string) for why the answer is correct, based on the notes.
-
-    Output the result ONLY as a valid JSON list (starting with '[' and ending with ']').
-    Each element in the list must be an object with keys: "question", "options", "correct_answer", and "explanation".
-
-    IMPORTANT: Do NOT include any introductory text, concluding remarks, code block markers (like ```json), or ANY characters whatsoever before the opening '[' or after the closing ']'. The entire response MUST be the JSON list itself.
-
-    Study Notes:
-    ---
-    {notes_text}
-    ---
-    """
-
-    quiz_content_raw = generate_gemini_content(quiz_prompt) # Use the existing helper
-
-    print(f"Raw AI response for quiz:\n{quiz_content_raw}") # Keep logging the raw response
+    regenerate = bool(data.get('regenerate')) # The user already has a quiz and wants a new one
+    prefetched = None if regenerate else claim_prefetched(session_id, current_user_id, 'quiz', notes_text)
+    if prefetched is not None:
+        print(f"Returning prefetched quiz for session {session_id}")
+        return jsonify(prefetched) # Already stored by the prefetch job
+    cached = take_shared_artifact(session_id, current_user_id, 'quiz_questions', notes_text)
+    if cached is not None:
+        print(f"Returning shared quiz for session {session_id}")
+        return jsonify(cached)
 
-    # --- Parse the Response ---
+    # --- Generate & Parse Quiz Questions using Gemini ---
+    quiz_content_raw = ""
     try:
-        # Attempt to extract JSON list using regex - more robust!
-        # This looks for the first '[' that seems to start a list/object structure
-        # and the last ']' that appropriately closes it. Handles nested structures.
-        match = re.search(r'\[\s*\{.*?\}\s*\]', quiz_content_raw, re.DOTALL)
-
-        if not match:
-             # Fallback: Maybe it returned a single object instead of a list? Less likely based on prompt.
-             match = re.search(r'\{\s*".*?":.*?\s*\}', quiz_content_raw, re.DOTALL)
-             if match:
-                 print("Warning: AI returned a single JSON object, expected a list. Attempting to wrap in a list.")
-                 potential_json = f"[{match.group(0)}]" # Wrap the single object in a list
-             else:
-                 raise ValueError("Could not find JSON list or object structure in the AI response using regex.")
-        else:
-             potential_json = match.group(0)
-
-
-        print(f"Attempting to parse extracted JSON:\n{potential_json}")
-        questions = json.loads(potential_json)
-
-        # Basic validation
-        if not isinstance(questions, list):
-            # If we wrapped a single object, this check might fail unless we re-assign 'questions'
-            if isinstance(questions, dict) and potential_json.startswith('['): # Check if we manually wrapped it
-                 questions = [questions] # Put the single dict into a list
-            else:
-                 raise ValueError("Parsed JSON is not a list.")
-
-        if not questions:
-             raise ValueError("Parsed JSON list is empty.")
-
-        # Check keys of the first question object
-        required_keys = ["question", "options", "correct_answer", "explanation"]
-        if not all(k in questions[0] for k in required_keys):
-             missing_keys = [k for k in required_keys if k not in questions[0]]
-             raise ValueError(f"Parsed JSON object missing required keys: {missing_keys}")
-
+        # Long notes are split by heading and generated per section in parallel
+        questions, quiz_content_raw = generate_quiz_questions(notes_text)
         print(f"Successfully parsed {len(questions)} quiz questions.")
     # --- Update Database ---
         try:
             session_to_update = SavedSession.query.filter_by(id=session_id, user_id=current_user_id).first()
             if session_to_update:
-                session_to_update.quiz_questions = json.dumps(questions) # Store as JSON string
+                session_to_update.quiz_questions = json_dumps(questions) # Store as JSON string
+                share_artifact(session_to_update, 'quiz_questions', session_to_update.quiz_questions, notes_text)
                 db.session.commit()
                 print(f"Updated session {session_id} with quiz questions.")
             else:
@@ -675,6 +3433,7 @@ def generate_quiz():
     
 
     except (json.JSONDecodeError, ValueError, TypeError) as e: # Catch different parsing/validation errors
+        quiz_content_raw = getattr(e, 'raw_response', quiz_content_raw)
         error_message = f"Failed to process AI response for quiz: {e}"
         print(error_message)
         # Log the raw response again in case of error for debugging
@@ -688,6 +3447,33 @@ def generate_quiz():
         print(f"Raw AI response was:\n{quiz_content_raw}")
         return jsonify({"error": error_message, "raw_response_snippet": quiz_content_raw[:500] + "..."}), 500
     
+def get_stored_notes_html(session_id, notes_text):
+    """
+    Returns the pre-rendered notes HTML for the current user's session if it was rendered
+    from exactly this notes text, otherwise None. Works only when a valid JWT was sent; an
+    expired or bad token just means the notes are rendered again (PDF export needs no login).
+    """
+    if session_id is None:
+        return None
+    try:
+        verify_jwt_in_request(optional=True)
+    except (JWTExtendedException, PyJWTError):
+        return None
+    current_user_id_str = get_jwt_identity()
+    if not current_user_id_str:
+        return None
+    try:
+        session = SavedSession.query.filter_by(id=int(session_id), user_id=int(current_user_id_str)).first()
+    except (ValueError, TypeError):
+        return None
+    if session is None or session.effective_notes != notes_text:
+        return None
+    content_source = session.content_source
+    if content_source.html_version != HTML_RENDERER_VERSION:
+        return None
+    return content_source.notes_html
+
+
 @app.route('/api/generate-pdf', methods=['POST'])
 def generate_pdf_route():
     if not request.is_json:
@@ -697,91 +3483,30 @@ def generate_pdf_route():
     notes_text = data.get('notes')
     quiz_data = data.get('quizQuestions') # List of {question, correct_answer, ...}
     topic = data.get('topic', 'Study Notes')
+    session_id = data.get('session_id') # Optional: lets us reuse the HTML rendered at save time
 
     if not notes_text:
         return jsonify({"error": "Missing 'notes' text to generate PDF"}), 400
 
     try:
         # --- Convert Markdown to HTML ---
-        # Use extensions for better formatting (e.g., tables, fenced code blocks if needed later)
-        notes_html = markdown(notes_text, extensions=['fenced_code', 'tables'])
-
-        # --- Prepare Quiz HTML (Question & Answer only) ---
-        quiz_html = ""
-        if quiz_data and isinstance(quiz_data, list) and len(quiz_data) > 0:
-            quiz_html += "<h2>Quiz Review</h2><ol>"
-            for i, q in enumerate(quiz_data):
-                question_text = q.get('question', 'N/A')
-                # Convert potential markdown in question to HTML
-                question_html = markdown(question_text, extensions=['fenced_code'])
-                # Remove surrounding <p> tags markdown might add
-                question_html = question_html.replace('<p>', '').replace('</p>', '').strip()
-
-                correct_answer = q.get('correct_answer', 'N/A')
-                # Convert potential markdown in answer to HTML
-                answer_html = markdown(correct_answer, extensions=['fenced_code'])
-                answer_html = answer_html.replace('<p>', '').replace('</p>', '').strip()
-
-                quiz_html += f"<li><strong>Question:</strong> {question_html}<br/>"
-                quiz_html += f"<strong>Answer:</strong> {answer_html}</li><br/>" # Add line break for spacing
-            quiz_html += "</ol>"
-
-        # --- Combine into Full HTML Document ---
-        # Basic HTML structure with some CSS for styling
-        # Using default serif font, easy to read. Add more CSS as needed.
-        html_content = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <style>
-                @page {{ margin: 1in; }} /* Set page margins */
-                body {{ font-family: Georgia, serif; font-size: 11pt; line-height: 1.4; }}
-                h1 {{ font-size: 18pt; font-weight: bold; text-align: center; margin-bottom: 20px; }}
-                h2 {{ font-size: 14pt; font-weight: bold; margin-top: 15px; margin-bottom: 8px; border-bottom: 1px solid #ccc; padding-bottom: 2px;}}
-                p {{ margin-top: 0; margin-bottom: 10px; }}
-                ul, ol {{ margin-left: 20px; margin-bottom: 10px;}}
-                li {{ margin-bottom: 5px; }}
-                strong, b {{ font-weight: bold; }}
-                em, i {{ font-style: italic; }}
-                pre {{ background-color: #f0f0f0; padding: 10px; border-radius: 4px; white-space: pre-wrap; word-wrap: break-word; }}
-                code {{ font-family: 'Courier New', monospace; background-color: #f0f0f0; padding: 1px 3px; border-radius: 3px;}}
-                /* Add more styles as needed */
-            </style>
-        </head>
-        <body>
-            <h1>{topic}</h1>
-
-            <h2>Study Notes</h2>
-            {notes_html}
-
-            {quiz_html}
-        </body>
-        </html>
-        """
-
-        # --- Generate PDF using xhtml2pdf ---
-        result_buffer = io.BytesIO() # Create a buffer to hold PDF data
-
-        # Convert HTML to PDF
-        pisa_status = pisa.CreatePDF(
-            src=io.StringIO(html_content), # Source HTML (as string IO)
-            dest=result_buffer             # Destination buffer
-        )
+        if PDF_ENGINE == 'fpdf':
+            # Drawn straight from the Markdown; no HTML needed
+            pdf_bytes = draw_notes_pdf(topic, notes_text, quiz_data)
+        else:
+            # Prefer the HTML stored with the session; render only for unsaved/edited notes
+            notes_html = get_stored_notes_html(session_id, notes_text) or render_markdown_html(notes_text)
 
-        # Check for errors
-        if pisa_status.err:
-            raise Exception(f"PDF Generation Error: {pisa_status.err}")
+            # --- Generate PDF using xhtml2pdf ---
+            pdf_bytes = render_notes_pdf(topic, notes_html, quiz_data)
 
         # --- Send PDF Response ---
-        result_buffer.seek(0) # Reset buffer position to the beginning
-
         safe_topic = re.sub(r'[^a-zA-Z0-9_]', '_', topic)
         download_filename = f"{safe_topic}_Study_Notes.pdf"
 
         # Use Flask Response object for more control over headers
         return Response(
-            result_buffer.getvalue(), # Get bytes from buffer
+            pdf_bytes,
             mimetype='application/pdf',
             headers={
                 'Content-Disposition': f'attachment;filename="{download_filename}"'
@@ -811,55 +3536,28 @@ def generate_flashcards_route():
 
         print(f"User {current_user_id} generating flashcards for session {session_id}")
 
-        # --- Generate Flashcards using Gemini ---
-        flashcard_prompt = f"""
-        Analyze the following study notes and extract key terms and their definitions.
-        Generate a list of flashcards based ONLY on the provided text.
-        For each flashcard, provide:
-        1. "term": The key term or concept (string, keep it concise).
-        2. "definition": A clear and concise definition of the term based on the notes (string).
-
-        Output the result ONLY as a valid JSON list where each element is an object with keys "term" and "definition".
-        Aim for around 5-15 flashcards, focusing on the most important concepts.
-
-        IMPORTANT: Do NOT include any introductory text, concluding remarks, code block markers (like ```json), or ANY characters whatsoever before the opening '[' or after the closing ']'. The entire response MUST be the JSON list itself.
-
-        Study Notes:
-        ---
-        {notes_text}
-        ---
-        """
-
-        flashcard_content_raw = generate_gemini_content(flashcard_prompt) # Reuse helper
-
-        print(f"Raw AI response for flashcards:\n{flashcard_content_raw}")
-
-        # --- Parse the Response (Similar to Quiz Parsing) ---
+        regenerate = bool(data.get('regenerate'))
+        prefetched = None if regenerate else claim_prefetched(session_id, current_user_id, 'flashcards', notes_text)
+        if prefetched is not None:
+            print(f"Returning prefetched flashcards for session {session_id}")
+            return jsonify(prefetched) # Already stored by the prefetch job
+        cached = take_shared_artifact(session_id, current_user_id, 'flashcards', notes_text)
+        if cached is not None:
+            print(f"Returning shared flashcards for session {session_id}")
+            return jsonify(cached)
+
+        # --- Generate & Parse Flashcards using Gemini (Similar to Quiz) ---
+        flashcard_content_raw = ""
         try:
-            # Attempt to extract JSON list using regex
-            match = re.search(r'\[\s*\{.*?\}\s*\]', flashcard_content_raw, re.DOTALL)
-            if not match:
-                raise ValueError("Could not find JSON list structure in the AI response using regex.")
-
-            potential_json = match.group(0)
-            print(f"Attempting to parse extracted flashcard JSON:\n{potential_json}")
-            flashcards = json.loads(potential_json)
-
-                        # Basic validation
-            if not isinstance(flashcards, list):
-                raise ValueError("Parsed JSON is not a list.")
-            # Allow empty list as valid response
-            if flashcards and not all(k in flashcards[0] for k in ["term", "definition"]):
-                missing_keys = [k for k in ["term", "definition"] if k not in flashcards[0]]
-                raise ValueError(f"Parsed JSON object missing required keys: {missing_keys}")
-
+            flashcards, flashcard_content_raw = generate_flashcard_list(notes_text)
             print(f"Successfully parsed {len(flashcards)} flashcards.")
             
             # --- Update Database ---
             try:
                 session_to_update = SavedSession.query.filter_by(id=session_id, user_id=current_user_id).first()
                 if session_to_update:
-                    session_to_update.flashcards = json.dumps(flashcards) # Store as JSON string
+                    session_to_update.flashcards = json_dumps(flashcards) # Store as JSON string
+                    share_artifact(session_to_update, 'flashcards', session_to_update.flashcards, notes_text)
                     db.session.commit()
                     print(f"Updated session {session_id} with flashcards.")
                 else:
@@ -871,6 +3569,7 @@ def generate_flashcards_route():
             return jsonify(flashcards) # Return generated flashcards
 
         except (json.JSONDecodeError, ValueError, TypeError) as e:
+            flashcard_content_raw = getattr(e, 'raw_response', flashcard_content_raw)
             error_message = f"Failed to process AI response for flashcards: {e}"
             print(error_message)
             print(f"Problematic Raw AI response was:\n{flashcard_content_raw}")
@@ -900,16 +3599,7 @@ def download_flashcards_route():
 
         try:
             # --- Generate CSV String ---
-            # Simple CSV generation: Header + one line per card
-            # Wrap fields in double quotes to handle potential commas within term/definition
-            # Double up existing double quotes within fields to escape them
-            csv_lines = ['"Term","Definition"'] # Header row
-            for card in flashcards:
-                term = str(card.get('term', '')).replace('"', '""') # Escape double quotes
-                definition = str(card.get('definition', '')).replace('"', '""') # Escape double quotes
-                csv_lines.append(f'"{term}","{definition}"')
-
-            csv_data = "\n".join(csv_lines)
+            csv_data = flashcards_to_csv(flashcards)
 
             # --- Send CSV Response ---
             safe_topic = re.sub(r'[^a-zA-Z0-9_]', '_', topic)
@@ -932,6 +3622,55 @@ def download_flashcards_route():
     #    app.run(debug=True)
 
 # --- Study Planner API Routes ---
+STUDY_PLAN_BATCH_LIMIT = int(os.getenv('STUDY_PLAN_BATCH_LIMIT', '500')) # Operations per /api/study-plan/batch call
+
+def plan_entry_dict(entry):
+    return {
+        "id": entry.id,
+        "topic": entry.topic,
+        "review_date": entry.review_date,
+        "revision": entry.revision,
+    }
+
+def study_plan_changes(user_id, since):
+    """
+    Entries changed and entry ids deleted after revision `since`, plus the revision to send next
+    time. Answers with the full list ("full": true) when the client has nothing yet, or when
+    tombstones it would need have been purged.
+    """
+    # Read first: a write landing during the queries is then sent again next time, never missed
+    revision = current_plan_revision(user_id)
+    floor = db.session.get(SyncCounter, PLAN_TOMBSTONE_FLOOR)
+    full = since <= 0 or since > revision or since < (floor.value if floor else 0)
+
+    query = StudyPlanEntry.query.filter_by(user_id=user_id)
+    if not full:
+        query = query.filter(StudyPlanEntry.revision > since)
+    entries = query.order_by(StudyPlanEntry.review_date, StudyPlanEntry.id).all()
+    deleted = [] if full else [
+        row.entry_id for row in
+        StudyPlanTombstone.query.filter(StudyPlanTombstone.user_id == user_id, StudyPlanTombstone.revision > since)
+    ]
+    return {"revision": revision, "full": full, "entries": [plan_entry_dict(e) for e in entries], "deleted": deleted}
+
+def is_entry_id(value):
+    return isinstance(value, int) and not isinstance(value, bool) # JSON true/false arrive as bools, which are ints
+
+def validate_plan_fields(item, require_all):
+    """Returns an error message for a bad topic/review_date in `item`, or None."""
+    if not isinstance(item, dict):
+        return "Each item must be an object"
+    if require_all and not (item.get('topic') and item.get('review_date')):
+        return "Missing 'topic' or 'review_date'"
+    if 'topic' in item and not (isinstance(item['topic'], str) and item['topic'].strip() and len(item['topic']) <= 200):
+        return "'topic' must be a non-empty string of at most 200 characters"
+    if 'review_date' in item:
+        try:
+            datetime.strptime(str(item['review_date']), '%Y-%m-%d')
+        except ValueError:
+            return "Invalid date format. Use YYYY-MM-DD."
+    return None
+
 
 @app.route('/api/study-plan', methods=['POST'])
 @jwt_required()
@@ -978,11 +3717,7 @@ def add_study_plan_entry():
         db.session.add(new_entry)
         db.session.commit()
         print(f"Added study plan entry: ID {new_entry.id} for User {current_user_id}")
-        return jsonify({
-            "id": new_entry.id,
-            "topic": new_entry.topic,
-            "review_date": new_entry.review_date
-        }), 201
+        return jsonify(plan_entry_dict(new_entry)), 201
     except Exception as e:
         db.session.rollback()
         print(f"--- ADD STUDY PLAN --- Database error: {e}")
@@ -1002,14 +3737,19 @@ def get_study_plan_entries():
     except (ValueError, TypeError):
         print(f"--- GET STUDY PLAN --- Invalid JWT identity: {current_user_id_str}") # Add/Confirm log
         return jsonify({"msg": "Invalid user identity"}), 422
+    since = request.args.get('since')
+    if since is not None:
+        try:
+            return jsonify(study_plan_changes(current_user_id, int(since)))
+        except ValueError:
+            return jsonify({"error": "'since' must be an integer revision"}), 400
+        except Exception as e:
+            print(f"Error syncing study plan for user {current_user_id}: {e}")
+            return jsonify({"error": f"Failed to sync study plan: {str(e)}"}), 500
     try:
         # Order by review date, then by ID
         entries = StudyPlanEntry.query.filter_by(user_id=current_user_id).order_by(StudyPlanEntry.review_date, StudyPlanEntry.id).all()
-        entries_list = [{
-            "id": entry.id,
-            "topic": entry.topic,
-            "review_date": entry.review_date
-        } for entry in entries]
+        entries_list = [plan_entry_dict(entry) for entry in entries]
         print(f"--- GET STUDY PLAN --- Found {len(entries_list)} entries for User ID: {current_user_id}") # Add/Confirm log
         return jsonify(entries_list)
     except Exception as e:
@@ -1041,6 +3781,188 @@ def delete_study_plan_entry(entry_id):
         print(f"Error deleting study plan entry: {e}")
         return jsonify({"error": f"Failed to delete entry: {str(e)}"}), 500
 
+
+@app.route('/api/study-plan/batch', methods=['POST'])
+@jwt_required()
+def batch_study_plan_entries():
+    """
+    Creates, updates and deletes study-plan entries in one transaction: all or nothing.
+    Body: {"create": [{"topic", "review_date"}], "update": [{"id", "topic"?, "review_date"?}], "delete": [id, ...]}
+    Returns the created and updated entries, the deleted ids and the new sync revision.
+    """
+    try:
+        current_user_id = int(get_jwt_identity())
+    except (ValueError, TypeError):
+        return jsonify({"msg": "Invalid user identity"}), 422
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+
+    data = request.get_json()
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    creates, updates, deletes = data.get('create') or [], data.get('update') or [], data.get('delete') or []
+    if not all(isinstance(ops, list) for ops in (creates, updates, deletes)):
+        return jsonify({"error": "'create', 'update' and 'delete' must be lists"}), 400
+    if len(creates) + len(updates) + len(deletes) > STUDY_PLAN_BATCH_LIMIT:
+        return jsonify({"error": f"At most {STUDY_PLAN_BATCH_LIMIT} operations per batch"}), 400
+    for op, items, require_all in (('create', creates, True), ('update', updates, False)):
+        for index, item in enumerate(items):
+            error = validate_plan_fields(item, require_all)
+            if error is None and op == 'update' and not (is_entry_id(item.get('id')) and ('topic' in item or 'review_date' in item)):
+                error = "Each update needs an integer 'id' and a 'topic' and/or 'review_date'"
+            if error:
+                return jsonify({"error": error, "op": op, "index": index}), 400
+    update_ids = [item['id'] for item in updates]
+    if not all(is_entry_id(entry_id) for entry_id in deletes):
+        return jsonify({"error": "'delete' must be a list of entry ids"}), 400
+    if len(set(update_ids)) != len(update_ids) or len(set(deletes)) != len(deletes) or set(update_ids) & set(deletes):
+        return jsonify({"error": "An entry id may appear only once per batch"}), 400
+
+    try:
+        owned = {entry.id: entry for entry in StudyPlanEntry.query.filter(
+            StudyPlanEntry.user_id == current_user_id, StudyPlanEntry.id.in_(update_ids + deletes))}
+        missing = [entry_id for entry_id in update_ids + deletes if entry_id not in owned]
+        if missing:
+            return jsonify({"error": "Entries not found or access denied", "ids": missing}), 404
+
+        for item in updates:
+            entry = owned[item['id']]
+            entry.topic = item.get('topic', entry.topic).strip()
+            entry.review_date = item.get('review_date', entry.review_date)
+        created = [StudyPlanEntry(topic=item['topic'].strip(), review_date=item['review_date'], user_id=current_user_id)
+                   for item in creates]
+        db.session.add_all(created)
+        if deletes:
+            db.session.execute(db.delete(StudyPlanEntry).where(
+                StudyPlanEntry.user_id == current_user_id, StudyPlanEntry.id.in_(deletes)))
+        db.session.flush()
+        created_ids = [entry.id for entry in created]
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error applying study plan batch for user {current_user_id}: {e}")
+        return jsonify({"error": f"Failed to apply study plan batch: {str(e)}"}), 500
+
+    # One query reloads every touched row with the revision its trigger assigned
+    touched = {entry.id: entry for entry in StudyPlanEntry.query.filter(StudyPlanEntry.id.in_(created_ids + update_ids))}
+    print(f"Study plan batch for user {current_user_id}: {len(creates)} created, {len(updates)} updated, {len(deletes)} deleted")
+    return jsonify({
+        "created": [plan_entry_dict(touched[entry_id]) for entry_id in created_ids],
+        "updated": [plan_entry_dict(touched[entry_id]) for entry_id in update_ids],
+        "deleted": deletes,
+        "revision": current_plan_revision(current_user_id),
+    })
+
+
+# --- Study Plan Calendar Feed ---
+# An iCalendar feed of upcoming reviews that calendar apps can subscribe to. They can't send the
+# JWT, so the URL carries an HMAC of the user id and a random per-user secret instead
+# (GET /api/study-plan/calendar-link). Resetting the secret revokes every link handed out before.
+# Responses have a weak ETag built from the user's plan revision and the date, so polling
+# calendar apps get a 304 without the feed being rebuilt until something changes.
+CALENDAR_MAX_AGE = int(os.getenv('CALENDAR_MAX_AGE', '300')) # Seconds clients may reuse the feed without asking
+
+def calendar_feed_token(user):
+    """The token in the user's feed URL, or None if they have never asked for a link."""
+    if not user.calendar_secret:
+        return None
+    message = f"calendar:{user.id}:{user.calendar_secret}".encode('utf-8')
+    return hmac.new(app.config['JWT_SECRET_KEY'].encode('utf-8'), message, hashlib.sha256).hexdigest()[:32]
+
+def calendar_feed_url(user):
+    return url_for('get_study_plan_calendar', user_id=user.id, token=calendar_feed_token(user), _external=True)
+
+def ical_escape(value):
+    return value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\r', '').replace('\n', '\\n')
+
+def ical_fold(line):
+    """Folds a content line at 75 octets as RFC 5545 requires, without splitting UTF-8 sequences."""
+    if len(line.encode('utf-8')) <= 75:
+        return line
+    parts, current, limit = [], '', 75
+    for char in line:
+        if len((current + char).encode('utf-8')) > limit:
+            parts.append(current)
+            current, limit = '', 74 # Continuation lines start with a space
+        current += char
+    return '\r\n '.join(parts + [current])
+
+def build_study_plan_ics(entries):
+    lines = [
+        "BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//LastLeap//Study Plan//EN",
+        "CALSCALE:GREGORIAN", "METHOD:PUBLISH", "X-WR-CALNAME:LastLeap Study Plan",
+    ]
+    for entry in entries:
+        day = datetime.strptime(entry.review_date, '%Y-%m-%d')
+        stamp = entry.updated_at or datetime.utcnow()
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:study-plan-{entry.id}@lastleap",
+            f"DTSTAMP:{stamp:%Y%m%dT%H%M%SZ}",
+            f"DTSTART;VALUE=DATE:{day:%Y%m%d}",
+            f"DTEND;VALUE=DATE:{day + timedelta(days=1):%Y%m%d}",
+            f"SUMMARY:{ical_escape('Review: ' + entry.topic)}",
+            "TRANSP:TRANSPARENT",
+            "END:VEVENT",
+        ]
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(ical_fold(line) for line in lines) + "\r\n"
+
+def calendar_link_response(reset):
+    try:
+        current_user_id = int(get_jwt_identity())
+    except (ValueError, TypeError):
+        return jsonify({"msg": "Invalid user identity"}), 422
+    user = db.session.get(User, current_user_id)
+    if user is None:
+        return jsonify({"msg": "User not found"}), 404
+    if reset or not user.calendar_secret:
+        try:
+            user.calendar_secret = secrets.token_hex(32)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error saving calendar secret for user {current_user_id}: {e}")
+            return jsonify({"error": "Failed to create calendar link"}), 500
+    return jsonify({"url": calendar_feed_url(user)})
+
+@app.route('/api/study-plan/calendar-link', methods=['GET'])
+@jwt_required()
+def get_study_plan_calendar_link():
+    return calendar_link_response(reset=False)
+
+@app.route('/api/study-plan/calendar-link/reset', methods=['POST'])
+@jwt_required()
+def reset_study_plan_calendar_link():
+    """Replaces the feed URL; subscriptions using the old one stop working."""
+    return calendar_link_response(reset=True)
+
+@app.route('/api/study-plan/calendar/<int:user_id>/<token>.ics', methods=['GET'])
+def get_study_plan_calendar(user_id, token):
+    user = db.session.get(User, user_id)
+    expected = calendar_feed_token(user) if user is not None else None
+    if expected is None or not hmac.compare_digest(token, expected):
+        return jsonify({"error": "Calendar not found"}), 404
+
+    today = datetime.utcnow().strftime('%Y-%m-%d')
+    # Past reviews drop out of the feed at midnight even without a change, hence the date
+    etag = f"{user_id}-{current_plan_revision(user_id)}-{today}"
+    cache_control = f"private, max-age={CALENDAR_MAX_AGE}"
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        try:
+            entries = (StudyPlanEntry.query
+                       .filter(StudyPlanEntry.user_id == user_id, StudyPlanEntry.review_date >= today)
+                       .order_by(StudyPlanEntry.review_date, StudyPlanEntry.id).all())
+            response = Response(build_study_plan_ics(entries), mimetype='text/calendar')
+        except Exception as e:
+            print(f"Error building calendar for user {user_id}: {e}")
+            return jsonify({"error": f"Failed to build calendar: {str(e)}"}), 500
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
 # --- Keep the main entry point ---
 # if __name__ == '__main__':
 #    app.run(debug=True)
@@ -1090,7 +4012,7 @@ def chat_with_ai():
     try:
         # Use the same Gemini helper function
         # Consider potential length issues if notes_context is huge, but Gemini 1.5 handles large contexts
-        ai_response_text = generate_gemini_content(system_prompt)
+        ai_response_text = generate_gemini_content(system_prompt, 'chat')
 
         print(f"AI chat response generated.")
         return jsonify({"response": ai_response_text})
@@ -1106,6 +4028,85 @@ def chat_with_ai():
 #    app.run(debug=True)
 
 
+# --- Frontend Static Files ---
+# Opt-in: SERVE_FRONTEND=true serves the Vite production build (`npm run build`) from the same
+# origin as the API, so authenticated /api calls from the browser need no CORS preflight.
+# Vite content-hashes everything under assets/, so those files are cached for a year as
+# immutable; index.html and the rest are revalidated against their ETag on each load.
+# The build writes .br/.gz copies next to each file and the one the client accepts is sent
+# as-is. Other non-API paths get index.html so client-side routes (/login, ...) survive a reload.
+SERVE_FRONTEND = os.getenv('SERVE_FRONTEND', 'false').lower() == 'true'
+FRONTEND_DIST_DIR = os.path.abspath(os.getenv('FRONTEND_DIST_DIR', os.path.join(basedir, '..', 'frontend', 'dist')))
+FRONTEND_IMMUTABLE_PREFIX = 'assets/'
+PRECOMPRESSED_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+# Module scripts are rejected unless served with a JavaScript type; some systems map .js to text/plain
+mimetypes.add_type('text/javascript', '.js')
+mimetypes.add_type('text/javascript', '.mjs')
+
+def send_frontend_file(relative_path):
+    """Sends a file from the build (its best precompressed variant if any), or None if it doesn't exist."""
+    full_path = safe_join(FRONTEND_DIST_DIR, relative_path)
+    if full_path is None or not os.path.isfile(full_path):
+        return None
+    available = [encoding for encoding, suffix in PRECOMPRESSED_SUFFIXES.items() if os.path.isfile(full_path + suffix)]
+    encoding = choose_content_encoding(request.headers.get('Accept-Encoding', ''), available)
+    mimetype = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    response = send_file(full_path + PRECOMPRESSED_SUFFIXES[encoding] if encoding else full_path,
+                         mimetype=mimetype, conditional=True, etag=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if available:
+        response.vary.add('Accept-Encoding')
+    if relative_path.startswith(FRONTEND_IMMUTABLE_PREFIX):
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+FRONTEND_METHODS = ['GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS']
+
+def api_route_methods(path):
+    """Methods a real API route accepts at this path (the catch-all shadows their 405s)."""
+    adapter = app.url_map.bind_to_environ(request.environ)
+    allowed = []
+    for method in FRONTEND_METHODS:
+        try:
+            endpoint, _ = adapter.match(path, method=method)
+        except HTTPException:
+            continue
+        if endpoint != 'serve_frontend':
+            allowed.append(method)
+    return allowed
+
+def serve_frontend(path=''):
+    # The catch-all takes every method so unknown API calls get a JSON 404, not a 405 from this rule
+    if path == 'api' or path.startswith('api/'):
+        allowed = api_route_methods(request.path)
+        if allowed:
+            response = jsonify({"error": "Method not allowed"})
+            response.headers['Allow'] = ', '.join(allowed)
+            return response, 405
+        return jsonify({"error": "Not found"}), 404
+    if request.method not in ('GET', 'HEAD'):
+        return jsonify({"error": "Method not allowed"}), 405
+    response = send_frontend_file(path) if path else None
+    if response is None:
+        # A missing hashed asset is a stale page asking for an old build; HTML wouldn't help it
+        if path.startswith(FRONTEND_IMMUTABLE_PREFIX):
+            return jsonify({"error": "Not found"}), 404
+        response = send_frontend_file('index.html')
+    if response is None:
+        return jsonify({"error": "Frontend build not found; run `npm run build` in frontend/"}), 404
+    return response
+
+if SERVE_FRONTEND:
+    if not os.path.isfile(os.path.join(FRONTEND_DIST_DIR, 'index.html')):
+        print(f"SERVE_FRONTEND is set but {FRONTEND_DIST_DIR} has no index.html yet; run `npm run build` in frontend/")
+    app.add_url_rule('/', 'serve_frontend', serve_frontend, methods=FRONTEND_METHODS)
+    app.add_url_rule('/<path:path>', 'serve_frontend', serve_frontend, methods=FRONTEND_METHODS)
+    print(f"Serving the frontend build from {FRONTEND_DIST_DIR}")
+
 
 # Main entry point
 if __name__ == '__main__':
@@ -0,0 +1 @@
+"""Benchmarks, load tests and fake upstream services for the LastLeap backend."""
@@ -0,0 +1,103 @@
+"""
+Classroom burst benchmark: many users request the same topic (in slightly different spellings)
+at the same moment. It reports get-content latency and how many upstream Gemini/YouTube calls
+the backend actually made, read from /api/admin/model-stats.
+
+    python -m bench.burst --users 40 --latency 1.0            # single-flight on (default)
+    python -m bench.burst --users 40 --latency 1.0 --compare  # also run with it off
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+import urllib.request
+import uuid
+
+from bench.fake_services import add_fake_service_arguments
+from bench.load import LoadClient, Recorder, spawn_backend
+from bench.stats import summarize, print_table, save_baseline, compare_to_baseline
+
+ADMIN_TOKEN = 'bench-burst'
+SPELLINGS = ["{topic}", "{lower}", "{lower}?", " {topic} ", "{upper}"]
+
+
+def run_burst(args, single_flight):
+    """Spawns a backend, fires the burst, returns (results, upstream counts)."""
+    process, base_url = spawn_backend(args, {
+        'SINGLE_FLIGHT_ENABLED': 'true' if single_flight else 'false',
+        'PROFILE_TOKEN': ADMIN_TOKEN,
+        'BCRYPT_LOG_ROUNDS': '4', # Registration isn't what's being measured
+    })
+    try:
+        clients = []
+        for i in range(args.users):
+            client = LoadClient(base_url, args.timeout)
+            username = f"burst_{uuid.uuid4().hex[:10]}_{i}"
+            client.request('POST', '/api/register', {"username": username, "password": "burst-password"})
+            _, body = client.request('POST', '/api/login', {"username": username, "password": "burst-password"})
+            client.token = json.loads(body)['access_token']
+            clients.append(client)
+
+        recorder = Recorder()
+        start_gate = threading.Barrier(args.users)
+
+        def student(index):
+            spelling = SPELLINGS[index % len(SPELLINGS)].format(
+                topic=args.topic, lower=args.topic.lower(), upper=args.topic.upper())
+            start_gate.wait()
+            recorder.timed('get_content', lambda: clients[index].request('POST', '/api/get-content', {"topic": spelling}))
+
+        threads = [threading.Thread(target=student, args=(i,)) for i in range(args.users)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        req = urllib.request.Request(base_url + '/api/admin/model-stats', headers={'X-Profile-Token': ADMIN_TOKEN})
+        with urllib.request.urlopen(req, timeout=args.timeout) as response:
+            stats = json.loads(response.read())
+    finally:
+        process.terminate()
+        process.wait()
+
+    gemini_calls = sum(row['calls'] for row in stats['stats'])
+    counts = {"gemini_calls": gemini_calls, "youtube_calls": stats['single_flight']['youtube']['calls'],
+              "failures": sum(recorder.failures.values())}
+    return {"get_content": summarize(recorder.samples['get_content'], elapsed)}, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent identical-topic burst against a spawned backend.")
+    parser.add_argument('--users', type=int, default=40)
+    parser.add_argument('--topic', default="Photosynthesis")
+    parser.add_argument('--compare', action='store_true', help="Also run with SINGLE_FLIGHT_ENABLED=false")
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--port', type=int, default=5057)
+    add_fake_service_arguments(parser)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=0.10)
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    modes = [True, False] if args.compare else [True]
+    all_results = {}
+    for single_flight in modes:
+        label = 'single_flight' if single_flight else 'no_single_flight'
+        results, counts = run_burst(args, single_flight)
+        all_results[f"{label}_get_content"] = results['get_content']
+        print(f"\n{label}: {args.users} users -> {counts['gemini_calls']} Gemini calls, "
+              f"{counts['youtube_calls']} YouTube searches, {counts['failures']} failed requests")
+    print_table(all_results, f"Burst of {args.users} identical-topic requests")
+
+    if args.save_baseline:
+        save_baseline('burst', all_results)
+        return 0
+    regressions = compare_to_baseline('burst', all_results, args.threshold)
+    return 1 if (regressions and args.fail_on_regression) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+Benchmarks for response encoding on realistic session payloads: stdlib json vs orjson for
+dumps/loads, and gzip vs brotli compression (time and compressed size). No network is used.
+
+    python -m bench.encoding [--repeat 200] [--save-baseline] [--fail-on-regression]
+"""
+import argparse
+import gzip
+import json
+import sys
+
+from bench.fake_services import make_notes, make_summary, make_quiz, make_flashcards
+from bench.micro import load_app, time_calls
+from bench.stats import summarize, print_table, save_baseline, compare_to_baseline
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def build_payloads(app):
+    """Session-details and batch-result documents shaped like the real API responses."""
+    topic = "Photosynthesis"
+    notes = make_notes(topic, sections=12)
+    summary = make_summary(topic)
+    session = {
+        "id": 1, "topic": topic, "notes": notes, "summary": summary,
+        "notes_html": app.render_markdown_html(notes), "summary_html": app.render_markdown_html(summary),
+        "youtube_videos": [{"title": f"{topic} video {i}", "videoId": f"vid{i:08d}",
+                            "thumbnail": f"https://i.ytimg.com/vi/vid{i:08d}/hqdefault.jpg"} for i in range(5)],
+        "quiz_data": make_quiz(topic), "flashcards_data": make_flashcards(topic, count=15),
+        "created_at": "2024-01-01T12:00:00",
+    }
+    sessions = [dict(session, id=i, topic=f"{topic} {i}") for i in range(20)]
+    return {"session": session, "session_list_20": sessions}
+
+
+def build_cases(app, payloads):
+    cases = {}
+    for name, payload in payloads.items():
+        text = json.dumps(payload)
+        raw = text.encode('utf-8')
+        cases[f"{name}_dumps_stdlib"] = lambda p=payload: json.dumps(p)
+        cases[f"{name}_loads_stdlib"] = lambda t=text: json.loads(t)
+        if orjson is not None:
+            cases[f"{name}_dumps_orjson"] = lambda p=payload: orjson.dumps(p)
+            cases[f"{name}_loads_orjson"] = lambda t=text: orjson.loads(t)
+        cases[f"{name}_gzip"] = lambda r=raw: gzip.compress(r, compresslevel=app.COMPRESS_GZIP_LEVEL)
+        if brotli is not None:
+            cases[f"{name}_brotli"] = lambda r=raw: brotli.compress(r, quality=app.COMPRESS_BROTLI_QUALITY)
+    return cases
+
+
+def print_sizes(app, payloads):
+    print(f"\n{'payload':<28}{'raw KB':>10}{'gzip KB':>10}{'br KB':>10}")
+    for name, payload in payloads.items():
+        raw = json.dumps(payload).encode('utf-8')
+        gzipped = len(app.compress_body(raw, 'gzip'))
+        brotlied = len(app.compress_body(raw, 'br')) if brotli is not None else None
+        print(f"{name:<28}{len(raw) / 1024:>10.1f}{gzipped / 1024:>10.1f}"
+              f"{(f'{brotlied / 1024:.1f}' if brotlied else '-'):>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JSON serialization and response compression.")
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=0.10)
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    app = load_app()
+    payloads = build_payloads(app)
+    results = {}
+    for name, func in build_cases(app, payloads).items():
+        samples = time_calls(func, args.repeat)
+        results[name] = summarize(samples, elapsed=sum(samples))
+
+    print_table(results, "Encoding benchmarks")
+    print_sizes(app, payloads)
+    if orjson is None or brotli is None:
+        print("\n(orjson and/or brotli not installed; their rows are skipped)")
+    if args.save_baseline:
+        save_baseline('encoding', results)
+        return 0
+    regressions = compare_to_baseline('encoding', results, args.threshold)
+    return 1 if (regressions and args.fail_on_regression) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,240 @@
+"""
+Deterministic stand-ins for the Gemini and YouTube APIs.
+
+The backend talks to these when GEMINI_API_ENDPOINT / YOUTUBE_API_ENDPOINT point at them,
+so benchmarks and load tests never hit (or pay for) the real services.
+
+Run standalone:
+    python -m bench.fake_services --gemini-port 8701 --youtube-port 8702 --latency 0.3 --token-rate 400
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+# --- Deterministic Content ---
+def _seed_for(text):
+    return int(hashlib.sha256(text.encode('utf-8')).hexdigest()[:8], 16)
+
+def extract_topic(prompt):
+    match = re.search(r'topic:\s*"([^"]+)"', prompt)
+    return match.group(1) if match else "the provided notes"
+
+def classify_prompt(prompt):
+    """Works out which artifact a prompt from app.py is asking for."""
+    lowered = prompt.lower()
+    if 'multiple-choice' in lowered:
+        return 'quiz'
+    if 'flashcard' in lowered:
+        return 'flashcards'
+    if 'study assistant' in lowered:
+        return 'chat'
+    if 'summary' in lowered or 'summarize' in lowered:
+        return 'summary'
+    return 'notes'
+
+def make_notes(topic, sections=6, bullets=5):
+    """Structured Markdown notes shaped like the real model output (headings, bold terms, bullets)."""
+    rng = random.Random(_seed_for(topic))
+    lines = [f"# {topic}", "", f"These notes cover the essentials of **{topic}** for exam revision.", ""]
+    for s in range(1, sections + 1):
+        lines += [f"## Section {s}: Aspect {rng.randint(100, 999)} of {topic}", ""]
+        lines.append(f"This section explains how part {s} of {topic} works and why it matters in practice. "
+                     f"It builds on the earlier material and introduces {bullets} key ideas.")
+        lines.append("")
+        for b in range(1, bullets + 1):
+            term = f"Term {s}.{b}"
+            lines.append(f"- **{term}**: a definition of {term.lower()} in the context of {topic}, "
+                         f"with value {rng.randint(1, 10_000)} and a short worked example.")
+        lines.append("")
+    return "\n".join(lines)
+
+def make_summary(topic):
+    return "\n\n".join(
+        f"Paragraph {i} of the summary of **{topic}**: the key concepts are outlined briefly "
+        f"and the most important definitions are highlighted for quick review."
+        for i in range(1, 4)
+    )
+
+def make_quiz(topic, count=5):
+    return [{
+        "question": f"Question {i} about {topic}?",
+        "options": [f"Option {c} for question {i}" for c in "ABCD"],
+        "correct_answer": f"Option A for question {i}",
+        "explanation": f"Option A is correct because the notes on {topic} say so in section {i}."
+    } for i in range(1, count + 1)]
+
+def make_flashcards(topic, count=12):
+    return [{"term": f"Term {i}", "definition": f"Definition {i} of a key idea in {topic}."}
+            for i in range(1, count + 1)]
+
+def make_chat_reply(prompt):
+    return "Based on the notes, here is a concise explanation of the concept you asked about."
+
+
+class FakeModel:
+    """
+    Generates deterministic responses with a configurable latency profile:
+    total delay = latency + output_tokens / token_rate (tokens approximated as chars / 4).
+    malformed_rate is the fraction of quiz/flashcard responses returned as broken JSON.
+    """
+    def __init__(self, latency=0.0, token_rate=0.0, malformed_rate=0.0, seed=1234, notes_sections=6):
+        self.latency = latency
+        self.token_rate = token_rate
+        self.malformed_rate = malformed_rate
+        self.notes_sections = notes_sections
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _is_malformed(self):
+        with self._lock:
+            return self._rng.random() < self.malformed_rate
+
+    def respond(self, prompt):
+        kind = classify_prompt(prompt)
+        topic = extract_topic(prompt)
+        if kind == 'notes':
+            text = make_notes(topic, sections=self.notes_sections)
+        elif kind == 'summary':
+            text = make_summary(topic)
+        elif kind == 'quiz':
+            text = json.dumps(make_quiz(topic))
+        elif kind == 'flashcards':
+            text = json.dumps(make_flashcards(topic))
+        else:
+            text = make_chat_reply(prompt)
+        if kind in ('quiz', 'flashcards') and self._is_malformed():
+            text = "Here you go: " + text[: len(text) // 2] # Truncated, unparseable JSON
+        return text
+
+    def delay_for(self, text):
+        delay = self.latency
+        if self.token_rate:
+            delay += (len(text) / 4) / self.token_rate
+        return delay
+
+
+# --- HTTP Servers ---
+class _JsonHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args): # Keep benchmark output readable
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_gemini_handler(model):
+    class GeminiHandler(_JsonHandler):
+        """Implements POST /v1beta/models/<model>:generateContent (REST transport)."""
+        def do_POST(self):
+            if ':generateContent' not in self.path:
+                return self._send_json({"error": {"code": 404, "message": "Not found"}}, 404)
+            length = int(self.headers.get('Content-Length', 0))
+            request_body = json.loads(self.rfile.read(length) or b'{}')
+            prompt = "".join(
+                part.get('text', '')
+                for content in request_body.get('contents', [])
+                for part in content.get('parts', [])
+            )
+            text = model.respond(prompt)
+            time.sleep(model.delay_for(text))
+            prompt_tokens, output_tokens = len(prompt) // 4, len(text) // 4
+            self._send_json({
+                "candidates": [{
+                    "content": {"parts": [{"text": text}], "role": "model"},
+                    "finishReason": "STOP",
+                    "index": 0
+                }],
+                "usageMetadata": {
+                    "promptTokenCount": prompt_tokens,
+                    "candidatesTokenCount": output_tokens,
+                    "totalTokenCount": prompt_tokens + output_tokens
+                }
+            })
+    return GeminiHandler
+
+
+def make_youtube_handler(latency=0.0):
+    class YouTubeHandler(_JsonHandler):
+        """Implements GET /youtube/v3/search."""
+        def do_GET(self):
+            url = urlparse(self.path)
+            if not url.path.endswith('/search'):
+                return self._send_json({"error": {"code": 404, "message": "Not found"}}, 404)
+            params = parse_qs(url.query)
+            query = params.get('q', [''])[0]
+            max_results = int(params.get('maxResults', ['5'])[0])
+            time.sleep(latency)
+            items = []
+            for i in range(max_results):
+                video_id = hashlib.sha1(f"{query}:{i}".encode('utf-8')).hexdigest()[:11]
+                items.append({
+                    "id": {"kind": "youtube#video", "videoId": video_id},
+                    "snippet": {
+                        "title": f"{query} explained (part {i + 1})",
+                        "thumbnails": {"medium": {"url": f"https://i.ytimg.com/vi/{video_id}/mqdefault.jpg"}}
+                    }
+                })
+            self._send_json({"kind": "youtube#searchListResponse", "items": items})
+    return YouTubeHandler
+
+
+def start_server(handler_class, port=0, host='127.0.0.1'):
+    """Starts a threaded HTTP server in a daemon thread. Returns (server, base_url)."""
+    server = ThreadingHTTPServer((host, port), handler_class)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/"
+
+
+def start_fake_services(latency=0.0, token_rate=0.0, malformed_rate=0.0, youtube_latency=0.0,
+                        seed=1234, gemini_port=0, youtube_port=0):
+    """Starts both fakes. Returns (gemini_url, youtube_url, servers)."""
+    model = FakeModel(latency=latency, token_rate=token_rate, malformed_rate=malformed_rate, seed=seed)
+    gemini_server, gemini_url = start_server(make_gemini_handler(model), gemini_port)
+    youtube_server, youtube_url = start_server(make_youtube_handler(youtube_latency), youtube_port)
+    return gemini_url, youtube_url, [gemini_server, youtube_server]
+
+
+def add_fake_service_arguments(parser):
+    parser.add_argument('--latency', type=float, default=0.2, help="Base Gemini latency in seconds")
+    parser.add_argument('--token-rate', type=float, default=500.0, help="Gemini output tokens per second (0 = instant)")
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help="Fraction of quiz/flashcard replies with broken JSON")
+    parser.add_argument('--youtube-latency', type=float, default=0.1, help="YouTube search latency in seconds")
+    parser.add_argument('--seed', type=int, default=1234)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run fake Gemini and YouTube servers.")
+    add_fake_service_arguments(parser)
+    parser.add_argument('--gemini-port', type=int, default=8701)
+    parser.add_argument('--youtube-port', type=int, default=8702)
+    args = parser.parse_args()
+
+    gemini_url, youtube_url, _ = start_fake_services(
+        latency=args.latency, token_rate=args.token_rate, malformed_rate=args.malformed_rate,
+        youtube_latency=args.youtube_latency, seed=args.seed,
+        gemini_port=args.gemini_port, youtube_port=args.youtube_port
+    )
+    print(f"Fake Gemini:  GEMINI_API_ENDPOINT={gemini_url}")
+    print(f"Fake YouTube: YOUTUBE_API_ENDPOINT={youtube_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""
+Multi-user load driver. Each virtual user runs the full study flow:
+register -> login -> get-content -> generate-quiz -> generate-flashcards -> generate-pdf.
+
+Against an already running backend:
+    python -m bench.load --base-url http://127.0.0.1:5000 --users 20 --iterations 3
+
+Or self-contained, starting the fake Gemini/YouTube servers and a backend on a throwaway DB:
+    python -m bench.load --spawn --users 20 --iterations 3 --latency 0.3 --token-rate 400
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.fake_services import start_fake_services, add_fake_service_arguments
+from bench.stats import summarize, print_table, save_baseline, compare_to_baseline
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_TOPICS = [
+    "Mitosis", "Photosynthesis", "Newton's Laws", "The French Revolution", "Supply and Demand",
+    "Plate Tectonics", "Binary Search Trees", "The Krebs Cycle", "Ohm's Law", "World War I",
+]
+
+
+class LoadClient:
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.token = None
+
+    def request(self, method, path, payload=None):
+        """Sends a JSON request. Returns (status, body bytes); non-2xx statuses don't raise."""
+        data = json.dumps(payload).encode('utf-8') if payload is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method)
+        req.add_header('Content-Type', 'application/json')
+        if self.token:
+            req.add_header('Authorization', f'Bearer {self.token}')
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+class Recorder:
+    """Thread-safe collection of per-step latencies and failures."""
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.failures = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def timed(self, step, func):
+        start = time.perf_counter()
+        try:
+            status, body = func()
+        except Exception as e:
+            status, body = None, str(e).encode('utf-8')
+        elapsed = time.perf_counter() - start
+        ok = status is not None and 200 <= status < 300
+        with self._lock:
+            if ok:
+                self.samples[step].append(elapsed)
+            else:
+                self.failures[step] += 1
+        return ok, body
+
+
+def run_user(user_index, args, recorder):
+    client = LoadClient(args.base_url, args.timeout)
+    username = f"load_{uuid.uuid4().hex[:10]}_{user_index}"
+    password = "load-test-password"
+
+    ok, _ = recorder.timed('register', lambda: client.request('POST', '/api/register', {"username": username, "password": password}))
+    if not ok:
+        return 0
+    ok, body = recorder.timed('login', lambda: client.request('POST', '/api/login', {"username": username, "password": password}))
+    if not ok:
+        return 0
+    client.token = json.loads(body)['access_token']
+
+    completed = 0
+    for iteration in range(args.iterations):
+        topic = args.topics[(user_index + iteration) % len(args.topics)]
+        start = time.perf_counter()
+        ok, body = recorder.timed('get_content', lambda: client.request('POST', '/api/get-content', {"topic": topic}))
+        if not ok:
+            continue
+        content = json.loads(body)
+        session_id, notes = content.get('session_id'), content.get('notes')
+
+        ok, body = recorder.timed('generate_quiz', lambda: client.request('POST', '/api/generate-quiz', {"notes": notes, "session_id": session_id}))
+        quiz = json.loads(body) if ok else []
+        recorder.timed('generate_flashcards', lambda: client.request('POST', '/api/generate-flashcards', {"notes": notes, "session_id": session_id}))
+        recorder.timed('generate_pdf', lambda: client.request('POST', '/api/generate-pdf', {
+            "topic": topic, "notes": notes, "quizQuestions": quiz, "session_id": session_id
+        }))
+        with recorder._lock:
+            recorder.samples['full_flow'].append(time.perf_counter() - start)
+        completed += 1
+    return completed
+
+
+def spawn_backend(args, extra_env=None):
+    """Starts fake upstreams and a Flask backend subprocess wired to them. Returns (process, base_url)."""
+    gemini_url, youtube_url, _ = start_fake_services(
+        latency=args.latency, token_rate=args.token_rate, malformed_rate=args.malformed_rate,
+        youtube_latency=args.youtube_latency, seed=args.seed
+    )
+    db_path = os.path.join(tempfile.mkdtemp(), 'load.db')
+    env = dict(os.environ,
+               GEMINI_API_KEY='fake', YOUTUBE_API_KEY='fake',
+               GEMINI_API_ENDPOINT=gemini_url, YOUTUBE_API_ENDPOINT=youtube_url,
+               DATABASE_URL=f'sqlite:///{db_path}')
+    env.update(extra_env or {})
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--port', str(args.port), '--no-reload', '--no-debugger'],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(base_url + '/api/test', timeout=1).read()
+            return process, base_url
+        except Exception:
+            if process.poll() is not None:
+                raise RuntimeError("Backend exited during startup")
+            time.sleep(0.25)
+    process.terminate()
+    raise RuntimeError("Backend did not become ready within 60s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-user load test for the LastLeap backend.")
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--iterations', type=int, default=2, help="Study flows per user")
+    parser.add_argument('--topics', nargs='*', default=DEFAULT_TOPICS)
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--spawn', action='store_true', help="Start fake upstreams and a backend automatically")
+    parser.add_argument('--port', type=int, default=5055, help="Port for the spawned backend")
+    add_fake_service_arguments(parser)
+    parser.add_argument('--baseline-name', default='load')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=0.10)
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    process = None
+    if args.spawn:
+        process, args.base_url = spawn_backend(args)
+    try:
+        recorder = Recorder()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.users) as pool:
+            completed = sum(pool.map(lambda i: run_user(i, args, recorder), range(args.users)))
+        elapsed = time.perf_counter() - start
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+    results = {step: summarize(samples, elapsed) for step, samples in recorder.samples.items()}
+    print_table(results, f"Load test: {args.users} users x {args.iterations} flows in {elapsed:.1f}s "
+                         f"({completed} flows completed, {completed / elapsed:.2f} flows/s)")
+    if recorder.failures:
+        print("Failures: " + ", ".join(f"{step}={count}" for step, count in sorted(recorder.failures.items())))
+
+    if args.save_baseline:
+        save_baseline(args.baseline_name, results)
+        return 0
+    regressions = compare_to_baseline(args.baseline_name, results, args.threshold)
+    return 1 if (regressions and args.fail_on_regression) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""
+Login storm benchmark: hammers /api/login from many threads while probe threads measure
+the latency of ordinary (non-bcrypt) traffic, to show how much auth work starves other routes.
+
+    python -m bench.login_throughput --spawn --login-threads 32 --duration 15
+    python -m bench.login_throughput --spawn --hash-workers 8   # compare pool sizes
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+import uuid
+
+from bench.fake_services import add_fake_service_arguments
+from bench.load import LoadClient, Recorder, spawn_backend
+from bench.stats import summarize, print_table, save_baseline, compare_to_baseline
+
+
+def storm(args, accounts, probe_token):
+    recorder = Recorder()
+    stop = threading.Event()
+
+    def login_loop(index):
+        client = LoadClient(args.base_url, args.timeout)
+        username, password = accounts[index % len(accounts)]
+        while not stop.is_set():
+            recorder.timed('login', lambda: client.request('POST', '/api/login', {"username": username, "password": password}))
+
+    def probe_loop():
+        client = LoadClient(args.base_url, args.timeout)
+        client.token = probe_token
+        while not stop.is_set():
+            recorder.timed('probe_sessions', lambda: client.request('GET', '/api/sessions'))
+            recorder.timed('probe_test', lambda: client.request('GET', '/api/test'))
+
+    threads = [threading.Thread(target=login_loop, args=(i,)) for i in range(args.login_threads)]
+    threads += [threading.Thread(target=probe_loop) for _ in range(args.probe_threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return recorder, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Login throughput vs. non-auth latency benchmark.")
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--spawn', action='store_true', help="Start a backend on a throwaway DB automatically")
+    parser.add_argument('--port', type=int, default=5056)
+    parser.add_argument('--hash-workers', type=int, help="PASSWORD_HASH_WORKERS for the spawned backend")
+    parser.add_argument('--bcrypt-rounds', type=int, help="BCRYPT_LOG_ROUNDS for the spawned backend")
+    parser.add_argument('--accounts', type=int, default=8)
+    parser.add_argument('--login-threads', type=int, default=16)
+    parser.add_argument('--probe-threads', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--timeout', type=float, default=60.0)
+    add_fake_service_arguments(parser)
+    parser.add_argument('--baseline-name', default='login')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=0.10)
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    process = None
+    if args.spawn:
+        extra_env = {}
+        if args.hash_workers:
+            extra_env['PASSWORD_HASH_WORKERS'] = str(args.hash_workers)
+        if args.bcrypt_rounds:
+            extra_env['BCRYPT_LOG_ROUNDS'] = str(args.bcrypt_rounds)
+        # The storm reuses a few accounts with correct passwords, so lockouts never trigger
+        process, args.base_url = spawn_backend(args, extra_env)
+    try:
+        client = LoadClient(args.base_url, args.timeout)
+        accounts = []
+        for i in range(args.accounts):
+            credentials = (f"storm_{uuid.uuid4().hex[:10]}_{i}", "storm-password")
+            client.request('POST', '/api/register', {"username": credentials[0], "password": credentials[1]})
+            accounts.append(credentials)
+        status, body = client.request('POST', '/api/login', {"username": accounts[0][0], "password": accounts[0][1]})
+        if status != 200:
+            print(f"Could not log in probe account (HTTP {status})")
+            return 1
+        recorder, elapsed = storm(args, accounts, json.loads(body)['access_token'])
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+    results = {step: summarize(samples, elapsed) for step, samples in recorder.samples.items()}
+    print_table(results, f"Login storm: {args.login_threads} login threads, {args.probe_threads} probe threads, {elapsed:.1f}s")
+    if recorder.failures:
+        print("Failures: " + ", ".join(f"{step}={count}" for step, count in sorted(recorder.failures.items())))
+
+    if args.save_baseline:
+        save_baseline(args.baseline_name, results)
+        return 0
+    regressions = compare_to_baseline(args.baseline_name, results, args.threshold)
+    return 1 if (regressions and args.fail_on_regression) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""
+Micro-benchmarks for CPU-bound backend helpers: AI response parsing, Markdown -> HTML,
+Markdown -> PDF (both engines) and flashcard CSV export. No network is used.
+
+    python -m bench.micro [--repeat 50] [--save-baseline] [--fail-on-regression]
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+from bench.fake_services import make_notes, make_quiz, make_flashcards
+from bench.stats import summarize, print_table, save_baseline, compare_to_baseline
+
+
+def load_app():
+    """Imports app.py against a throwaway database with dummy keys (nothing here calls the APIs)."""
+    os.environ.setdefault('GEMINI_API_KEY', 'bench')
+    os.environ.setdefault('YOUTUBE_API_KEY', 'bench')
+    os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'))
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        import app
+    return app
+
+
+def time_calls(func, repeat):
+    """Runs func `repeat` times (after one warm-up call) and returns per-call durations in seconds."""
+    samples = []
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull): # Helpers log verbosely
+        func()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+def build_cases(app):
+    topic = "Photosynthesis"
+    notes = make_notes(topic, sections=8)
+    long_notes = make_notes(topic, sections=40)
+    quiz = make_quiz(topic)
+    quiz_raw = "Sure! Here is your quiz:\n" + json.dumps(quiz, indent=2)
+    flashcards_raw = json.dumps(make_flashcards(topic, count=15))
+    many_flashcards = make_flashcards(topic, count=500)
+    notes_html = app.render_markdown_html(notes)
+
+    cases = {
+        "parse_quiz": lambda: app.parse_quiz_response(quiz_raw),
+        "parse_flashcards": lambda: app.parse_flashcards_response(flashcards_raw),
+        "markdown_to_html": lambda: app.render_markdown_html(notes),
+        "markdown_to_html_long": lambda: app.render_markdown_html(long_notes),
+        "pdf_render": lambda: app.render_notes_pdf(topic, notes_html, quiz),
+        "pdf_render_fpdf": lambda: app.draw_notes_pdf(topic, notes, quiz),
+        "flashcards_csv_500": lambda: app.flashcards_to_csv(many_flashcards),
+        "flashcards_local": lambda: app.extract_flashcards_locally(notes),
+    }
+    if app.FPDF is None:
+        del cases["pdf_render_fpdf"]
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run backend micro-benchmarks.")
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--only', nargs='*', help="Run only these benchmarks")
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=0.10)
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    app = load_app()
+    results = {}
+    for name, func in build_cases(app).items():
+        if args.only and name not in args.only:
+            continue
+        # PDF rendering is orders of magnitude slower; keep its run time reasonable
+        repeat = max(args.repeat // 5, 3) if name.startswith('pdf') else args.repeat
+        samples = time_calls(func, repeat)
+        results[name] = summarize(samples, elapsed=sum(samples))
+
+    print_table(results, "Micro-benchmarks")
+    if args.save_baseline:
+        save_baseline('micro', results)
+        return 0
+    regressions = compare_to_baseline('micro', results, args.threshold)
+    return 1 if (regressions and args.fail_on_regression) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
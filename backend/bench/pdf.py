@@ -0,0 +1,77 @@
+"""
+Compares the two PDF engines on render time and output size: xhtml2pdf (PDF_ENGINE=pisa, fed the
+pre-rendered notes HTML as when a session's stored HTML is reused) and the direct fpdf2 engine
+(PDF_ENGINE=fpdf). Notes are generated in English and in non-Latin scripts. No network is used.
+
+    python -m bench.pdf [--repeat 10] [--sections 8 40]
+
+The pisa layout uses core fonts, which have no Cyrillic or Greek glyphs. Its multilingual PDFs
+are smaller because that text comes out blank. The fpdf2 PDFs embed subsets of the DejaVu fonts.
+"""
+import argparse
+import sys
+
+from bench.fake_services import make_notes, make_quiz
+from bench.micro import load_app, time_calls
+from bench.stats import summarize, print_table, save_baseline, compare_to_baseline
+
+MULTILINGUAL_LINES = [
+    "Фотосинтез превращает **световую энергию** в химическую энергию глюкозы.",
+    "Η φωτοσύνθεση συμβαίνει στους *χλωροπλάστες* των φυτικών κυττάρων.",
+    "Quang hợp tạo ra **oxy** và glucose từ nước và carbon dioxide.",
+    "Хлорофилл поглощает красный и синий свет, отражая зелёный.",
+]
+
+
+def make_multilingual_notes(sections):
+    """Same structure as make_notes, with the prose in Russian, Greek and Vietnamese."""
+    lines = ["# Фотосинтез / Φωτοσύνθεση", ""]
+    for s in range(1, sections + 1):
+        lines += [f"## Раздел {s}: Ενότητα {s}", "", MULTILINGUAL_LINES[s % len(MULTILINGUAL_LINES)], ""]
+        lines += [f"- **Термин {s}.{b}**: {MULTILINGUAL_LINES[(s + b) % len(MULTILINGUAL_LINES)]}" for b in range(1, 6)]
+        lines.append("")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the xhtml2pdf and fpdf2 PDF engines.")
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--sections', type=int, nargs='*', default=[8, 40], help="Note sizes to render")
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=0.10)
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    app = load_app()
+    if app.FPDF is None:
+        print("fpdf2 is not installed; only the pisa engine can be measured.")
+
+    quiz = make_quiz("Photosynthesis")
+    results, sizes = {}, []
+    for sections in args.sections:
+        for corpus, notes in (("latin", make_notes("Photosynthesis", sections=sections)),
+                              ("multilingual", make_multilingual_notes(sections))):
+            notes_html = app.render_markdown_html(notes)
+            engines = {"pisa": lambda: app.render_notes_pdf("Photosynthesis", notes_html, quiz)}
+            if app.FPDF is not None:
+                engines["fpdf"] = lambda: app.draw_notes_pdf("Photosynthesis", notes, quiz)
+            for engine, render in engines.items():
+                name = f"{engine}_{corpus}_{sections}"
+                samples = time_calls(render, args.repeat)
+                results[name] = summarize(samples, elapsed=sum(samples))
+                sizes.append((name, len(render())))
+
+    print_table(results, "PDF engines")
+    print(f"\n{'document':<28}{'size KB':>10}")
+    for name, size in sizes:
+        print(f"{name:<28}{size / 1024:>10.1f}")
+
+    if args.save_baseline:
+        save_baseline('pdf', results)
+        return 0
+    regressions = compare_to_baseline('pdf', results, args.threshold)
+    return 1 if (regressions and args.fail_on_regression) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""Latency statistics and baseline comparison shared by the micro and load benchmarks."""
+import json
+import math
+import os
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+
+def percentile(sorted_samples, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_samples:
+        return 0.0
+    rank = max(math.ceil(pct * len(sorted_samples) / 100.0) - 1, 0)
+    return sorted_samples[min(rank, len(sorted_samples) - 1)]
+
+
+def summarize(samples, elapsed=None):
+    """p50/p95/p99/mean in milliseconds, plus throughput (ops/s) if the wall time is known."""
+    ordered = sorted(samples)
+    summary = {
+        "count": len(ordered),
+        "p50_ms": percentile(ordered, 50) * 1000,
+        "p95_ms": percentile(ordered, 95) * 1000,
+        "p99_ms": percentile(ordered, 99) * 1000,
+        "mean_ms": (sum(ordered) / len(ordered) * 1000) if ordered else 0.0,
+    }
+    if elapsed:
+        summary["throughput_per_s"] = len(ordered) / elapsed
+    return summary
+
+
+def print_table(results, title):
+    print(f"\n{title}")
+    print(f"{'name':<28}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>10}")
+    for name, stats in results.items():
+        throughput = stats.get("throughput_per_s")
+        print(f"{name:<28}{stats['count']:>7}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}"
+              f"{stats['p99_ms']:>10.2f}{(f'{throughput:.1f}' if throughput else '-'):>10}")
+
+
+def baseline_path(name):
+    return os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+def save_baseline(name, results):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    with open(baseline_path(name), 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(f"\nSaved baseline to {baseline_path(name)}")
+
+
+def compare_to_baseline(name, results, threshold=0.10):
+    """
+    Prints the change of every metric against the stored baseline.
+    Latencies regress when they grow by more than `threshold`, throughput when it drops by more.
+    Returns the list of regressions (empty if none or no baseline exists).
+    """
+    path = baseline_path(name)
+    if not os.path.exists(path):
+        print(f"\nNo baseline at {path} (run with --save-baseline to create one).")
+        return []
+    with open(path) as f:
+        baseline = json.load(f)
+
+    regressions = []
+    print(f"\nComparison against {path} (threshold {threshold:.0%})")
+    for entry, stats in results.items():
+        base_stats = baseline.get(entry)
+        if not base_stats:
+            continue
+        for metric in ("p50_ms", "p95_ms", "p99_ms", "throughput_per_s"):
+            if metric not in stats or not base_stats.get(metric):
+                continue
+            change = (stats[metric] - base_stats[metric]) / base_stats[metric]
+            higher_is_better = metric == "throughput_per_s"
+            regressed = (-change if higher_is_better else change) > threshold
+            marker = "REGRESSION" if regressed else ""
+            print(f"  {entry:<26}{metric:<18}{base_stats[metric]:>10.2f} -> {stats[metric]:>10.2f} ({change:+.1%}) {marker}")
+            if regressed:
+                regressions.append((entry, metric, change))
+    return regressions
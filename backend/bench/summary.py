@@ -0,0 +1,143 @@
+"""
+Compares the local extractive summarizer (SUMMARY_MODE=local) with the LLM summary.
+
+Quality: ROUGE-1/ROUGE-2 F1 of the local summary against the LLM summary, plus for both
+summaries the share of section headings they cover and their length relative to the notes.
+Latency: local summarization time vs the summary model call.
+
+    # Synthetic notes, LLM side answered by the fake Gemini server
+    python -m bench.summary --latency 0.8 --token-rate 200
+
+    # Real notes and the LLM summaries already stored with them (no API calls)
+    python -m bench.summary --database study_plan.db --limit 50
+"""
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import time
+
+from bench.fake_services import start_fake_services, add_fake_service_arguments, make_notes
+from bench.load import DEFAULT_TOPICS
+from bench.stats import summarize, print_table, save_baseline, compare_to_baseline
+
+
+def ngrams(value, n):
+    words = re.findall(r"[a-z0-9]+", value.lower())
+    return [tuple(words[i:i + n]) for i in range(len(words) - n + 1)]
+
+
+def rouge_f1(candidate, reference, n):
+    """ROUGE-N F1 with clipped n-gram counts."""
+    candidate_grams, reference_grams = ngrams(candidate, n), ngrams(reference, n)
+    if not candidate_grams or not reference_grams:
+        return 0.0
+    remaining = {}
+    for gram in reference_grams:
+        remaining[gram] = remaining.get(gram, 0) + 1
+    overlap = 0
+    for gram in candidate_grams:
+        if remaining.get(gram):
+            remaining[gram] -= 1
+            overlap += 1
+    if not overlap:
+        return 0.0
+    precision, recall = overlap / len(candidate_grams), overlap / len(reference_grams)
+    return 2 * precision * recall / (precision + recall)
+
+
+def heading_coverage(summary, notes):
+    """Share of h2/h3 sections whose heading words (any of them) appear in the summary."""
+    headings = re.findall(r'^#{2,3}\s+(.+)$', notes, re.M)
+    summary_words = set(re.findall(r"[a-z0-9]+", summary.lower()))
+    covered = [h for h in headings if set(w for w in re.findall(r"[a-z0-9]+", h.lower()) if len(w) > 3) & summary_words]
+    return len(covered) / len(headings) if headings else 0.0
+
+
+def load_pairs_from_database(path, limit):
+    """(topic, notes, llm_summary) rows from an existing study_plan.db (shared content and own copies)."""
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute("""
+            SELECT topic, notes, summary FROM generated_content WHERE notes IS NOT NULL AND summary IS NOT NULL
+            UNION ALL
+            SELECT topic, notes, summary FROM saved_session WHERE content_id IS NULL AND notes IS NOT NULL AND summary IS NOT NULL
+            LIMIT ?
+        """, (limit,)).fetchall()
+    finally:
+        conn.close()
+    return [row for row in rows if not row[1].startswith("Error")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the local extractive summary with the LLM summary.")
+    parser.add_argument('--database', help="Use notes and stored LLM summaries from this SQLite file")
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--sections', type=int, default=8, help="Sections per synthetic note")
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=0.10)
+    parser.add_argument('--fail-on-regression', action='store_true')
+    add_fake_service_arguments(parser)
+    args = parser.parse_args()
+
+    if not args.database:
+        gemini_url, youtube_url, _ = start_fake_services(
+            latency=args.latency, token_rate=args.token_rate, youtube_latency=args.youtube_latency, seed=args.seed)
+        os.environ['GEMINI_API_ENDPOINT'] = gemini_url
+        os.environ['YOUTUBE_API_ENDPOINT'] = youtube_url
+
+    from bench.micro import load_app, time_calls
+    app = load_app()
+    if app.np is None:
+        print("NumPy is not installed; the local summarizer is unavailable.")
+        return 1
+
+    if args.database:
+        pairs = load_pairs_from_database(args.database, args.limit)
+    else:
+        pairs = [(topic, make_notes(topic, sections=args.sections), None) for topic in DEFAULT_TOPICS[:args.limit]]
+
+    local_samples, llm_samples = [], []
+    rouge1, rouge2, local_coverage, llm_coverage, local_ratio, llm_ratio = [], [], [], [], [], []
+    skipped = 0
+    for topic, notes, llm_summary in pairs:
+        local_samples.extend(time_calls(lambda: app.summarize_notes_locally(notes), 3))
+        local_summary = app.summarize_notes_locally(notes)
+        if local_summary is None:
+            skipped += 1
+            continue
+        if llm_summary is None:
+            started = time.perf_counter()
+            llm_summary = app.generate_gemini_content(app.build_summary_prompt(topic), 'summary')
+            llm_samples.append(time.perf_counter() - started)
+        rouge1.append(rouge_f1(local_summary, llm_summary, 1))
+        rouge2.append(rouge_f1(local_summary, llm_summary, 2))
+        local_coverage.append(heading_coverage(local_summary, notes))
+        llm_coverage.append(heading_coverage(llm_summary, notes))
+        local_ratio.append(len(local_summary) / len(notes))
+        llm_ratio.append(len(llm_summary) / len(notes))
+
+    results = {"local_summary": summarize(local_samples, elapsed=sum(local_samples))}
+    if llm_samples:
+        results["llm_summary_call"] = summarize(llm_samples, elapsed=sum(llm_samples))
+    print_table(results, "Summary latency")
+
+    mean = lambda values: sum(values) / len(values) if values else 0.0
+    print(f"\nQuality over {len(rouge1)} notes ({skipped} too short for a local summary)")
+    print(f"  ROUGE-1 F1 local vs LLM:   {mean(rouge1):.3f}")
+    print(f"  ROUGE-2 F1 local vs LLM:   {mean(rouge2):.3f}")
+    print(f"  Heading coverage:          local {mean(local_coverage):.0%}   LLM {mean(llm_coverage):.0%}")
+    print(f"  Length / notes length:     local {mean(local_ratio):.1%}   LLM {mean(llm_ratio):.1%}")
+    if not args.database:
+        print("  (The fake LLM's summaries are placeholder text; use --database for a meaningful quality comparison.)")
+
+    if args.save_baseline:
+        save_baseline('summary', results)
+        return 0
+    regressions = compare_to_baseline('summary', results, args.threshold)
+    return 1 if (regressions and args.fail_on_regression) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
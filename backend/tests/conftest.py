@@ -0,0 +1,21 @@
+import contextlib
+import os
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# app.py configures the APIs and creates the database at import; give it dummy keys and a throwaway DB
+os.environ.setdefault('GEMINI_API_KEY', 'test')
+os.environ.setdefault('YOUTUBE_API_KEY', 'test')
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db'))
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        import app
+    return app
@@ -0,0 +1,71 @@
+"""DELETE /api/user/me removes the account's rows through ON DELETE CASCADE and the triggers on them."""
+import uuid
+
+from sqlalchemy import text
+
+
+def make_user(app, password):
+    user = app.User(username=f"user-{uuid.uuid4().hex[:8]}", password_hash=app.bcrypt.generate_password_hash(password, 4).decode('utf-8'))
+    app.db.session.add(user)
+    app.db.session.commit()
+    return user
+
+
+def make_content(app, topic):
+    content = app.GeneratedContent(content_key=uuid.uuid4().hex, topic=topic, notes=f"# {topic}\n\nNotes.")
+    app.db.session.add(content)
+    app.db.session.commit()
+    return content
+
+
+def test_delete_account_cascades(app_module):
+    app = app_module
+    with app.app.app_context():
+        doomed, other = make_user(app, "secret-1"), make_user(app, "secret-2")
+        shared, private = make_content(app, "shared topic"), make_content(app, "private topic")
+        sessions = [app.SavedSession(topic="shared topic", user_id=doomed.id, content_id=shared.id) for _ in range(3)]
+        sessions.append(app.SavedSession(topic="private topic", user_id=doomed.id, content_id=private.id))
+        sessions.append(app.SavedSession(topic="own notes", notes="Mitochondria", user_id=doomed.id))
+        kept = app.SavedSession(topic="shared topic", user_id=other.id, content_id=shared.id)
+        app.db.session.add_all(sessions + [kept, app.StudyPlanEntry(topic="Review", review_date="2026-01-01", user_id=doomed.id)])
+        app.db.session.commit()
+        doomed_id, session_ids, kept_id = doomed.id, [s.id for s in sessions], kept.id
+        shared_id, private_id = shared.id, private.id
+        assert app.db.session.get(app.GeneratedContent, shared_id).ref_count == 4
+        token = app.create_access_token(identity=str(doomed_id))
+
+    client = app.app.test_client()
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.delete('/api/user/me', json={"password": "wrong"}, headers=headers).status_code == 401
+    assert client.delete('/api/user/me', json={"password": "secret-1"}, headers=headers).status_code == 200
+
+    with app.app.app_context():
+        db = app.db
+        assert db.session.get(app.User, doomed_id) is None
+        assert app.SavedSession.query.filter_by(user_id=doomed_id).count() == 0
+        assert app.StudyPlanEntry.query.filter_by(user_id=doomed_id).count() == 0
+        assert app.StudyPlanTombstone.query.filter_by(user_id=doomed_id).count() == 0
+        fts_rows = db.session.execute(text(
+            f"SELECT count(*) FROM {app.SEARCH_INDEX_TABLE} WHERE rowid IN ({', '.join(map(str, session_ids))})"
+        )).scalar()
+        assert fts_rows == 0
+        assert db.session.get(app.GeneratedContent, shared_id).ref_count == 1
+        assert db.session.get(app.GeneratedContent, private_id) is None
+        assert db.session.get(app.SavedSession, kept_id) is not None
+
+
+def test_delete_account_password_is_throttled(app_module, monkeypatch):
+    app = app_module
+    monkeypatch.setattr(app, 'LOGIN_MAX_FAILURES', 2)
+    with app.app.app_context():
+        user = make_user(app, "right")
+        token, username = app.create_access_token(identity=str(user.id)), user.username
+    client = app.app.test_client()
+    headers = {"Authorization": f"Bearer {token}"}
+    assert [client.delete('/api/user/me', json={"password": "guess"}, headers=headers).status_code for _ in range(2)] == [401, 401]
+    # Locked now: even the right password is refused, and so is login for the same username/IP
+    response = client.delete('/api/user/me', json={"password": "right"}, headers=headers)
+    assert response.status_code == 429 and int(response.headers['Retry-After']) > 0
+    assert client.post('/api/login', json={"username": username, "password": "right"}).status_code == 429
+    app.clear_login_failures((username, '127.0.0.1'))
+    assert client.delete('/api/user/me', json={"password": "right"}, headers=headers).status_code == 200
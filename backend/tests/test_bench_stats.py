@@ -0,0 +1,25 @@
+import pytest
+
+from bench.stats import percentile, summarize
+
+
+@pytest.mark.parametrize("n, pct, expected_rank", [
+    (10, 50, 5), (10, 90, 9), (10, 100, 10), (10, 1, 1),
+    (100, 95, 95), (100, 99, 99), (100, 7, 7), (20, 95, 19), (3, 50, 2), (1, 99, 1),
+])
+def test_percentile_is_nearest_rank(n, pct, expected_rank):
+    samples = list(range(1, n + 1)) # Sample value == its 1-based rank
+    assert percentile(samples, pct) == expected_rank
+
+
+def test_percentile_empty():
+    assert percentile([], 50) == 0.0
+
+
+def test_summarize():
+    summary = summarize([0.003, 0.001, 0.002, 0.004], elapsed=2.0)
+    assert summary["count"] == 4
+    assert summary["p50_ms"] == pytest.approx(2.0)
+    assert summary["p99_ms"] == pytest.approx(4.0)
+    assert summary["mean_ms"] == pytest.approx(2.5)
+    assert summary["throughput_per_s"] == 2.0
@@ -0,0 +1,172 @@
+"""Pure helpers in app.py: AI response parsing, exports, note splitting, encoding, iCalendar output, HTML rendering and telemetry."""
+import contextlib
+import io
+import json
+import re
+
+import pytest
+
+QUESTION = {"question": "What is ATP?", "options": ["a", "b", "c", "d"], "correct_answer": "a", "explanation": "e"}
+
+
+# --- parse_quiz_response ---
+def test_parse_quiz_extracts_list_from_surrounding_text(app_module):
+    raw = "Here is your quiz:\n```json\n" + json.dumps([QUESTION, QUESTION]) + "\n```\nGood luck!"
+    assert app_module.parse_quiz_response(raw) == [QUESTION, QUESTION]
+
+
+def test_parse_quiz_wraps_single_object(app_module):
+    assert app_module.parse_quiz_response(json.dumps(QUESTION)) == [QUESTION]
+
+
+def test_parse_quiz_rejects_missing_keys(app_module):
+    with pytest.raises(ValueError, match="explanation"):
+        app_module.parse_quiz_response(json.dumps([{k: v for k, v in QUESTION.items() if k != "explanation"}]))
+
+
+def test_parse_quiz_rejects_text_without_json(app_module):
+    with pytest.raises(ValueError):
+        app_module.parse_quiz_response("Sorry, I can't help with that.")
+
+
+# --- parse_flashcards_response / flashcards_to_csv ---
+def test_parse_flashcards(app_module):
+    cards = [{"term": "ATP", "definition": "Energy currency"}]
+    assert app_module.parse_flashcards_response("Cards: " + json.dumps(cards)) == cards
+
+
+def test_parse_flashcards_rejects_missing_keys(app_module):
+    with pytest.raises(ValueError, match="definition"):
+        app_module.parse_flashcards_response(json.dumps([{"term": "ATP"}]))
+
+
+def test_flashcards_to_csv_quotes_and_escapes(app_module):
+    csv_text = app_module.flashcards_to_csv([{"term": 'The "cell"', "definition": "a, b"}, {"term": "x"}])
+    assert csv_text.split("\n") == ['"Term","Definition"', '"The ""cell""","a, b"', '"x",""']
+
+
+# --- split_notes_sections ---
+def test_split_notes_short_notes_stay_whole(app_module):
+    assert app_module.split_notes_sections("# Short\n\nText.") == ["# Short\n\nText."]
+
+
+def test_split_notes_at_headings(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'NOTES_MAP_REDUCE_MIN_CHARS', 0)
+    monkeypatch.setattr(app_module, 'NOTES_SECTION_MIN_CHARS', 10)
+    notes = "# Title\n\n" + "".join(f"## Part {i}\n\n{'word ' * 5}\n\n" for i in range(3))
+    sections = app_module.split_notes_sections(notes)
+    assert "".join(sections) == notes
+    assert [section.split("\n")[0] for section in sections] == ["# Title", "## Part 1", "## Part 2"]
+    assert "## Part 0" in sections[0] # The short title section absorbs the next one
+
+
+def test_split_notes_ignores_headings_in_code(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'NOTES_MAP_REDUCE_MIN_CHARS', 0)
+    monkeypatch.setattr(app_module, 'NOTES_SECTION_MIN_CHARS', 0)
+    notes = "## A\n\ntext\n\n```\n# not a heading\n```\n\n## B\n\ntext\n"
+    assert app_module.split_notes_sections(notes) == ["## A\n\ntext\n\n```\n# not a heading\n```\n\n", "## B\n\ntext\n"]
+
+
+def test_split_notes_caps_section_count(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'NOTES_MAP_REDUCE_MIN_CHARS', 0)
+    monkeypatch.setattr(app_module, 'NOTES_SECTION_MIN_CHARS', 0)
+    monkeypatch.setattr(app_module, 'NOTES_MAX_SECTIONS', 3)
+    notes = "".join(f"## Part {i}\n\ntext\n\n" for i in range(10))
+    sections = app_module.split_notes_sections(notes)
+    assert len(sections) == 3 and "".join(sections) == notes
+
+
+# --- reduce_candidates ---
+def test_reduce_candidates_round_robin_and_dedupe(app_module):
+    per_section = [
+        [{"q": "what is mitosis"}, {"q": "what is meiosis"}],
+        [{"q": "What is mitosis?"}, {"q": "define osmosis"}], # Near-duplicate of section 1's first
+        [{"bad": "no key"}, {"q": "name the organelles"}],
+    ]
+    selected = app_module.reduce_candidates(per_section, 4, key=lambda c: c["q"], required_keys=["q"])
+    assert [c["q"] for c in selected] == ["what is mitosis", "define osmosis", "name the organelles", "what is meiosis"]
+
+
+def test_reduce_candidates_respects_limit(app_module):
+    per_section = [[{"q": f"question number {i} about topic {chr(97 + i)}"} for i in range(5)]]
+    assert len(app_module.reduce_candidates(per_section, 2, key=lambda c: c["q"], required_keys=["q"])) == 2
+
+
+# --- choose_content_encoding ---
+@pytest.mark.parametrize("header, candidates, expected", [
+    ("gzip, br", ["br", "gzip"], "br"),
+    ("gzip;q=1.0, br;q=0.5", ["br", "gzip"], "gzip"),
+    ("br;q=0, gzip;q=0", ["br", "gzip"], None),
+    ("*", ["br", "gzip"], "br"),
+    ("*;q=0.1, br;q=0", ["br", "gzip"], "gzip"),
+    ("", ["br", "gzip"], None),
+    ("gzip", ["br"], None),
+    ("gzip, br", [], None),
+    ("GZIP;q=bad, br", ["gzip"], None),
+])
+def test_choose_content_encoding(app_module, header, candidates, expected):
+    assert app_module.choose_content_encoding(header, candidates) == expected
+
+
+# --- ical_fold / ical_escape ---
+def test_ical_fold_short_line_unchanged(app_module):
+    assert app_module.ical_fold("SUMMARY:Short") == "SUMMARY:Short"
+
+
+@pytest.mark.parametrize("text", ["x" * 200, "é" * 120, "フォトシンセシス" * 20])
+def test_ical_fold_limits_octets_without_splitting_characters(app_module, text):
+    folded = app_module.ical_fold("SUMMARY:" + text)
+    lines = folded.split("\r\n")
+    assert all(len(line.encode("utf-8")) <= 75 for line in lines)
+    assert all(line.startswith(" ") for line in lines[1:])
+    assert lines[0] + "".join(line[1:] for line in lines[1:]) == "SUMMARY:" + text
+
+
+def test_ical_escape(app_module):
+    assert app_module.ical_escape("a;b,c\\d\r\ne") == "a\\;b\\,c\\\\d\\ne"
+
+
+# --- render_markdown_html ---
+def test_render_markdown_html_follows_commonmark_and_gfm(app_module):
+    html = app_module.render_markdown_html("Key facts:\n* item\n  * nested\n\n~~old~~ and | a |\n\n| a | b |\n|--:|---|\n| 1 | 2 |\n")
+    assert "<p>Key facts:</p>\n<ul>\n<li>item\n<ul>\n<li>nested</li>" in html
+    assert "<s>old</s>" in html
+    assert '<td style="text-align:right">1</td>' in html
+
+
+@pytest.mark.parametrize("source", [
+    "<script>alert(1)</script>",
+    "[x](javascript:alert(1))",
+    "[x](jav&#x61;script:alert(1))",
+    '<img src=x onerror="alert(1)">',
+])
+def test_render_markdown_html_drops_active_content(app_module, source):
+    html = app_module.render_markdown_html(source)
+    assert re.findall(r"<(\w+)", html) == ["p"] # Raw HTML is escaped and the bad link isn't linked
+
+
+def test_render_markdown_html_never_embeds_remote_images(app_module):
+    html = app_module.render_markdown_html('See ![a *cell* diagram](https://tracker.example/p.png "t")')
+    assert html == "<p>See a cell diagram</p>\n"
+
+
+# --- nearest_rank_percentile / model_telemetry_snapshot ---
+@pytest.mark.parametrize("n", [1, 2, 3, 10, 19, 20, 21, 100, 500])
+@pytest.mark.parametrize("pct", [50, 95])
+def test_nearest_rank_percentile_matches_bench(app_module, n, pct):
+    from bench.stats import percentile
+    samples = [i / 10 for i in range(1, n + 1)]
+    assert app_module.nearest_rank_percentile(samples, pct) == percentile(samples, pct)
+
+
+def test_nearest_rank_percentile_empty(app_module):
+    assert app_module.nearest_rank_percentile([], 50) is None
+
+
+def test_model_telemetry_snapshot_percentiles(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, '_model_telemetry', {})
+    with contextlib.redirect_stdout(io.StringIO()):
+        for latency in range(20, 0, -1): # 1..20 seconds, recorded out of order
+            app_module.record_model_call('quiz', 'test-model', float(latency), None, True)
+    [row] = app_module.model_telemetry_snapshot()
+    assert (row["latency_p50_s"], row["latency_p95_s"]) == (10.0, 19.0) # int(n * pct) gave 11 and 20
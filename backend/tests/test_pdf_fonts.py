@@ -0,0 +1,56 @@
+"""The fpdf2 engine's font cache copies fpdf2's internal font objects; check it against the pinned release."""
+import datetime
+
+import pytest
+
+NOTES = "# Фотосинтез\n\n- **Chlorophyll** absorbs light\n- Η φωτοσύνθεση\n\n1. *Light* reactions\n\n`code` and a [link](https://example.org)\n"
+QUIZ = [{"question": "Where?", "options": ["Chloroplast", "Nucleus"], "correct_answer": "Chloroplast", "explanation": "Because."}]
+
+# TTFFont's slots when the cache was written. add_cached_font resets the per-document ones
+# (i, ttfont, subset, missing_glyphs, biggest_size_pt); any new slot needs reviewing there.
+TTFFONT_SLOTS = {
+    'i', 'type', 'name', 'desc', 'glyph_ids', '_hbfont', 'sp', 'ss', 'up', 'ut', 'cw', 'ttffile', 'fontkey',
+    'emphasis', 'scale', 'subset', 'cmap', 'ttfont', 'missing_glyphs', 'biggest_size_pt', 'color_font',
+    'unicode_range', 'palette_index', 'is_compressed', 'is_cff', 'is_cid_keyed', 'is_symbol', 'cff_ros',
+    'collection_font_number',
+}
+
+
+@pytest.fixture
+def fixed_date_pdf(app_module, monkeypatch):
+    """Makes draw_notes_pdf deterministic so outputs can be compared byte for byte."""
+    class FixedDatePDF(app_module.StudyNotesPDF):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.set_creation_date(datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc))
+    monkeypatch.setattr(app_module, 'StudyNotesPDF', FixedDatePDF)
+    return app_module
+
+
+@pytest.fixture
+def cached_fonts(app_module):
+    if not app_module.PDF_FONT_CACHE_ENABLED:
+        pytest.skip(f"font cache is only used with fpdf2 {app_module.PDF_FONT_CACHE_FPDF_VERSION}")
+
+
+def test_ttffont_layout_matches_cache(app_module, cached_fonts):
+    assert set(app_module.TTFFont.__slots__) == TTFFONT_SLOTS
+
+
+def test_cached_fonts_match_public_add_font(fixed_date_pdf, cached_fonts, monkeypatch):
+    app = fixed_date_pdf
+    # Another document first, so state leaking between copies of a template would show up
+    app.draw_notes_pdf("Other", "Plain *Latin* text only.", None)
+    cached = app.draw_notes_pdf("Photosynthesis", NOTES, QUIZ)
+    monkeypatch.setattr(app, 'PDF_FONT_CACHE_ENABLED', False)
+    uncached = app.draw_notes_pdf("Photosynthesis", NOTES, QUIZ)
+    assert cached == uncached
+
+
+def test_core_font_fallback_handles_non_latin1(fixed_date_pdf, monkeypatch):
+    app = fixed_date_pdf
+    if app.FPDF is None:
+        pytest.skip("fpdf2 is not installed")
+    monkeypatch.setattr(app, 'PDF_FONT_DIR', '/nonexistent')
+    monkeypatch.setattr(app, '_pdf_font_templates', {})
+    assert app.draw_notes_pdf("Фотосинтез", NOTES, QUIZ).startswith(b'%PDF')
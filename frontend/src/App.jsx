@@ -1,10 +1,10 @@
 import React, { useState, useRef, useEffect, useCallback } from 'react';
-import axios from 'axios';
 
 import { Routes, Route, Navigate, useNavigate } from 'react-router-dom';
 import { useAuth } from './context/useAuth'; // Import useAuth
 import LoginPage from './pages/LoginPage'; // Import Login page
 import RegisterPage from './pages/RegisterPage'; // Import Register page
+import { mergePlanEntries } from './studyPlan';
 import MenuIcon from '@mui/icons-material/Menu'; // Sandwich icon
 import AccountCircle from '@mui/icons-material/AccountCircle'; // User icon
 import ChatIcon from '@mui/icons-material/Chat'; // Icon for chatbot FAB
@@ -89,12 +89,13 @@ function ProtectedRoute({ children }) {
   return children;
 }
 
-
 export default function App() {
   // --- State Variables ---
   const [topic, setTopic] = useState('');
   const [notes, setNotes] = useState('');
   const [summary, setSummary] = useState('');
+  const [notesHtml, setNotesHtml] = useState(''); // Sanitized HTML rendered by the backend at save time
+  const [summaryHtml, setSummaryHtml] = useState('');
   const [videos, setVideos] = useState([]);
   const [isLoading, setIsLoading] = useState(false); // Loading for main content
   const [error, setError] = useState(null); // Error for main content fetch
@@ -125,6 +126,7 @@ export default function App() {
   const [newPlanDate, setNewPlanDate] = useState(null); // Store date object from picker
   const [planLoading, setPlanLoading] = useState(false);
   const [planError, setPlanError] = useState(null);
+  const planRevisionRef = useRef(0); // Last study-plan revision synced from the server (0 = nothing yet)
 
   // --- Chatbot State ---
   const [chatHistory, setChatHistory] = useState([]); // Array of { sender: 'user'|'ai', text: '...' }
@@ -189,8 +191,11 @@ export default function App() {
     setPlanLoading(true);
     setPlanError(null);
     try {
-        const response = await apiClient.get('/study-plan'); // Use apiClient
-        setStudyPlanEntries(response.data || []);
+        // Only entries changed (and ids deleted) since the last sync come back
+        const response = await apiClient.get('/study-plan', { params: { since: planRevisionRef.current } });
+        const { revision, full, entries, deleted } = response.data;
+        setStudyPlanEntries((prev) => mergePlanEntries(full ? [] : prev, entries, deleted));
+        planRevisionRef.current = revision;
     } catch (err) {
         console.error("Error fetching study plan:", err);
         setPlanError(err.response?.data?.error || err.message || "Failed to fetch study plan.");
@@ -226,7 +231,7 @@ export default function App() {
   setDrawerOpen(false); // Close drawer after selection
 
   // Clear potentially stale data from previous session first
-  setNotes(''); setSummary(''); setVideos([]); setQuizQuestions([]); setFlashcards([]); setChatHistory([]); // Clear chat too
+  setNotes(''); setSummary(''); setNotesHtml(''); setSummaryHtml(''); setVideos([]); setQuizQuestions([]); setFlashcards([]); setChatHistory([]); // Clear chat too
   setQuizCompleted(false); setQuizError(null); setFlashcardsError(null); setPdfError(null); setChatError(null); // Clear errors
 
   try {
@@ -237,6 +242,8 @@ export default function App() {
       setTopic(sessionData.topic || '');
       setNotes(sessionData.notes || '');
       setSummary(sessionData.summary || '');
+      setNotesHtml(sessionData.notes_html || '');
+      setSummaryHtml(sessionData.summary_html || '');
       setVideos(sessionData.videos || []);
       setQuizQuestions(sessionData.quizQuestions || []);
       setFlashcards(sessionData.flashcards || []);
@@ -282,6 +289,8 @@ export default function App() {
     setTopic('');
     setNotes('');
     setSummary('');
+    setNotesHtml('');
+    setSummaryHtml('');
     setVideos([]);
     setQuizQuestions([]);
     setFlashcards([]);
@@ -296,7 +305,7 @@ export default function App() {
     setPlanError(null); // Clear planner error too
     // Close drawer if open
     setDrawerOpen(false);
-  }, [setTopic, setNotes, setSummary, setVideos, setQuizQuestions, setFlashcards, setChatHistory, setCurrentSessionId, setError, setQuizError, setFlashcardsError, setPdfError, setChatError, setPlanError, setDrawerOpen]);
+  }, [setTopic, setNotes, setSummary, setNotesHtml, setSummaryHtml, setVideos, setQuizQuestions, setFlashcards, setChatHistory, setCurrentSessionId, setError, setQuizError, setFlashcardsError, setPdfError, setChatError, setPlanError, setDrawerOpen]);
 
   const handleGetContent = () => {
     if (!topic.trim()) {
@@ -313,11 +322,13 @@ export default function App() {
   
     apiClient.post('/get-content', { topic: topic })
       .then(response => {
-        const { session_id, topic: resTopic, notes, summary, videos } = response.data;
+        const { session_id, topic: resTopic, notes, summary, notes_html, summary_html, videos } = response.data;
   
         setTopic(resTopic || topic); // Update topic if backend modified it
         setNotes(notes || "No notes generated.");
         setSummary(summary || "No summary generated.");
+        setNotesHtml(notes_html || '');
+        setSummaryHtml(summary_html || '');
         setVideos(videos || []);
         setCurrentSessionId(session_id); // Store new session ID
   
@@ -351,7 +362,8 @@ export default function App() {
   
     apiClient.post('/generate-quiz', {
       notes: notes,
-      session_id: currentSessionId // Send current session ID
+      session_id: currentSessionId, // Send current session ID
+      regenerate: quizQuestions.length > 0 // Already have one: ask for a fresh set, not the stored one
     })
       .then(response => {
         if (response.data && Array.isArray(response.data) && response.data.length > 0) {
@@ -435,7 +447,8 @@ export default function App() {
 
     apiClient.post('/generate-quiz', {
         notes: notes,
-        session_id: currentSessionId // Send current session ID to update it
+        session_id: currentSessionId, // Send current session ID to update it
+        regenerate: true
     })
     .then(response => {
         if (response.data && Array.isArray(response.data) && response.data.length > 0) {
@@ -470,10 +483,11 @@ export default function App() {
     const pdfData = {
       topic: topic || 'Study Notes',
       notes: notes,
-      quizQuestions: quizQuestions // Send quiz data (backend will handle Q&A extraction)
+      quizQuestions: quizQuestions, // Send quiz data (backend will handle Q&A extraction)
+      session_id: currentSessionId // Lets the backend reuse the HTML it stored for this session
     };
 
-    axios.post('http://127.0.0.1:5000/api/generate-pdf', pdfData, {
+    apiClient.post('/generate-pdf', pdfData, {
       responseType: 'blob', // Expect binary file data
     })
       .then(response => {
@@ -533,7 +547,8 @@ export default function App() {
   
     apiClient.post('/generate-flashcards', {
       notes: notes,
-      session_id: currentSessionId // Send current session ID
+      session_id: currentSessionId, // Send current session ID
+      regenerate: flashcards.length > 0
     })
       .then(response => {
         if (response.data && Array.isArray(response.data)) {
@@ -589,7 +604,7 @@ export default function App() {
     // Consider adding a loading state specific to download if needed
     setFlashcardsError(null);
 
-    axios.post('http://127.0.0.1:5000/api/download-flashcards',
+    apiClient.post('/download-flashcards',
       {
         flashcards: flashcards, // Send the array of flashcards
         topic: topic || 'flashcards' // Send topic for filename
@@ -659,9 +674,7 @@ export default function App() {
       review_date: formattedDate
   })
     .then(() => {
-        // Add the new entry to the state immediately (optimistic update or refetch)
-        // Refetching is simpler:
-        fetchStudyPlan(); // Refetch the whole list
+        fetchStudyPlan(); // Fetches just the changes since the last sync
         setNewPlanDate(null); // Clear the date picker
     })
     .catch(err => {
@@ -681,7 +694,7 @@ export default function App() {
     setPlanError(null);
     apiClient.delete(`/study-plan/${id}`)
         .then(() => {
-            fetchStudyPlan(); // Refetch the list after deletion
+            fetchStudyPlan(); // Picks up the deletion (and anything else changed) as a delta
         })
         .catch(err => {
           console.error("Error deleting study plan entry:", err);
@@ -702,6 +715,7 @@ useEffect(() => {
   } else {
      console.log("Not authenticated, clearing data..."); // Add log
      setStudyPlanEntries([]);
+     planRevisionRef.current = 0;
      setSessionHistory([]);
      handleNewSession();
   }
@@ -1097,7 +1111,12 @@ return (
                               '& pre': { whiteSpace: 'pre-wrap', wordBreak: 'break-word' },
                             }}
                           >
-                            <ReactMarkdown remarkPlugins={[remarkGfm]}>{notes}</ReactMarkdown>
+                            {notesHtml ? (
+                              // Pre-rendered and sanitized by the backend; skips client-side Markdown parsing
+                              <div dangerouslySetInnerHTML={{ __html: notesHtml }} />
+                            ) : (
+                              <ReactMarkdown remarkPlugins={[remarkGfm]}>{notes}</ReactMarkdown>
+                            )}
                           </Box>
                         </Grid>
                       )}
@@ -1130,7 +1149,11 @@ return (
                                   '& pre': { whiteSpace: 'pre-wrap', wordBreak: 'break-word' },
                                 }}
                               >
-                                <ReactMarkdown remarkPlugins={[remarkGfm]}>{summary}</ReactMarkdown>
+                                {summaryHtml ? (
+                                  <div dangerouslySetInnerHTML={{ __html: summaryHtml }} />
+                                ) : (
+                                  <ReactMarkdown remarkPlugins={[remarkGfm]}>{summary}</ReactMarkdown>
+                                )}
                               </Box>
                             </Box>
                           )}
@@ -3,8 +3,10 @@ import axios from 'axios';
 import { AuthContext } from './authContextDefinition';
 
 // Create the Axios instance for API calls
+// Same origin by default: the backend serves the built app (SERVE_FRONTEND), and `npm run dev`
+// proxies /api to it. Set VITE_API_BASE_URL only when the API lives on another origin.
 const apiClient = axios.create({
-    baseURL: 'http://127.0.0.1:5000/api' // Your backend API base URL
+    baseURL: import.meta.env.VITE_API_BASE_URL || '/api'
 });
 
 
@@ -0,0 +1,7 @@
+// Applies a study-plan delta: drops deleted ids, adds/replaces changed entries, keeps review-date order
+export function mergePlanEntries(current, changed, deletedIds) {
+  const byId = new Map(current.map((entry) => [entry.id, entry]));
+  deletedIds.forEach((id) => byId.delete(id));
+  changed.forEach((entry) => byId.set(entry.id, entry));
+  return [...byId.values()].sort((a, b) => a.review_date.localeCompare(b.review_date) || a.id - b.id);
+}
@@ -0,0 +1,27 @@
+import { test } from 'node:test';
+import assert from 'node:assert/strict';
+import { mergePlanEntries } from './studyPlan.js';
+
+const entry = (id, review_date, topic = `Topic ${id}`) => ({ id, review_date, topic });
+
+test('adds changed entries in review-date order, ties by id', () => {
+  const merged = mergePlanEntries([entry(2, '2026-10-02')], [entry(3, '2026-10-01'), entry(1, '2026-10-02')], []);
+  assert.deepEqual(merged.map((e) => e.id), [3, 1, 2]);
+});
+
+test('replaces an updated entry instead of duplicating it', () => {
+  const merged = mergePlanEntries([entry(1, '2026-10-01', 'Old')], [entry(1, '2026-10-05', 'New')], []);
+  assert.deepEqual(merged, [entry(1, '2026-10-05', 'New')]);
+});
+
+test('drops deleted ids, and a full resync starts from an empty list', () => {
+  const current = [entry(1, '2026-10-01'), entry(2, '2026-10-02')];
+  assert.deepEqual(mergePlanEntries(current, [], [1]).map((e) => e.id), [2]);
+  assert.deepEqual(mergePlanEntries([], [entry(5, '2026-10-09')], [1, 2]).map((e) => e.id), [5]);
+});
+
+test('does not mutate the current list', () => {
+  const current = [entry(1, '2026-10-01')];
+  mergePlanEntries(current, [entry(2, '2026-09-01')], [1]);
+  assert.deepEqual(current, [entry(1, '2026-10-01')]);
+});
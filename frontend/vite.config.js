@@ -1,7 +1,49 @@
 import { defineConfig } from 'vite'
 import react from '@vitejs/plugin-react'
+import fs from 'node:fs'
+import path from 'node:path'
+import zlib from 'node:zlib'
+
+const BACKEND_URL = process.env.BACKEND_URL || 'http://127.0.0.1:5000'
+const COMPRESSIBLE = /\.(js|mjs|css|html|svg|json|txt|map|ico)$/
+const MIN_COMPRESS_SIZE = 1024
+
+// Writes .gz and .br next to every compressible build file so the backend can send them
+// as-is (picked by Accept-Encoding) instead of compressing on each request.
+function precompress() {
+  let outDir
+  return {
+    name: 'precompress',
+    apply: 'build',
+    configResolved(config) {
+      outDir = path.resolve(config.root, config.build.outDir)
+    },
+    closeBundle() {
+      const walk = (dir) => fs.readdirSync(dir, { withFileTypes: true }).flatMap((entry) =>
+        entry.isDirectory() ? walk(path.join(dir, entry.name)) : [path.join(dir, entry.name)])
+      for (const file of walk(outDir)) {
+        if (!COMPRESSIBLE.test(file)) continue
+        const data = fs.readFileSync(file)
+        if (data.length < MIN_COMPRESS_SIZE) continue
+        fs.writeFileSync(`${file}.gz`, zlib.gzipSync(data, { level: 9 }))
+        fs.writeFileSync(`${file}.br`, zlib.brotliCompressSync(data, {
+          params: {
+            [zlib.constants.BROTLI_PARAM_QUALITY]: zlib.constants.BROTLI_MAX_QUALITY,
+            [zlib.constants.BROTLI_PARAM_SIZE_HINT]: data.length,
+          },
+        }))
+      }
+    },
+  }
+}
 
 // https://vite.dev/config/
 export default defineConfig({
-  plugins: [react()],
+  plugins: [react(), precompress()],
+  server: {
+    // Same-origin /api in development too, so authenticated calls need no CORS preflight
+    proxy: {
+      '/api': BACKEND_URL,
+    },
+  },
 })